@@ -5,15 +5,17 @@ import List from "../components/List";
 
 export default function ShowResults() {
   const [resData, setResData] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchResults();
   }, []);
 
-  async function fetchResults() {
+  async function fetchResults(cursor = null) {
     try {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
       const response = await fetch(
-        `${process.env.REACT_APP_SERVER_URL}/api/results`,
+        `${process.env.REACT_APP_SERVER_URL}/api/results${query}`,
         {
           method: "GET",
           headers: {
@@ -24,11 +26,9 @@ export default function ShowResults() {
       if (response) {
         const data = await response.json();
         if (data) {
-          // sort descending by timestamp (latest first)
-          const sorted = data.data.sort(
-            (a, b) => new Date(b.timeStamp) - new Date(a.timeStamp)
-          );
-          setResData(sorted);
+          // pages arrive latest first; older pages are appended
+          setResData((prev) => (cursor ? [...prev, ...data.data] : data.data));
+          setNextCursor(data.next_cursor);
         }
       }
     } catch (e) {
@@ -70,7 +70,7 @@ export default function ShowResults() {
         <Heading fontSize={60} color={"rgba(43, 18, 230, 0.82)"}>
           RESULTS
         </Heading>
-        <Box><Button colorScheme={'green'} onClick={fetchResults}>Refresh</Button></Box>
+        <Box><Button colorScheme={'green'} onClick={() => fetchResults()}>Refresh</Button></Box>
         {resData &&
           resData.map((item, key) => (
             <List
@@ -79,6 +79,11 @@ export default function ShowResults() {
               text={formatDate(item.timeStamp)}
             />
           ))}
+        {nextCursor && (
+          <Box paddingBottom={4}>
+            <Button colorScheme={'blue'} onClick={() => fetchResults(nextCursor)}>Load more</Button>
+          </Box>
+        )}
       </VStack>
     </Box>
   );
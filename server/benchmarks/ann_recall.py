@@ -0,0 +1,104 @@
+"""
+Recall@1 and latency of the IVF index against exact gallery search.
+
+Run from the server/ directory:
+    python -m benchmarks.ann_recall --students 50000 --probes 4 8 16 32
+
+Uses synthetic ArcFace-like embeddings by default, scaled to varying lengths
+for --metric euclidean; pass --embeddings with an .npz holding an
+`embeddings` (N, 512) array to measure on a real gallery.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from utils.ann import IVFIndex
+from utils.deepface import get_threshold
+from utils.gallery import GalleryIndex
+
+
+def synthetic_gallery(num_students, dim=512, num_groups=64, seed=0):
+    """Unit vectors drawn around a few shared directions, like real face embeddings."""
+    rng = np.random.default_rng(seed)
+    groups = rng.normal(size=(num_groups, dim))
+    members = groups[rng.integers(num_groups, size=num_students)]
+    embeddings = members + 1.5 * rng.normal(size=(num_students, dim))
+    return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype(np.float32)
+
+
+def make_queries(embeddings, num_queries, noise, seed=1):
+    """Perturbed copies of random gallery rows, i.e. new photos of enrolled students."""
+    rng = np.random.default_rng(seed)
+    targets = rng.choice(len(embeddings), num_queries, replace=False)
+    queries = embeddings[targets] + noise * rng.normal(size=(num_queries, embeddings.shape[1])) / np.sqrt(
+        embeddings.shape[1]
+    )
+    return queries.astype(np.float32)
+
+
+def timed_search(gallery, queries, metric, threshold):
+    start = time.perf_counter()
+    results = gallery.search(queries, distance_metric=metric, threshold=threshold, top_k=1)
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=1.2, help="Query perturbation (1.2 ~ cosine distance 0.4)")
+    parser.add_argument("--lists", type=int, default=None, help="IVF cells (default 4 * sqrt(N))")
+    parser.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--metric", default="cosine", choices=["cosine", "euclidean", "euclidean_l2"])
+    parser.add_argument("--embeddings", help=".npz file with an `embeddings` array")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        with np.load(args.embeddings) as data:
+            embeddings = data["embeddings"].astype(np.float32)
+    else:
+        embeddings = synthetic_gallery(args.students)
+    noise = args.noise
+    if args.metric == "euclidean" and not args.embeddings:
+        # Raw ArcFace embeddings are not unit length; euclidean ranks by both
+        lengths = np.random.default_rng(2).uniform(15, 30, size=(len(embeddings), 1))
+        embeddings = (embeddings * lengths).astype(np.float32)
+        noise *= lengths.mean()
+    queries = make_queries(embeddings, min(args.queries, len(embeddings)), noise)
+    threshold = get_threshold("ArcFace", args.metric)
+    students = [{"roll_number": str(i), "name": str(i), "embedding": e} for i, e in enumerate(embeddings)]
+
+    exact = GalleryIndex()
+    exact.load(students)
+    exact_results, exact_latency = timed_search(exact, queries, args.metric, threshold)
+    exact_ids = [r[0]["roll_number"] for r in exact_results]
+    exact_verified = [r[0]["verified"] for r in exact_results]
+
+    start = time.perf_counter()
+    index = IVFIndex(n_lists=args.lists)
+    index.rebuild([s["roll_number"] for s in students], embeddings)
+    build_seconds = time.perf_counter() - start
+
+    print(f"gallery={len(embeddings)} queries={len(queries)} metric={args.metric} threshold={threshold}")
+    print(f"IVF build: {build_seconds:.2f}s, {len(index.centroids)} cells")
+    print(f"exact: {exact_latency * 1000:.3f} ms/query")
+    print(f"{'n_probe':>8} {'recall@1':>9} {'verified agree':>15} {'ms/query':>9} {'speedup':>8}")
+
+    for n_probe in args.probes:
+        index.n_probe = n_probe
+        approx = GalleryIndex()
+        approx.load(students)
+        approx.attach_ann(index, min_size=0)
+        results, latency = timed_search(approx, queries, args.metric, threshold)
+
+        recall = np.mean([bool(r) and r[0]["roll_number"] == e for r, e in zip(results, exact_ids)])
+        agree = np.mean([(bool(r) and r[0]["verified"]) == v for r, v in zip(results, exact_verified)])
+        print(
+            f"{n_probe:>8} {recall:>9.4f} {agree:>15.4f} {latency * 1000:>9.3f} {exact_latency / latency:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
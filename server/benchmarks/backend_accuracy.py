@@ -0,0 +1,114 @@
+"""
+Verification agreement between the TensorFlow and ONNX ArcFace backends.
+
+Takes a held-out set laid out like a bulk import: a directory or zip of
+'<roll_number>_<name>.jpg' photos, several per person, not used to tune
+anything. The largest face of each photo is detected once and embedded by
+both backends, so only the recognizer differs. Run from the server/
+directory:
+    python -m benchmarks.backend_accuracy --images ../heldout --onnx-model models/arcface.onnx
+
+For every pair of faces, both backends' distances are compared against
+get_threshold("ArcFace", metric). The report covers:
+    - flips: pairs verified by one backend but not the other
+    - TAR and FAR: same-person pairs accepted, different-person pairs
+      accepted, for each backend
+    - per-face distance between the two backends' embeddings
+    - embedding time per face
+Exits 1 when the flip rate exceeds --max-flip-rate.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import utils.deepface as deepface
+from utils.deepface import (
+    bytes_to_cv2_image,
+    detect_faces,
+    get_embeddings_from_faces,
+    get_threshold,
+    pairwise_distances,
+)
+from utils.enrollment import RosterReader, list_roster_files, parse_roster_filename
+
+
+def load_faces(source):
+    """Largest face of every parsable photo. Returns (faces, identities)."""
+    faces, identities = [], []
+    with RosterReader(source) as roster:
+        for filename in list_roster_files(source):
+            parsed = parse_roster_filename(filename)
+            img = bytes_to_cv2_image(roster.read(filename)) if parsed else None
+            if img is None:
+                continue
+            detections = [d for d in detect_faces(img) if d.get("confidence", 0) > 0]
+            if not detections:
+                print(f"  no face in {filename}", file=sys.stderr)
+                continue
+            largest = max(detections, key=lambda d: d["facial_area"]["w"] * d["facial_area"]["h"])
+            faces.append(largest["face"])
+            identities.append(parsed[0])
+    return faces, np.array(identities)
+
+
+def timed_embed(faces, backend):
+    get_embeddings_from_faces(faces[:1], backend=backend)  # warm-up
+    start = time.perf_counter()
+    embeddings = get_embeddings_from_faces(faces, backend=backend).astype(np.float64)
+    return embeddings, (time.perf_counter() - start) * 1000 / len(faces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Held-out directory or zip of <roll_number>_<name>.jpg")
+    parser.add_argument("--onnx-model", default=deepface.ONNX_MODEL_PATH)
+    parser.add_argument("--metrics", nargs="+", default=["cosine", "euclidean_l2"])
+    parser.add_argument("--max-flip-rate", type=float, default=0.001, help="Allowed share of pairs that flip")
+    args = parser.parse_args()
+
+    deepface.ONNX_MODEL_PATH = args.onnx_model
+    faces, identities = load_faces(args.images)
+    if len(faces) < 2:
+        sys.exit("Need at least two faces in the held-out set")
+
+    reference, reference_ms = timed_embed(faces, "tensorflow")
+    candidate, candidate_ms = timed_embed(faces, "onnx")
+
+    unit_reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    unit_candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    drift = 1 - (unit_reference * unit_candidate).sum(axis=1)
+    print(f"{len(faces)} faces of {len(set(identities))} people")
+    print(f"embedding time: tensorflow {reference_ms:.1f} ms/face, onnx {candidate_ms:.1f} ms/face")
+    print(f"cosine distance tensorflow vs onnx per face: mean {drift.mean():.5f}, max {drift.max():.5f}")
+
+    upper = np.triu_indices(len(faces), k=1)
+    same = (identities[:, None] == identities[None, :])[upper]
+    failed = False
+    for metric in args.metrics:
+        threshold = get_threshold("ArcFace", metric)
+        verified_reference = pairwise_distances(reference, reference, metric)[upper] <= threshold
+        verified_candidate = pairwise_distances(candidate, candidate, metric)[upper] <= threshold
+        flips = int((verified_reference != verified_candidate).sum())
+        flip_rate = flips / len(same)
+
+        print(f"\n{metric} (threshold {threshold}): {len(same)} pairs, {int(same.sum())} same-person")
+        for name, verified in (("tensorflow", verified_reference), ("onnx", verified_candidate)):
+            tar = verified[same].mean() if same.any() else float("nan")
+            far = verified[~same].mean() if (~same).any() else float("nan")
+            print(f"  {name:>10}: TAR {tar:.4f}  FAR {far:.4f}")
+        print(f"  flips: {flips} ({flip_rate:.4%})")
+        if flip_rate > args.max_flip_rate:
+            failed = True
+            print(f"  FAIL: more than {args.max_flip_rate:.2%} of verification results changed")
+
+    if failed:
+        sys.exit(1)
+    print("\nVerification results preserved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Peak memory and latency of face detection on large classroom photos.
+
+Compares the plain path (full decode + detect_faces) with the reduced-
+resolution pyramid in detect_faces_from_bytes. Run from the server/ directory:
+    python -m benchmarks.detection --image ../samples/group-pic-1.jpg --megapixels 12 24 48
+
+Every measurement runs in a fresh process, after both models are warmed up
+on a small sample, so "peak RSS" is the extra memory the detection needed.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "samples")
+
+
+def make_large_image(source, megapixels, out_dir):
+    """Upscale `source` to roughly `megapixels` and save it as a JPEG."""
+    img = cv2.imread(source)
+    scale = (megapixels * 1e6 / (img.shape[0] * img.shape[1])) ** 0.5
+    large = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    path = os.path.join(out_dir, f"{megapixels}mp.jpg")
+    cv2.imwrite(path, large, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return path
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(mode, image_path):
+    """Runs inside the child process and prints one JSON line."""
+    from utils.deepface import bytes_to_cv2_image, detect_faces, detect_faces_from_bytes
+
+    detect_faces(cv2.imread(os.path.join(SAMPLES_DIR, "brad.jpg")))
+    baseline = peak_rss_mb()
+
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    start = time.perf_counter()
+    if mode == "plain":
+        detections = detect_faces(bytes_to_cv2_image(image_bytes))
+    else:
+        detections = detect_faces_from_bytes(image_bytes)
+    elapsed = time.perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "seconds": elapsed,
+                "peak_rss_mb": max(0.0, peak_rss_mb() - baseline),
+                "faces": sum(1 for d in detections if d.get("confidence")),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=os.path.join(SAMPLES_DIR, "group-pic-1.jpg"))
+    parser.add_argument("--megapixels", type=int, nargs="+", default=[12, 24, 48])
+    parser.add_argument("--measure", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    print(f"{'size':>6} {'path':>8} {'seconds':>8} {'peak RSS MB':>12} {'faces':>6}")
+    with tempfile.TemporaryDirectory() as out_dir:
+        for megapixels in args.megapixels:
+            path = make_large_image(args.image, megapixels, out_dir)
+            for mode in ("plain", "pyramid"):
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.detection", "--measure", mode, path],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{megapixels:>4}MP {mode:>8} {result['seconds']:>8.2f} "
+                    f"{result['peak_rss_mb']:>12.0f} {result['faces']:>6}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Per-pair find_distance loop versus the vectorized pairwise_distances kernel.
+
+Times Q faces against G students for each metric, the way matching used to
+work (one find_distance call per face and student, sorted in Python) and
+with pairwise_distances in float64 and float32, with and without cached
+gallery norms. Run from the server/ directory:
+    python -m benchmarks.distance --students 100 1000 10000 --faces 20
+
+Also checks equivalence on the same data, with noisy queries and exact
+duplicates of gallery rows: float64 distances must agree with find_distance
+after its 6-decimal rounding, and find_best_match and GalleryIndex.search
+must return the same top 5 as the per-pair loop. Exits 1 if a check fails.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.ann_recall import make_queries, synthetic_gallery
+from utils.deepface import find_best_match, find_distance, get_threshold, pairwise_distances
+from utils.gallery import GalleryIndex
+
+METRICS = ["cosine", "euclidean", "euclidean_l2"]
+
+
+def raw_embeddings(num_students, seed=0):
+    """Synthetic gallery rows scaled to ArcFace's unnormalized lengths, so euclidean differs from euclidean_l2."""
+    lengths = np.random.default_rng(seed).uniform(15, 30, size=(num_students, 1))
+    return (synthetic_gallery(num_students, seed=seed) * lengths).astype(np.float32)
+
+
+def per_pair_top_k(query, stored, metric, threshold, top_k=5):
+    """find_best_match as it was: one find_distance call per student, then a sort."""
+    matches = []
+    for roll_number, student in stored.items():
+        distance = find_distance(query, student["embedding"], metric)
+        matches.append({"roll_number": roll_number, "distance": distance, "verified": distance <= threshold})
+    matches.sort(key=lambda x: x["distance"])
+    return matches[:top_k]
+
+
+def best_of(fn, repeat):
+    """Fastest of `repeat` runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def check_equivalence(queries, gallery, metric):
+    """Returns (max |difference| after rounding, number of top-5 mismatches)."""
+    threshold = get_threshold("ArcFace", metric)
+    stored = {f"S{i:06d}": {"name": None, "embedding": row.tolist()} for i, row in enumerate(gallery)}
+    vectorized = np.round(pairwise_distances(queries, gallery, metric), 6)
+    index = GalleryIndex()
+    index.load_arrays(list(stored), [None] * len(gallery), gallery)
+    searched = index.search(queries, distance_metric=metric, threshold=threshold)
+
+    worst = 0.0
+    mismatches = 0
+    for q, query in enumerate(queries):
+        query = query.tolist()
+        for g in range(0, len(gallery), max(1, len(gallery) // 50)):
+            worst = max(worst, abs(vectorized[q, g] - find_distance(query, stored[f"S{g:06d}"]["embedding"], metric)))
+        expected = [(m["roll_number"], m["distance"]) for m in per_pair_top_k(query, stored, metric, threshold)]
+        actual = [(m["roll_number"], m["distance"]) for m in find_best_match(query, stored, metric, threshold)["all_matches"]]
+        mismatches += expected != actual
+        mismatches += expected != [(m["roll_number"], m["distance"]) for m in searched[q]]
+    return worst, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--faces", type=int, default=20, help="Query faces per image")
+    parser.add_argument("--metrics", nargs="+", default=METRICS, choices=METRICS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-loop-students", type=int, default=2000, help="Skip the slow loop above this")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'metric':>13} {'students':>9} {'per-pair ms':>12} {'f64 ms':>8} {'f32 ms':>8} {'f32+norms ms':>13}")
+    for metric in args.metrics:
+        for num_students in args.students:
+            gallery = raw_embeddings(num_students)
+            queries = make_queries(gallery, min(args.faces, num_students), noise=5.0)
+            norms = np.linalg.norm(gallery.astype(np.float64), axis=1)
+
+            loop_ms = float("nan")
+            if num_students <= args.max_loop_students:
+                stored = {f"S{i:06d}": {"embedding": row.tolist()} for i, row in enumerate(gallery)}
+                threshold = get_threshold("ArcFace", metric)
+                loop_ms = best_of(
+                    lambda: [per_pair_top_k(q.tolist(), stored, metric, threshold) for q in queries],
+                    max(1, args.repeat // 5),
+                )
+            f64_ms = best_of(lambda: pairwise_distances(queries, gallery, metric), args.repeat)
+            f32_ms = best_of(lambda: pairwise_distances(queries, gallery, metric, dtype=np.float32), args.repeat)
+            cached_ms = best_of(
+                lambda: pairwise_distances(queries, gallery, metric, gallery_norms=norms, dtype=np.float32),
+                args.repeat,
+            )
+            print(f"{metric:>13} {num_students:>9} {loop_ms:>12.1f} {f64_ms:>8.2f} {f32_ms:>8.2f} {cached_ms:>13.2f}")
+
+        gallery = raw_embeddings(min(args.students), seed=1)
+        # Exact duplicates must come out at distance 0, as from find_distance
+        queries = np.concatenate([make_queries(gallery, min(10, len(gallery)), noise=5.0), gallery[:3]])
+        worst, mismatches = check_equivalence(queries, gallery, metric)
+        status = "ok" if worst <= 1e-6 and mismatches == 0 else "FAIL"
+        failed |= status == "FAIL"
+        print(f"{metric:>13} equivalence: max difference {worst:.1e}, top-5 mismatches {mismatches}  {status}\n")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
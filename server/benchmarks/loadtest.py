@@ -0,0 +1,509 @@
+"""
+Load test of the production server under a classroom burst.
+
+Classes start on the hour, so most attendance photos arrive in the same
+minute. For each serving configuration this starts `gunicorn server:app`
+on an offline LocalStore (the Firestore stand-in; seeded with a synthetic
+gallery, analysis cache off) and replays open-loop traffic in phases of
+"seconds:requests per second", by default a quiet period, the
+start-of-period burst and a cool-down. Requests are drawn from a mix of:
+
+    analyse   POST /api/analyse with a classroom photo
+    upload    POST /api/upload_for_analyse, then poll /api/jobs/<id>
+    results   GET /api/results?limit=50
+    enroll    POST /api/students with a new roll number and one photo
+
+Run from the server/ directory:
+    python -m benchmarks.loadtest --mix analyse=4,upload=4,results=1,enroll=1 \\
+        --phases 20:0.5,30:6,20:0.5 \\
+        --config 4-threads:GUNICORN_THREADS=4 \\
+        --config 8-threads:GUNICORN_THREADS=8,INFERENCE_MAX_WAITING=8
+
+Each --config is NAME:KEY=VALUE,... of environment settings for that
+server. --model stub (the default) puts benchmarks/stub_deepface first on
+the server's path, a DeepFace stand-in with fixed CPU costs (STUB_DETECT_MS,
+STUB_EMBED_MS, ...; set them per config too), so queueing and memory can be
+compared without TensorFlow; --model real loads ArcFace and RetinaFace. To
+go through Firestore instead, run its emulator and add
+STORAGE_BACKEND=firestore,FIRESTORE_EMULATOR_HOST=localhost:8080 to a
+config (the gallery is then not seeded). --url runs the traffic against an
+already running server instead, with --server-pid for its memory.
+
+Arrivals are Poisson and latency is measured from each request's scheduled
+time, so a server that falls behind shows it in the tail rather than by
+slowing the clients down. An upload's latency runs until its job is done;
+with several workers the poll may reach one that does not know the job
+(jobs live in the worker that queued them), which is retried until
+--job-timeout. Reports throughput, p50/p95/p99 latency of successful
+requests, error rate and 503s (requests the server turned away) per
+configuration, phase and request kind, plus a per-second timeline with the
+memory of the whole gunicorn process tree. Exits 1 if a configuration's
+error rate is above --max-error-rate.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.serving import (
+    DEFAULT_IMAGES,
+    SAMPLES_DIR,
+    free_port,
+    seed_store,
+    start_server,
+    wait_ready,
+)
+
+STUB_DIR = os.path.join(os.path.dirname(__file__), "stub_deepface")
+DEFAULT_ENROLL_IMAGES = ["brad.jpg", "tom.jpg", "jagi_ref.jpg", "kanav_ref.jpg"]
+KINDS = ("analyse", "upload", "results", "enroll")
+
+
+# ==================== Traffic ====================
+
+def encode_form(fields, files):
+    """Encode text fields and (field, filename, data) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(
+            (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f"Content-Type: application/octet-stream\r\n\r\n"
+            ).encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def call(url, body=None, content_type=None, timeout=300):
+    """One request. Returns (status, parsed JSON body or None); status 0 if there was no response."""
+    headers = {"Content-Type": content_type} if content_type else {}
+    request = urllib.request.Request(url, data=body, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, data = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, data = e.code, e.read()
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return 0, None
+    try:
+        return status, json.loads(data)
+    except ValueError:
+        return status, None
+
+
+class Traffic:
+    """
+    Sends one request of a kind and returns its HTTP status. A finished
+    upload job counts as 200, a failed one as 500 and one still unfinished
+    after `job_timeout` seconds as 504.
+    """
+
+    def __init__(self, base_url, photos, enroll_photos, job_timeout=120, roll_prefix="LT"):
+        self.base_url = base_url
+        self.photos = photos
+        self.enroll_photos = enroll_photos
+        self.job_timeout = job_timeout
+        self.roll_prefix = roll_prefix
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def send(self, kind):
+        return getattr(self, kind)(self._next())
+
+    def analyse(self, n):
+        filename, data = self.photos[n % len(self.photos)]
+        body, content_type = encode_form({}, [("image", filename, data)])
+        return call(f"{self.base_url}/api/analyse", body, content_type)[0]
+
+    def upload(self, n):
+        filename, data = self.photos[n % len(self.photos)]
+        body, content_type = encode_form({}, [("image", filename, data)])
+        status, submitted = call(f"{self.base_url}/api/upload_for_analyse", body, content_type)
+        if status != 202:
+            return status
+        deadline = time.perf_counter() + self.job_timeout
+        while time.perf_counter() < deadline:
+            time.sleep(0.25)
+            status, job = call(f"{self.base_url}{submitted['status_url']}", timeout=30)
+            if status == 200 and job["status"] in ("done", "failed"):
+                return 200 if job["status"] == "done" else 500
+        return 504
+
+    def results(self, n):
+        return call(f"{self.base_url}/api/results?limit=50")[0]
+
+    def enroll(self, n):
+        filename, data = self.enroll_photos[n % len(self.enroll_photos)]
+        fields = {"name": f"Load Test {n}", "roll_number": f"{self.roll_prefix}{n:06d}"}
+        body, content_type = encode_form(fields, [("image", filename, data)])
+        return call(f"{self.base_url}/api/students", body, content_type)[0]
+
+    def _next(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+
+def parse_mix(text):
+    """"analyse=4,upload=1" -> {"analyse": 0.8, "upload": 0.2}"""
+    weights = {}
+    for entry in text.split(","):
+        kind, _, weight = entry.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown request kind {kind!r}; expected one of {', '.join(KINDS)}")
+        weights[kind] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("The mix needs a positive weight")
+    return {kind: weight / total for kind, weight in weights.items() if weight > 0}
+
+
+def parse_phases(text):
+    """"20:0.5,30:6" -> [(20.0, 0.5), (30.0, 6.0)] as (seconds, requests per second)"""
+    try:
+        phases = [tuple(float(value) for value in entry.split(":")) for entry in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Phases must be seconds:rate,..., got {text!r}")
+    if any(len(phase) != 2 or phase[0] <= 0 or phase[1] < 0 for phase in phases):
+        raise argparse.ArgumentTypeError(f"Phases must be seconds:rate,..., got {text!r}")
+    return phases
+
+
+def parse_config(text):
+    """"2-workers:WEB_CONCURRENCY=2,GUNICORN_THREADS=8" -> ("2-workers", {...})"""
+    name, _, settings = text.partition(":")
+    env = {}
+    for entry in filter(None, settings.split(",")):
+        key, sep, value = entry.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Config settings must be KEY=VALUE, got {entry!r}")
+        env[key] = value
+    return name, env
+
+
+def schedule(phases, mix, seed):
+    """Poisson arrivals over the phases. Returns [(offset seconds, phase index, kind)]."""
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    arrivals, start = [], 0.0
+    for index, (seconds, rate) in enumerate(phases):
+        t = start
+        while rate > 0:
+            t += rng.expovariate(rate)
+            if t >= start + seconds:
+                break
+            arrivals.append((t, index, rng.choices(kinds, weights)[0]))
+        start += seconds
+    return arrivals
+
+
+# ==================== Server Memory ====================
+
+def process_tree(pid):
+    """`pid` and all its descendants, e.g. the gunicorn master, its workers and their helpers."""
+    children = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields after it are fixed
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[parent].append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children[current])
+    return tree
+
+
+def tree_memory_mb(pid):
+    """
+    (RSS, PSS) in MB summed over the process tree. RSS counts pages shared
+    copy-on-write by forked workers once per worker; PSS splits them between
+    the processes sharing them, so it is the memory the server really uses
+    (None where /proc/<pid>/smaps_rollup is unavailable).
+    """
+    rss, pss = 0, 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                rss += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except OSError:
+            continue
+        if pss is not None:
+            try:
+                with open(f"/proc/{member}/smaps_rollup") as f:
+                    pss += next((int(line.split()[1]) for line in f if line.startswith("Pss:")), 0)
+            except OSError:
+                pss = None
+    return rss / 1024, (pss / 1024 if pss is not None else None)
+
+
+# ==================== Run ====================
+
+def run(traffic, arrivals, server_pid=None, max_clients=256):
+    """
+    Replay `arrivals`. Returns the request records and the per-second
+    samples of requests in flight and server memory.
+    """
+    records, samples = [], []
+    in_flight = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+    start = time.perf_counter()
+
+    def request(offset, phase, kind):
+        with lock:
+            in_flight[0] += 1
+        try:
+            status = traffic.send(kind)
+        except Exception:
+            status = 0
+        finished = time.perf_counter() - start
+        with lock:
+            in_flight[0] -= 1
+            records.append(
+                {"kind": kind, "phase": phase, "finished": finished, "latency": finished - offset, "status": status}
+            )
+
+    def sample():
+        while not done.is_set():
+            rss, pss = tree_memory_mb(server_pid) if server_pid else (None, None)
+            with lock:
+                samples.append(
+                    {"t": time.perf_counter() - start, "in_flight": in_flight[0], "rss_mb": rss, "pss_mb": pss}
+                )
+            done.wait(1)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    with ThreadPoolExecutor(max_workers=max_clients) as pool:
+        for offset, phase, kind in arrivals:
+            delay = offset - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(request, offset, phase, kind)
+    done.set()
+    sampler.join()
+    return records, samples
+
+
+def summarize(records, seconds):
+    ok = np.array([r["latency"] for r in records if 200 <= r["status"] < 300])
+    errors = sum(1 for r in records if not 200 <= r["status"] < 300)
+
+    def percentile(q):
+        return round(float(np.percentile(ok, q) * 1000), 1) if len(ok) else None
+
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": errors,
+        "busy_503": sum(1 for r in records if r["status"] == 503),
+        "error_rate": errors / len(records) if records else 0.0,
+        "throughput_per_s": len(ok) / seconds if seconds else 0.0,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+    }
+
+
+def timeline(records, samples):
+    """Per second of the run: completions, errors, p95 latency of what finished, in flight and memory."""
+    seconds = int(max([r["finished"] for r in records] + [s["t"] for s in samples] + [0])) + 1
+    rows = [{"t": t, "completed": 0, "errors": 0, "p95_ms": None, "in_flight": None, "rss_mb": None, "pss_mb": None}
+            for t in range(seconds)]
+    latencies = defaultdict(list)
+    for r in records:
+        row = rows[int(r["finished"])]
+        row["completed"] += 1
+        if 200 <= r["status"] < 300:
+            latencies[row["t"]].append(r["latency"])
+        else:
+            row["errors"] += 1
+    for t, values in latencies.items():
+        rows[t]["p95_ms"] = round(float(np.percentile(values, 95) * 1000), 1)
+    for s in samples:
+        row = rows[int(s["t"])]
+        row["in_flight"] = s["in_flight"]
+        row["rss_mb"] = round(s["rss_mb"], 1) if s["rss_mb"] is not None else None
+        row["pss_mb"] = round(s["pss_mb"], 1) if s["pss_mb"] is not None else None
+    return rows
+
+
+def report(config_env, phases, records, samples, seconds):
+    memory = [s for s in samples if s["rss_mb"] is not None]
+    by_phase = defaultdict(list)
+    by_kind = defaultdict(list)
+    for r in records:
+        by_phase[r["phase"]].append(r)
+        by_kind[r["kind"]].append(r)
+    return {
+        "env": config_env,
+        "seconds": seconds,
+        "overall": summarize(records, seconds),
+        "by_phase": [
+            {"seconds": length, "rate_per_s": rate, **summarize(by_phase[index], length)}
+            for index, (length, rate) in enumerate(phases)
+        ],
+        "by_kind": {kind: summarize(rows, seconds) for kind, rows in sorted(by_kind.items())},
+        "peak_rss_mb": max((s["rss_mb"] for s in memory), default=None),
+        "peak_pss_mb": max((s["pss_mb"] for s in memory if s["pss_mb"] is not None), default=None),
+        "timeline": timeline(records, samples),
+    }
+
+
+def run_config(name, env, args, photos, enroll_photos, arrivals):
+    traffic_args = dict(job_timeout=args.job_timeout, roll_prefix=f"LT{uuid.uuid4().hex[:6]}-")
+    if args.url:
+        traffic = Traffic(args.url.rstrip("/"), photos, enroll_photos, **traffic_args)
+        start = time.perf_counter()
+        records, samples = run(traffic, arrivals, args.server_pid, args.max_clients)
+        return report(env, args.phases, records, samples, time.perf_counter() - start)
+
+    num_workers = int(env.get("WEB_CONCURRENCY", 1))
+    with tempfile.TemporaryDirectory() as directory:
+        server_env = {
+            "ENROLLMENT_IMAGE_DIR": os.path.join(directory, "enrollment_images"),
+            "RESULT_SPILL_DIR": os.path.join(directory, "result_spill"),
+            "WEB_CONCURRENCY": str(num_workers),
+        }
+        if args.model == "stub":
+            server_env["PYTHONPATH"] = os.pathsep.join(filter(None, [STUB_DIR, os.environ.get("PYTHONPATH")]))
+        server_env.update(env)
+        if server_env.get("STORAGE_BACKEND", "local") == "local":
+            seed_store(directory, args.students)
+
+        port = free_port()
+        log_path = os.path.join(directory, "gunicorn.log")
+        with open(log_path, "wb") as log:
+            process = start_server(num_workers, port, directory, log, server_env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                ready_seconds = wait_ready(process, base_url, num_workers, args.ready_timeout, log_path)
+                print(f"[{name}] ready in {ready_seconds:.1f}s, sending {len(arrivals)} requests")
+                traffic = Traffic(base_url, photos, enroll_photos, **traffic_args)
+                start = time.perf_counter()
+                records, samples = run(traffic, arrivals, process.pid, args.max_clients)
+                seconds = time.perf_counter() - start
+            finally:
+                process.terminate()
+                process.wait(timeout=60)
+
+    result = report(env, args.phases, records, samples, seconds)
+    result["ready_seconds"] = ready_seconds
+    return result
+
+
+def format_ms(value):
+    return f"{value:.0f}" if value is not None else "-"
+
+
+def print_config(name, result):
+    print(f"\n[{name}] {json.dumps(result['env'])}")
+    print(f"  {'':<14} {'req':>5} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err %':>6} {'503s':>5}")
+    rows = [(f"phase {i + 1} @{p['rate_per_s']:g}/s", p) for i, p in enumerate(result["by_phase"])]
+    rows += list(result["by_kind"].items())
+    for label, stats in rows:
+        print(
+            f"  {label:<14} {stats['requests']:>5} {stats['throughput_per_s']:>7.2f} {format_ms(stats['p50_ms']):>8} "
+            f"{format_ms(stats['p95_ms']):>8} {format_ms(stats['p99_ms']):>8} {stats['error_rate'] * 100:>6.1f} "
+            f"{stats['busy_503']:>5}"
+        )
+
+
+def print_comparison(results, burst):
+    print(f"\n{'config':<16} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err %':>6} {'503s':>5} "
+          f"{'burst p99':>10} {'burst err %':>11} {'peak RSS MB':>12} {'peak PSS MB':>12}")
+    for name, result in results.items():
+        stats, peak = result["overall"], result["by_phase"][burst]
+        rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "-"
+        pss = f"{result['peak_pss_mb']:.0f}" if result["peak_pss_mb"] is not None else "-"
+        print(
+            f"{name:<16} {stats['throughput_per_s']:>7.2f} {format_ms(stats['p50_ms']):>8} "
+            f"{format_ms(stats['p95_ms']):>8} {format_ms(stats['p99_ms']):>8} {stats['error_rate'] * 100:>6.1f} "
+            f"{stats['busy_503']:>5} {format_ms(peak['p99_ms']):>10} {peak['error_rate'] * 100:>11.1f} "
+            f"{rss:>12} {pss:>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", type=parse_config, action="append", help="NAME:KEY=VALUE,... (repeatable)")
+    parser.add_argument("--mix", type=parse_mix, default="analyse=4,upload=4,results=1,enroll=1")
+    parser.add_argument("--phases", type=parse_phases, default="20:0.5,30:6,20:0.5", help="seconds:rate,...")
+    parser.add_argument("--model", choices=["stub", "real"], default="stub")
+    parser.add_argument("--url", help="Send the traffic to this running server instead")
+    parser.add_argument("--server-pid", type=int, help="With --url, the server process whose memory to sample")
+    parser.add_argument("--students", type=int, default=1000, help="Synthetic gallery size")
+    parser.add_argument("--images", nargs="+", default=[os.path.join(SAMPLES_DIR, name) for name in DEFAULT_IMAGES])
+    parser.add_argument(
+        "--enroll-images", nargs="+", default=[os.path.join(SAMPLES_DIR, name) for name in DEFAULT_ENROLL_IMAGES]
+    )
+    parser.add_argument("--max-clients", type=int, default=256, help="Requests in flight at most")
+    parser.add_argument("--job-timeout", type=float, default=120, help="Seconds to wait for an upload's job")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-error-rate", type=float, help="Exit 1 if any config's error rate is above this")
+    parser.add_argument("--output", help="Write the report, with timelines, as JSON")
+    args = parser.parse_args()
+
+    configs = args.config or [
+        parse_config("4-threads:GUNICORN_THREADS=4"),
+        parse_config("8-threads:GUNICORN_THREADS=8"),
+    ]
+    if args.url:
+        configs = configs[:1] if args.config else [("external", {})]
+
+    def read(paths):
+        photos = []
+        for path in paths:
+            with open(path, "rb") as f:
+                photos.append((os.path.basename(path), f.read()))
+        return photos
+
+    photos, enroll_photos = read(args.images), read(args.enroll_images)
+    # Every configuration gets the same arrivals
+    arrivals = schedule(args.phases, args.mix, args.seed)
+    burst = max(range(len(args.phases)), key=lambda i: args.phases[i][1])
+
+    results = {}
+    for name, env in configs:
+        results[name] = run_config(name, env, args, photos, enroll_photos, arrivals)
+        print_config(name, results[name])
+    print_comparison(results, burst)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"mix": args.mix, "phases": args.phases, "model": args.model, "configs": results}, f, indent=2
+            )
+
+    if args.max_error_rate is not None:
+        failing = [name for name, result in results.items() if result["overall"]["error_rate"] > args.max_error_rate]
+        if failing:
+            print(f"\nError rate above {args.max_error_rate:.1%}: {', '.join(failing)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
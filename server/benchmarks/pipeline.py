@@ -0,0 +1,207 @@
+"""
+End-to-end timing of the /api/analyse pipeline, stage by stage.
+
+Runs the same steps as the route (hashing, detection, embedding, matching,
+result write and read) against a synthetic gallery in a throwaway
+LocalStore, so no Firestore credentials or network are needed.
+Run from the server/ directory:
+    python -m benchmarks.pipeline --students 1000 10000 --iterations 20
+    python -m benchmarks.pipeline --save-baseline baseline.json
+    python -m benchmarks.pipeline --baseline baseline.json  # exits 1 on regression
+
+Latency is wall time per stage (p50/p95 over iterations). Peak memory is
+measured in a separate traced pass so tracing does not skew the timings;
+it covers Python and NumPy allocations, not TensorFlow's own allocator.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.ann_recall import synthetic_gallery
+from utils.cache import AnalysisCache
+from utils.deepface import detect_faces_from_bytes, get_embeddings_from_faces, get_threshold
+from utils.gallery import GalleryIndex
+from utils.storage import LocalStore
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "samples")
+DEFAULT_IMAGES = ["group-pic-1.jpg", "brad_and_jennifer.jpg", "karan_auj.jpg"]
+STAGES = ["hash", "detect", "embed", "match", "store_write", "store_read"]
+
+
+def build_store(directory, num_students, planted):
+    """A LocalStore holding `num_students` synthetic students plus the `planted` real faces."""
+    store = LocalStore(directory)
+    embeddings = synthetic_gallery(num_students)
+    students = [
+        {"roll_number": f"S{i:06d}", "name": f"Student {i}", "embedding": row.tolist(), "samples": []}
+        for i, row in enumerate(embeddings)
+    ]
+    students += [
+        {"roll_number": f"P{i:03d}", "name": f"Planted {i}", "embedding": row.tolist(), "samples": []}
+        for i, row in enumerate(planted)
+    ]
+    for start in range(0, len(students), 1000):
+        store.save_students(students[start:start + 1000])
+    return store
+
+
+def run_once(image_bytes, gallery, store, timings):
+    """One pass of the analyse pipeline; appends each stage's seconds to `timings`."""
+
+    def stage(name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        value = fn(*args, **kwargs)
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+        return value
+
+    stage("hash", AnalysisCache().make_key, image_bytes)
+    detections = stage("detect", detect_faces_from_bytes, image_bytes)
+    embeddings = stage("embed", get_embeddings_from_faces, [d["face"] for d in detections])
+    matches = stage("match", gallery.search, embeddings, "cosine", get_threshold("ArcFace", "cosine"), 5)
+    document = {
+        "message": f"Detected {len(detections)} face(s)",
+        "matched_roll_numbers": [m[0]["roll_number"] for m in matches if m and m[0]["verified"]],
+        "faces": [{"face_box": d.get("facial_area"), "top_matches": m} for d, m in zip(detections, matches)],
+    }
+    stage("store_write", store.add_result, document)
+    stage("store_read", store.list_results, limit=50)
+
+
+def peak_memory(image_bytes, gallery, store):
+    """Peak traced allocation, in MB, of each stage in one extra pass."""
+    peaks = {}
+
+    def traced(name, fn, *args, **kwargs):
+        tracemalloc.start()
+        value = fn(*args, **kwargs)
+        peaks[name] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        return value
+
+    traced("hash", AnalysisCache().make_key, image_bytes)
+    detections = traced("detect", detect_faces_from_bytes, image_bytes)
+    embeddings = traced("embed", get_embeddings_from_faces, [d["face"] for d in detections])
+    traced("match", gallery.search, embeddings, "cosine", get_threshold("ArcFace", "cosine"), 5)
+    traced("store_write", store.add_result, {"message": "", "matched_roll_numbers": [], "faces": []})
+    traced("store_read", store.list_results, limit=50)
+    return peaks
+
+
+def summarize(timings, peaks):
+    report = {}
+    for name in STAGES:
+        seconds = np.array(timings[name])
+        report[name] = {
+            "p50_ms": float(np.percentile(seconds, 50) * 1000),
+            "p95_ms": float(np.percentile(seconds, 95) * 1000),
+            "peak_mb": peaks.get(name, 0.0),
+        }
+    total = np.sum([timings[name] for name in STAGES], axis=0)
+    report["total"] = {
+        "p50_ms": float(np.percentile(total, 50) * 1000),
+        "p95_ms": float(np.percentile(total, 95) * 1000),
+        "throughput_per_s": float(len(total) / total.sum()),
+    }
+    return report
+
+
+def benchmark(image_paths, num_students, iterations, warmup):
+    images = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    # Plant the real faces so matching does verified hits, not only misses
+    planted = np.concatenate(
+        [get_embeddings_from_faces([d["face"] for d in detect_faces_from_bytes(data)]) for data in images]
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = build_store(directory, num_students, planted)
+
+        start = time.perf_counter()
+        gallery = GalleryIndex()
+        gallery.load_arrays(*store.load_gallery())
+        gallery_load_ms = (time.perf_counter() - start) * 1000
+
+        for i in range(warmup):
+            run_once(images[i % len(images)], gallery, store, {})
+
+        timings = {}
+        for i in range(iterations):
+            run_once(images[i % len(images)], gallery, store, timings)
+
+        report = summarize(timings, peak_memory(images[0], gallery, store))
+        report["gallery_load"] = {"ms": gallery_load_ms}
+        return report
+
+
+def compare(results, baseline, tolerance):
+    """Print stages whose p50 or p95 got more than `tolerance` slower; return True if any did."""
+    regressed = False
+    for students, report in results.items():
+        for name, stats in report.items():
+            base = baseline.get(students, {}).get(name)
+            if not base:
+                continue
+            for key in ("p50_ms", "p95_ms", "ms"):
+                if key in stats and key in base and stats[key] > base[key] * (1 + tolerance):
+                    regressed = True
+                    print(
+                        f"REGRESSION {students} students, {name} {key}: "
+                        f"{base[key]:.2f} -> {stats[key]:.2f} ({stats[key] / base[key] - 1:+.0%})"
+                    )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=[os.path.join(SAMPLES_DIR, name) for name in DEFAULT_IMAGES])
+    parser.add_argument("--students", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--baseline", help="Compare against a JSON report saved with --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", help="Write this run's report as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for num_students in args.students:
+        report = benchmark(args.images, num_students, args.iterations, args.warmup)
+        results[str(num_students)] = report
+
+        print(f"\n{num_students} students, gallery load {report['gallery_load']['ms']:.1f} ms")
+        print(f"{'stage':>12} {'p50 ms':>9} {'p95 ms':>9} {'peak MB':>8}")
+        for name in STAGES:
+            stats = report[name]
+            print(f"{name:>12} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['peak_mb']:>8.1f}")
+        total = report["total"]
+        print(
+            f"{'total':>12} {total['p50_ms']:>9.2f} {total['p95_ms']:>9.2f} "
+            f"{'':>8} {total['throughput_per_s']:.2f} images/s"
+        )
+
+    print(f"\npeak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Embedding work saved by the face-quality filter, and what it costs.
+
+Detects faces in each photo, scores them with FaceQualityFilter, and embeds
+both every face (the previous behaviour) and only the kept ones. Run from
+the server/ directory:
+    python -m benchmarks.quality --images ../samples/group-pic-1.jpg ../samples/karan_auj.jpg
+    python -m benchmarks.quality --crowd --store local_store
+
+--crowd adds a mosaic of the first photo with blurred and shrunken copies,
+standing in for a crowded lecture hall where back rows are small and soft.
+With --store (a LocalStore directory), skipped faces are also matched
+against its gallery, to show how many would have been recognized anyway.
+"""
+
+import argparse
+import collections
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from utils.deepface import detect_faces_from_bytes, get_embeddings_from_faces, get_threshold
+from utils.gallery import GalleryIndex
+from utils.quality import FaceQualityFilter
+from utils.storage import LocalStore
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "samples")
+DEFAULT_IMAGES = ["group-pic-1.jpg", "brad_and_jennifer.jpg", "karan_auj.jpg"]
+
+
+def make_crowd(image_path, directory):
+    """A 2x2 mosaic: the photo, a blurred copy, and copies at 1/2 and 1/4 size."""
+    img = cv2.imread(image_path)
+    height, width = img.shape[:2]
+    mosaic = np.zeros((height * 2, width * 2, 3), dtype=np.uint8)
+    mosaic[:height, :width] = img
+    mosaic[:height, width:] = cv2.GaussianBlur(img, (0, 0), max(2.0, width / 400))
+    for column, factor in ((0, 2), (1, 4)):
+        small = cv2.resize(img, (width // factor, height // factor), interpolation=cv2.INTER_AREA)
+        mosaic[height:height + small.shape[0], column * width:column * width + small.shape[1]] = small
+    path = os.path.join(directory, "crowd.jpg")
+    cv2.imwrite(path, mosaic, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return path
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=[os.path.join(SAMPLES_DIR, name) for name in DEFAULT_IMAGES])
+    parser.add_argument("--crowd", action="store_true", help="Also measure a synthetic crowded photo")
+    parser.add_argument("--store", help="LocalStore directory whose gallery skipped faces are matched against")
+    parser.add_argument("--min-confidence", type=float, default=0.9)
+    parser.add_argument("--min-size", type=int, default=24)
+    parser.add_argument("--min-sharpness", type=float, default=20.0)
+    parser.add_argument("--max-yaw", type=float, default=1.0)
+    args = parser.parse_args()
+
+    face_quality = FaceQualityFilter(args.min_confidence, args.min_size, args.min_sharpness, args.max_yaw or None)
+    gallery = None
+    if args.store:
+        gallery = GalleryIndex()
+        gallery.load_arrays(*LocalStore(args.store).load_gallery())
+    threshold = get_threshold("ArcFace", "cosine")
+
+    with tempfile.TemporaryDirectory() as directory:
+        images = list(args.images) + ([make_crowd(args.images[0], directory)] if args.crowd else [])
+
+        # Warm up both models so the first photo is not charged for loading
+        with open(images[0], "rb") as f:
+            get_embeddings_from_faces([d["face"] for d in detect_faces_from_bytes(f.read())[:1]])
+
+        reasons = collections.Counter()
+        totals = collections.Counter()
+        print(f"{'image':>24} {'faces':>6} {'kept':>5} {'skipped':>8} {'embed all ms':>13} {'filter+embed ms':>16}")
+        for path in images:
+            with open(path, "rb") as f:
+                detections = detect_faces_from_bytes(f.read())
+
+            all_embeddings, all_ms = timed(get_embeddings_from_faces, [d["face"] for d in detections])
+            (kept, skipped), filter_ms = timed(face_quality.split, detections)
+            _, kept_ms = timed(get_embeddings_from_faces, [d["face"] for d in kept])
+            reasons.update(face["reason"] for face in skipped)
+
+            if gallery is not None and skipped:
+                kept_ids = {id(d) for d in kept}
+                rows = [i for i, d in enumerate(detections) if id(d) not in kept_ids]
+                matches = gallery.search(all_embeddings[rows], distance_metric="cosine", threshold=threshold, top_k=1)
+                totals["skipped_verified"] += sum(1 for m in matches if m and m[0]["verified"])
+
+            totals.update(faces=len(detections), kept=len(kept), all_ms=all_ms, kept_ms=filter_ms + kept_ms)
+            name = os.path.basename(path)
+            print(
+                f"{name:>24} {len(detections):>6} {len(kept):>5} {len(skipped):>8} "
+                f"{all_ms:>13.1f} {filter_ms + kept_ms:>16.1f}"
+            )
+
+    saved = 1 - totals["kept_ms"] / totals["all_ms"] if totals["all_ms"] else 0.0
+    print(f"\n{totals['faces']} faces, {totals['kept']} embedded; skipped by reason: {dict(reasons)}")
+    print(f"embedding time {totals['all_ms']:.0f} ms -> {totals['kept_ms']:.0f} ms with the filter ({saved:.0%} saved)")
+    if gallery is not None:
+        print(f"skipped faces that would have verified against the gallery: {totals['skipped_verified']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Throughput of the production server as gunicorn workers are added.
+
+For each worker count, starts `gunicorn server:app` (offline LocalStore
+with a synthetic gallery, analysis cache off so every request runs the
+model), waits for /readyz, then keeps --concurrency clients posting sample
+photos to /api/analyse for --seconds. Run from the server/ directory:
+    python -m benchmarks.serving --workers 1 2 4 --concurrency 8 --seconds 60
+
+Reports requests/s, p50/p95 latency and 503s (requests the inference
+limiter turned away) per worker count, with the speedup over the first.
+Thread limits come from gunicorn.conf.py, so each run splits the CPU
+between its workers the way production does.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.ann_recall import synthetic_gallery
+from utils.storage import LocalStore
+
+SERVER_DIR = os.path.join(os.path.dirname(__file__), "..")
+SAMPLES_DIR = os.path.join(SERVER_DIR, "..", "samples")
+DEFAULT_IMAGES = ["group-pic-1.jpg", "brad_and_jennifer.jpg", "karan_auj.jpg", "brad_and_tom.jpg"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def multipart(field, filename, data):
+    """Encode one file field as multipart/form-data. Returns (body, content type)."""
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def seed_store(directory, num_students):
+    store = LocalStore(directory)
+    embeddings = synthetic_gallery(num_students)
+    students = [
+        {"roll_number": f"S{i:06d}", "name": f"Student {i}", "embedding": row.tolist(), "samples": []}
+        for i, row in enumerate(embeddings)
+    ]
+    for start in range(0, len(students), 1000):
+        store.save_students(students[start:start + 1000])
+
+
+def start_server(num_workers, port, directory, log, extra_env=None):
+    """Start gunicorn on the LocalStore in `directory`; `extra_env` overrides or adds settings."""
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "local",
+        "LOCAL_STORE_DIR": directory,
+        "ANN_INDEX_PATH": os.path.join(directory, "ann_index.npz"),
+        "ANALYSIS_CACHE_ENTRIES": "0",
+        "WEB_CONCURRENCY": str(num_workers),
+        **(extra_env or {}),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "server:app", "--bind", f"127.0.0.1:{port}"],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def wait_ready(process, base_url, num_workers, timeout, log_path):
+    """
+    Poll /readyz until every worker has answered 200 at least once (each
+    warms up separately). Returns the seconds that took.
+    """
+    start = time.perf_counter()
+    ready_pids = set()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                raise RuntimeError(f"gunicorn exited:\n{f.read()}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/readyz", timeout=5) as response:
+                ready_pids.add(json.load(response)["pid"])
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        if len(ready_pids) >= num_workers:
+            return time.perf_counter() - start
+        time.sleep(0.5)
+    raise TimeoutError(f"Server not ready within {timeout}s")
+
+
+def load(base_url, images, concurrency, seconds):
+    """Keep `concurrency` clients busy for `seconds`; returns [(status, latency)]."""
+    bodies = [multipart("image", os.path.basename(path), data) for path, data in images]
+    deadline = time.perf_counter() + seconds
+    results = []
+    lock = threading.Lock()
+
+    def client(index):
+        i = index
+        while time.perf_counter() < deadline:
+            body, content_type = bodies[i % len(bodies)]
+            i += 1
+            request = urllib.request.Request(
+                f"{base_url}/api/analyse", data=body, headers={"Content-Type": content_type}
+            )
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=300) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                status = 0
+            with lock:
+                results.append((status, time.perf_counter() - start))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return results
+
+
+def summarize(results, seconds):
+    ok = np.array([latency for status, latency in results if status == 200])
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "busy_503": sum(1 for status, _ in results if status == 503),
+        "errors": sum(1 for status, _ in results if status not in (200, 503)),
+        "throughput_per_s": len(ok) / seconds,
+        "p50_ms": float(np.percentile(ok, 50) * 1000) if len(ok) else None,
+        "p95_ms": float(np.percentile(ok, 95) * 1000) if len(ok) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous clients")
+    parser.add_argument("--seconds", type=float, default=60, help="Load duration per worker count")
+    parser.add_argument("--students", type=int, default=1000, help="Synthetic gallery size")
+    parser.add_argument("--images", nargs="+", default=[os.path.join(SAMPLES_DIR, name) for name in DEFAULT_IMAGES])
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    images = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            images.append((path, f.read()))
+
+    report = {}
+    print(f"{'workers':>7} {'ready s':>8} {'req/s':>7} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8} {'503s':>5} {'errors':>6}")
+    for num_workers in args.workers:
+        with tempfile.TemporaryDirectory() as directory:
+            seed_store(directory, args.students)
+            port = free_port()
+            log_path = os.path.join(directory, "gunicorn.log")
+            with open(log_path, "wb") as log:
+                process = start_server(num_workers, port, directory, log)
+                try:
+                    base_url = f"http://127.0.0.1:{port}"
+                    ready_seconds = wait_ready(process, base_url, num_workers, args.ready_timeout, log_path)
+                    stats = summarize(load(base_url, images, args.concurrency, args.seconds), args.seconds)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=60)
+
+        stats["ready_seconds"] = ready_seconds
+        report[str(num_workers)] = stats
+        base = report[str(args.workers[0])]["throughput_per_s"]
+        speedup = stats["throughput_per_s"] / base if base else float("nan")
+        p50 = f"{stats['p50_ms']:.0f}" if stats["p50_ms"] is not None else "-"
+        p95 = f"{stats['p95_ms']:.0f}" if stats["p95_ms"] is not None else "-"
+        print(
+            f"{num_workers:>7} {ready_seconds:>8.1f} {stats['throughput_per_s']:>7.2f} {speedup:>7.2f}x "
+            f"{p50:>8} {p95:>8} {stats['busy_503']:>5} {stats['errors']:>6}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""The DeepFace calls utils/deepface.py makes; see the package docstring."""
+
+import os
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+DETECT_MS = float(os.environ.get("STUB_DETECT_MS", 150))
+EMBED_MS = float(os.environ.get("STUB_EMBED_MS", 15))
+LOAD_MS = float(os.environ.get("STUB_LOAD_MS", 500))
+MAX_FACES = int(os.environ.get("STUB_MAX_FACES", 40))
+
+# Output sizes of the recognizers in utils.deepface.get_threshold
+DIMENSIONS = {"Facenet": 128, "OpenFace": 128, "SFace": 128, "DeepID": 160, "Dlib": 128, "DeepFace": 4096}
+
+_block = np.random.default_rng(0).standard_normal((256, 256)).astype(np.float32)
+
+
+def _burn(milliseconds):
+    """Keep a core busy for `milliseconds`, releasing the GIL like TensorFlow's kernels do."""
+    deadline = time.perf_counter() + milliseconds / 1000
+    while time.perf_counter() < deadline:
+        _block @ _block
+
+
+class _Model:
+    def __init__(self, model_name):
+        self.output_shape = DIMENSIONS.get(model_name, 512)
+
+
+def build_model(model_name, task="facial_recognition"):
+    _burn(LOAD_MS)
+    return _Model(model_name)
+
+
+def extract_faces(img_path, detector_backend="retinaface", enforce_detection=True, align=True):
+    """A grid of square faces with frontal landmarks, one per 300x300 pixels up to MAX_FACES."""
+    _burn(DETECT_MS)
+    height, width = img_path.shape[:2]
+    count = int(min(MAX_FACES, max(1, height * width // (300 * 300))))
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / columns))
+    side = max(8, min(width // columns, height // rows) * 2 // 3)
+
+    detections = []
+    for i in range(count):
+        x = (i % columns) * (width // columns)
+        y = (i // columns) * (height // rows)
+        face = img_path[y:y + side, x:x + side]
+        detections.append(
+            {
+                "face": face[:, :, ::-1] / 255,
+                "facial_area": {
+                    "x": x,
+                    "y": y,
+                    "w": side,
+                    "h": side,
+                    "left_eye": (x + side * 2 // 3, y + side // 3),
+                    "right_eye": (x + side // 3, y + side // 3),
+                    "nose": (x + side // 2, y + side // 2),
+                },
+                "confidence": 0.99,
+            }
+        )
+    return detections
+
+
+def represent(img_path, model_name="VGG-Face", detector_backend="opencv", enforce_detection=True):
+    """One embedding per face, seeded by its pixels; a list of faces gives a list of results."""
+    faces = img_path if isinstance(img_path, list) else [img_path]
+    dimension = DIMENSIONS.get(model_name, 512)
+    results = []
+    for face in faces:
+        _burn(EMBED_MS)
+        thumbnail = cv2.resize(np.asarray(face, dtype=np.float32), (8, 8), interpolation=cv2.INTER_AREA)
+        seed = zlib.crc32(np.round(thumbnail * 255).astype(np.uint8).tobytes())
+        embedding = np.random.default_rng(seed).standard_normal(dimension) * 20
+        results.append([{"embedding": embedding.tolist()}])
+    return results if isinstance(img_path, list) and len(faces) > 1 else results[0]
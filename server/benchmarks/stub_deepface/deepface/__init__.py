@@ -0,0 +1,17 @@
+"""
+Stand-in for the deepface package, for load tests without TensorFlow.
+
+benchmarks/loadtest.py --model stub puts this directory first on the
+server's PYTHONPATH. It implements the few DeepFace calls utils/deepface.py
+makes with fixed, CPU-bound costs, so the server's queueing, matching and
+storage run as usual while the model itself takes a known time:
+
+    STUB_DETECT_MS   per detection call (default 150)
+    STUB_EMBED_MS    per embedded face (default 15)
+    STUB_LOAD_MS     per model build (default 500)
+    STUB_MAX_FACES   faces found in the largest photos (default 40)
+
+Detections are a grid of frontal faces, more for larger photos, and each
+embedding is derived from its face pixels, so a repeated photo gives the
+same embeddings. Nothing here recognizes anyone.
+"""
@@ -0,0 +1,14 @@
+"""The alignment helpers utils/deepface.py uses for large photos; faces are cropped without rotation."""
+
+
+def extract_sub_image(img, facial_area):
+    x, y, w, h = facial_area
+    return img[y:y + h, x:x + w], 0, 0
+
+
+def align_img_wrt_eyes(img, left_eye, right_eye):
+    return img, 0
+
+
+def project_facial_area(facial_area, angle, size):
+    return facial_area
@@ -0,0 +1,99 @@
+"""
+Memory and time spent on an upload before it is accepted or rejected.
+
+Compares the previous handling (read the whole file, then cv2.imdecode)
+with utils.uploads.read_image_upload followed by the same decode, for a
+normal photo, an oversized file, a decompression bomb (a small JPEG that
+claims a huge frame) and a non-image. Files sit in temporary files, as
+Werkzeug spools large uploads. Run from the server/ directory:
+    python -m benchmarks.uploads --image ../samples/group-pic-1.jpg
+
+Peak memory is traced Python and NumPy allocation, which covers the read
+buffer and the decoded image.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import types
+
+import cv2
+import numpy as np
+
+from utils.uploads import MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS, UploadError, read_image_upload
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "samples")
+
+
+def make_cases(image_path, directory):
+    """Write the test uploads. Returns [(name, path)]."""
+    cases = [("photo", image_path)]
+
+    # Noise barely compresses; stack 12 MP frames until the file exceeds the cap
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, size=(3000, 4000, 3), dtype=np.uint8)
+    path = os.path.join(directory, "oversized.jpg")
+    frames = 1
+    while True:
+        cv2.imwrite(path, np.tile(noise, (frames, 1, 1)), [cv2.IMWRITE_JPEG_QUALITY, 100])
+        if os.path.getsize(path) > MAX_IMAGE_BYTES:
+            break
+        frames += 1
+    cases.append(("oversized", path))
+
+    side = int((MAX_IMAGE_PIXELS * 1.2) ** 0.5)
+    path = os.path.join(directory, "bomb.jpg")
+    cv2.imwrite(path, np.zeros((side, side), dtype=np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 50])
+    cases.append(("bomb", path))
+
+    path = os.path.join(directory, "not_an_image.bin")
+    with open(path, "wb") as f:
+        f.write(rng.bytes(8 * 1024 * 1024))
+    cases.append(("not_an_image", path))
+    return cases
+
+
+def previous(stream):
+    img = cv2.imdecode(np.frombuffer(stream.read(), np.uint8), cv2.IMREAD_COLOR)
+    return "decoded" if img is not None else "invalid after decode"
+
+
+def bounded(stream):
+    try:
+        data = read_image_upload(types.SimpleNamespace(stream=stream))
+    except UploadError as e:
+        return f"{e.status} {e}"
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return "decoded" if img is not None else "invalid after decode"
+
+
+def measure(handler, path):
+    with open(path, "rb") as stream:
+        tracemalloc.start()
+        start = time.perf_counter()
+        outcome = handler(stream)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return outcome, elapsed * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=os.path.join(SAMPLES_DIR, "group-pic-1.jpg"))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = make_cases(args.image, directory)
+        print(f"{'case':>13} {'size MB':>8} {'handling':>9} {'ms':>8} {'peak MB':>8}  outcome")
+        for name, path in cases:
+            size = os.path.getsize(path) / 2**20
+            for label, handler in (("previous", previous), ("bounded", bounded)):
+                outcome, ms, peak = measure(handler, path)
+                print(f"{name:>13} {size:>8.1f} {label:>9} {ms:>8.1f} {peak:>8.1f}  {outcome}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Embedding work and identification of VideoAttendance on synthetic clips.
+
+Feeds generated frames through VideoAttendance with a stub detector,
+embedder and matcher, so no model is needed. Run from the server/ directory:
+    python -m benchmarks.video
+
+Each scenario checks the present/absent events and summary, e.g. that a
+student in view for a whole clip shorter than the tracker's max_age is
+still identified. Exits 1 if a check fails.
+"""
+
+import sys
+
+import numpy as np
+
+from utils.video import VideoAttendance
+
+FRAME_SHAPE = (240, 320, 3)
+FACE_BOX = {"x": 100, "y": 60, "w": 80, "h": 80}
+
+
+def synthetic_clip(seconds, visible_until=None, sample_fps=2.0):
+    """(seconds, frame, visible) at `sample_fps`; the student is in view until `visible_until`."""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, size=FRAME_SHAPE, dtype=np.uint8)
+    for index in range(int(seconds * sample_fps)):
+        t = index / sample_fps
+        yield t, background, visible_until is None or t < visible_until
+
+
+def run_scenario(seconds, visible_until=None, roster=("R1",)):
+    """Returns (events, stats) of one clip with student R1 in view until `visible_until`."""
+    current = {"in_view": False}
+
+    def frames():
+        for t, frame, in_view in synthetic_clip(seconds, visible_until):
+            current["in_view"] = in_view
+            yield t, frame
+
+    def detect(frame):
+        if not current["in_view"]:
+            return []
+        return [{"facial_area": dict(FACE_BOX), "confidence": 0.99, "face": np.zeros((112, 112, 3))}]
+
+    def embed(faces):
+        return np.ones((len(faces), 512), dtype=np.float32)
+
+    def match(embeddings):
+        return [[{"roll_number": "R1", "name": "Student 1", "distance": 0.2, "verified": True}] for _ in embeddings]
+
+    attendance = VideoAttendance(detect, embed, match)
+    events = list(attendance.run(frames(), roster=list(roster)))
+    return events, attendance.stats
+
+
+def check(name, events, stats, present, absent, absent_events):
+    summary = events[-1]
+    got_absent_events = [e["roll_number"] for e in events if e["type"] == "absent"]
+    ok = summary["present"] == present and summary["absent"] == absent and got_absent_events == absent_events
+    print(
+        f"{name:>28} frames {stats['frames']:>4} detections {stats['detections']:>4} "
+        f"embeddings {stats['embeddings']:>3}  present {summary['present']} absent {summary['absent']}  "
+        f"{'ok' if ok else 'FAIL'}"
+    )
+    return ok
+
+
+def main():
+    failed = False
+    # Shorter than max_age, so the track never expires before the clip ends
+    events, stats = run_scenario(4.0)
+    failed |= not check("in view for a 4 s clip", events, stats, ["R1"], [], [])
+
+    events, stats = run_scenario(60.0)
+    failed |= not check("in view for a 60 s clip", events, stats, ["R1"], [], [])
+
+    events, stats = run_scenario(40.0, visible_until=10.0)
+    failed |= not check("leaves after 10 s of 40 s", events, stats, ["R1"], [], ["R1"])
+
+    events, stats = run_scenario(4.0, visible_until=0.0)
+    failed |= not check("never in view", events, stats, [], ["R1"], [])
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
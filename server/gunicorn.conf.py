@@ -0,0 +1,83 @@
+"""
+Production serving with gunicorn. Run from the server/ directory:
+    gunicorn server:app
+
+The app (Flask, the store and the gallery) is imported once in the master
+before forking, but TensorFlow is not: its runtime and thread pools are not
+fork-safe. Each worker loads TensorFlow, DeepFace and both models after it
+forks, then warms up, in the background; its /readyz answers 503 until then.
+
+The CPU is split between workers: each gets cpu_count / workers threads for
+TensorFlow, OpenCV and BLAS, instead of every worker sizing its pools to
+the whole machine. Within a worker, INFERENCE_CONCURRENCY requests run the
+model at once and the rest wait their turn (see utils/limiter.py).
+
+Run a single worker (the default) and scale with threads. Upload jobs,
+the gallery, the analysis cache and attendance sessions all live in the
+memory of the worker that created them, and gunicorn's shared socket cannot
+route a request to a particular worker: with several workers, a job poll or
+session photo may reach one that never saw it, and an enrollment, delete or
+POST /api/students/reload only updates the worker that served it. Serving
+with several workers is out of scope until those are moved into shared
+storage; WEB_CONCURRENCY above 1 is not supported.
+
+Environment:
+    WEB_CONCURRENCY   worker processes (default: 1; see above)
+    GUNICORN_THREADS  request threads per worker (default: 8)
+    PORT              listen port (default: 5000)
+"""
+
+import multiprocessing
+import os
+import sys
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+preload_app = True
+# Large group photos on a busy CPU can take tens of seconds
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# ==================== Thread Limits ====================
+# Read by TensorFlow and the BLAS libraries when they first initialize (BLAS
+# with NumPy in the master during preload), so they are set before the app loads.
+THREADS_PER_WORKER = max(1, cpu_count // workers)
+for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+    os.environ.setdefault(name, str(THREADS_PER_WORKER))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+# Each worker loads the models after forking; upload workers spawn lazily per web worker
+os.environ.setdefault("MODEL_AUTOLOAD", "0")
+os.environ.setdefault("WARM_WORKERS_ON_START", "0")
+os.environ.setdefault("ANALYSIS_WORKERS", "1")
+# Writer threads do not survive fork; each worker starts its own in post_fork
+os.environ.setdefault("START_RESULT_WRITER", "0")
+
+
+# ==================== Hooks ====================
+
+def post_fork(arbiter, worker):
+    """Worker: cap OpenCV's pool, start the result writer, then load the models; /readyz is 503 until warm."""
+    import cv2
+
+    cv2.setNumThreads(THREADS_PER_WORKER)
+    app = sys.modules.get("server")
+    if app is not None:
+        app.result_writer.start()
+        app.models.start()
+
+
+def worker_exit(server, worker):
+    """
+    Worker, on graceful shutdown: close open attendance sessions, then commit
+    queued results; what remains is replayed on restart.
+    """
+    app = sys.modules.get("server")
+    if app is not None:
+        app.sessions.close_all()
+        app.result_writer.close(timeout=graceful_timeout / 2)
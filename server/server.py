@@ -2,65 +2,665 @@
 Flask server for face recognition attendance system.
 """
 
+import atexit
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
 import os
-from flask import Flask, send_from_directory, request, jsonify
-from firebase_admin import credentials, firestore, initialize_app
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timezone
+from flask import Flask, Response, send_from_directory, request, jsonify, stream_with_context
 from flask_cors import CORS
+import numpy as np
 
 from utils.deepface import (
+    INFERENCE_BACKEND,
+    WARMUP_IMAGE,
     bytes_to_cv2_image,
-    get_embedding_from_cv2_image,
     detect_faces,
-    get_embedding_from_face,
-    find_distance,
+    get_embeddings_from_cv2_images,
+    detect_faces_from_bytes,
+    get_embeddings_from_faces,
     get_threshold,
+    load_models,
+    warm_up,
 )
+from utils.ann import IVFIndex
+from utils.assignment import assign_faces
+from utils.cache import AnalysisCache
+from utils.enrollment import (
+    EnrollmentError,
+    EnrollmentImages,
+    import_roster,
+    read_roster_csv,
+    summarize_samples,
+)
+from utils.gallery import GalleryIndex
+from utils.jobs import JobQueue, QueueFull, detect_and_embed
+from utils.lifecycle import ModelLifecycle
+from utils.limiter import ConcurrencyLimiter, Overloaded
+from utils.metrics import Metrics
+from utils.quality import FaceQualityFilter
+from utils.sessions import SessionClosed, SessionRegistry
+from utils.storage import DEFAULT_MODEL, create_store
+from utils.uploads import UploadError, read_image_upload
+from utils.video import VideoAttendance, iter_frames
+from utils.writer import ResultWriter, compact_result
 
 # ==================== Flask Setup ====================
 app = Flask(__name__, static_folder="../client/build", static_url_path="/static-disabled-xyz")
 CORS(app)
+startup_began = time.perf_counter()
+# Upload and bulk import workers are spawned and re-import this module
+# (as __mp_main__ under `python server.py`); they only need its functions,
+# so the store, gallery and models below are only set up in the main process.
+IS_MAIN_PROCESS = multiprocessing.current_process().name == "MainProcess"
 
-# ==================== Firebase Setup ====================
-cred = credentials.Certificate("./utils/firebase-key.json")
-initialize_app(cred)
-db = firestore.client()
+# ==================== Storage Setup ====================
+# STORAGE_BACKEND=firestore (default) or local, for offline SQLite storage
+store = create_store() if IS_MAIN_PROCESS else None
 
 # ==================== Configuration ====================
-MODEL_NAME = "ArcFace"
-DISTANCE_METRIC = "cosine"  # Options: "cosine", "euclidean", "euclidean_l2"
+# Model and metric of the store's active embedding version, which
+# tools/reembed.py switches; RECOGNITION_MODEL and DISTANCE_METRIC pin them
+# instead, e.g. to try out a version before activating it
+MODEL_OVERRIDE = os.environ.get("RECOGNITION_MODEL")
+METRIC_OVERRIDE = os.environ.get("DISTANCE_METRIC")
+ACTIVE_EMBEDDING = (store.active_embedding() or {}) if store is not None else {}
+MODEL_NAME = MODEL_OVERRIDE or ACTIVE_EMBEDDING.get("model", DEFAULT_MODEL)
+# Options: "cosine", "euclidean", "euclidean_l2"
+DISTANCE_METRIC = METRIC_OVERRIDE or ACTIVE_EMBEDDING.get("distance_metric", "cosine")
 THRESHOLD = get_threshold(MODEL_NAME, DISTANCE_METRIC)
+TOP_K = 5
+EMBEDDING_BATCH_SIZE = 32  # Faces per recognizer forward pass
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", 2))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", 32))
+ANN_INDEX_PATH = os.environ.get("ANN_INDEX_PATH", "./ann_index.npz")
+ANN_MIN_SIZE = int(os.environ.get("ANN_MIN_SIZE", 20000))  # Exact search below this
+ANN_PROBES = int(os.environ.get("ANN_PROBES", 16))  # Recall/latency knob
+ANALYSIS_CACHE_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_ENTRIES", 256))
+ANALYSIS_CACHE_MB = int(os.environ.get("ANALYSIS_CACHE_MB", 64))
+ANALYSIS_CACHE_TTL = int(os.environ.get("ANALYSIS_CACHE_TTL", 600))  # Seconds
+# Reuse results for a same-size photo within this many dHash bits; unset
+# (the default) reuses them only for byte-identical uploads
+ANALYSIS_CACHE_MAX_HAMMING = os.environ.get("ANALYSIS_CACHE_MAX_HAMMING")
+BULK_IMPORT_DIR = os.environ.get("BULK_IMPORT_DIR", "./bulk_imports")
+BULK_IMPORT_WORKERS = int(os.environ.get("BULK_IMPORT_WORKERS", 2))
+# Registration photos are kept here so the gallery can be re-embedded later
+ENROLLMENT_IMAGE_DIR = os.environ.get("ENROLLMENT_IMAGE_DIR", "./enrollment_images")
+RESULTS_PAGE_SIZE = 50
+RESULTS_MAX_PAGE_SIZE = 500
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 5))  # 0 disables the log
+# Requests running the model at once in this process; more wait up to
+# INFERENCE_WAIT_SECONDS in a line of INFERENCE_MAX_WAITING, then get a 503
+INFERENCE_CONCURRENCY = int(os.environ.get("INFERENCE_CONCURRENCY", 1))
+INFERENCE_MAX_WAITING = int(os.environ.get("INFERENCE_MAX_WAITING", 32))
+INFERENCE_WAIT_SECONDS = float(os.environ.get("INFERENCE_WAIT_SECONDS", 30))
+# Whole request (also bounds video and roster archives), then each image
+MAX_REQUEST_MB = int(os.environ.get("MAX_REQUEST_MB", 512))
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_MB", 20)) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_MEGAPIXELS", 120)) * 1_000_000
+# Faces failing any of these are reported as skipped instead of embedded;
+# 0 turns a check off (see utils/quality.py)
+FACE_MIN_CONFIDENCE = float(os.environ.get("FACE_MIN_CONFIDENCE", 0.9))
+FACE_MIN_SIZE = int(os.environ.get("FACE_MIN_SIZE", 24))  # Pixels, shorter box side
+FACE_MIN_SHARPNESS = float(os.environ.get("FACE_MIN_SHARPNESS", 20))
+FACE_MAX_YAW = float(os.environ.get("FACE_MAX_YAW", 1.0)) or None
+# Results are saved by a background writer in batches; documents not yet
+# committed survive restarts in RESULT_SPILL_DIR
+RESULT_SPILL_DIR = os.environ.get("RESULT_SPILL_DIR", "./result_spill")
+RESULT_BATCH_SIZE = int(os.environ.get("RESULT_BATCH_SIZE", 50))
+RESULT_STORED_MATCHES = 3  # top_matches kept per face in stored results
+# Open attendance sessions without a photo for this long close (and save) by themselves
+SESSION_IDLE_HOURS = float(os.environ.get("SESSION_IDLE_HOURS", 4))
+VIDEO_SAMPLE_FPS = float(os.environ.get("VIDEO_SAMPLE_FPS", 2))
+VIDEO_MAX_SECONDS = float(os.environ.get("VIDEO_MAX_SECONDS", 300))
+# Cameras clients may stream from, as "name=source,..." (RTSP URL or webcam index)
+VIDEO_CAMERAS = dict(
+    entry.split("=", 1) for entry in os.environ.get("VIDEO_CAMERAS", "").split(",") if "=" in entry
+)
+
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_MB * 1024 * 1024
+
+# ==================== Model Setup ====================
+# TensorFlow and both models load in a background thread while the gallery
+# is set up below, then warm up on a sample photo; /readyz answers 503 until
+# that is done. Under gunicorn, gunicorn.conf.py sets MODEL_AUTOLOAD=0 and
+# each worker loads the models after forking.
+MODEL_AUTOLOAD = os.environ.get("MODEL_AUTOLOAD", "1") == "1"
+models = ModelLifecycle(warmup_image=os.environ.get("WARMUP_IMAGE") or None, model_name=MODEL_NAME)
+if IS_MAIN_PROCESS and MODEL_AUTOLOAD:
+    models.start()
+
+# ==================== Gallery Setup ====================
+# The active model's student embeddings are kept in memory and updated
+# alongside the store, so analysis never has to stream the students collection.
+
+
+def ann_index_path(model_name):
+    """IVF index file of one model's gallery; the default model's keeps ANN_INDEX_PATH itself."""
+    if model_name == DEFAULT_MODEL:
+        return ANN_INDEX_PATH
+    root, ext = os.path.splitext(ANN_INDEX_PATH)
+    return f"{root}-{model_name}{ext}"
+
+
+def build_gallery(model_name):
+    """
+    Load the store's `model_name` embeddings into a new gallery. Large
+    galleries are searched through an IVF index saved next to the server,
+    so restarts only re-assign changed students instead of retraining.
+    """
+    index = GalleryIndex()
+    index.load_arrays(*store.load_gallery(model_name))
+    path = ann_index_path(model_name)
+    if os.path.exists(path):
+        ann_index = IVFIndex.load(path)
+        ann_index.n_probe = ANN_PROBES
+    else:
+        ann_index = IVFIndex(n_probe=ANN_PROBES)
+    index.attach_ann(ann_index, min_size=ANN_MIN_SIZE)
+    if index.ann_needs_training():
+        index.retrain_ann().save(path)
+    return index
+
+
+gallery = build_gallery(MODEL_NAME) if IS_MAIN_PROCESS else GalleryIndex()
+ann_retrain_lock = threading.Lock()
+# Held while another embedding version is loaded and swapped in
+embedding_switch_lock = threading.Lock()
+enrollment_images = EnrollmentImages(ENROLLMENT_IMAGE_DIR)
+# Bulk imports running per uploaded archive; it is deleted once none are left
+bulk_imports = {}
+bulk_imports_lock = threading.Lock()
+
+# ==================== Cache Setup ====================
+# Re-sent photos reuse their detections and embeddings; only matching is
+# redone when the gallery has changed in between.
+analysis_cache = AnalysisCache(
+    max_entries=ANALYSIS_CACHE_ENTRIES,
+    max_bytes=ANALYSIS_CACHE_MB * 1024 * 1024,
+    ttl=ANALYSIS_CACHE_TTL,
+    max_hamming=int(ANALYSIS_CACHE_MAX_HAMMING) if ANALYSIS_CACHE_MAX_HAMMING else None,
+)
+
+# ==================== Face Quality Setup ====================
+# Scored between detection and embedding, so unusable faces skip ArcFace
+face_quality = FaceQualityFilter(
+    min_confidence=FACE_MIN_CONFIDENCE,
+    min_size=FACE_MIN_SIZE,
+    min_sharpness=FACE_MIN_SHARPNESS,
+    max_yaw=FACE_MAX_YAW,
+)
+
+# ==================== Job Queue Setup ====================
+# Uploads are analysed by worker processes that each preload the model;
+# matching and saving happen back in this process, against the gallery.
+analysis_queue = JobQueue(
+    num_workers=ANALYSIS_WORKERS,
+    max_pending=ANALYSIS_QUEUE_SIZE,
+    preload=["utils.deepface"],
+    warmup=functools.partial(warm_up, model_name=MODEL_NAME),
+)
+# Workers spawn and warm up alongside the main process instead of on the
+# first upload, and /readyz waits for them as well.
+WARM_WORKERS_ON_START = os.environ.get("WARM_WORKERS_ON_START", "1") == "1"
+if IS_MAIN_PROCESS and WARM_WORKERS_ON_START:
+    analysis_queue.start_workers()
+
+# ==================== Result Writer Setup ====================
+# Routes answer once matching is done; results reach the store in batched
+# commits from a background thread. Under gunicorn each worker starts its
+# own writer after forking (gunicorn.conf.py sets START_RESULT_WRITER=0).
+result_writer = ResultWriter(store, spill_dir=RESULT_SPILL_DIR, batch_size=RESULT_BATCH_SIZE)
+if IS_MAIN_PROCESS and os.environ.get("START_RESULT_WRITER", "1") == "1":
+    result_writer.start()
+    atexit.register(result_writer.close)
+
+# ==================== Session Setup ====================
+# Multi-photo attendance: evidence accumulates in memory while a session is
+# open and is saved as one result when it closes (see utils/sessions.py).
+sessions = SessionRegistry(
+    on_close=lambda session: save_session(session),
+    idle_timeout=SESSION_IDLE_HOURS * 3600,
+)
+if IS_MAIN_PROCESS:
+    # Registered after the writer's close, so it runs first and its results still get written
+    atexit.register(sessions.close_all)
+
+# ==================== Inference Limiter Setup ====================
+# Synchronous routes queue for the model here instead of oversubscribing
+# the CPU; the per-process thread budget itself is set in gunicorn.conf.py.
+inference_limiter = ConcurrencyLimiter(
+    max_concurrent=INFERENCE_CONCURRENCY,
+    max_waiting=INFERENCE_MAX_WAITING,
+    timeout=INFERENCE_WAIT_SECONDS,
+)
+
+# ==================== Metrics Setup ====================
+# Stage latency histograms for the hot routes, scraped from /metrics;
+# requests slower than SLOW_REQUEST_SECONDS are logged with their breakdown.
+metrics = Metrics(slow_request_seconds=SLOW_REQUEST_SECONDS)
+metrics.gauge("sensattend_gallery_size", "Students in the in-memory gallery", lambda: len(gallery))
+metrics.gauge("sensattend_jobs_pending", "Upload jobs queued or running", lambda: analysis_queue.stats()["pending"])
+metrics.gauge("sensattend_model_warm", "1 once this process has run the model", lambda: int(metrics.model_warm))
+metrics.gauge(
+    "sensattend_results_pending", "Results accepted but not yet committed", lambda: result_writer.stats()["pending"]
+)
+metrics.gauge("sensattend_sessions_open", "Attendance sessions open in this process", lambda: sessions.stats()["open"])
+metrics.gauge(
+    "sensattend_inference_waiting",
+    "Requests waiting for an inference slot",
+    lambda: inference_limiter.stats()["waiting"],
+)
+models.when_ready(lambda: setattr(metrics, "model_warm", True))
+models.record("server_setup", time.perf_counter() - startup_began)
+
+
+# ==================== Helpers ====================
+
+
+def refresh_ann_index():
+    """Retrain and save the IVF index if the gallery outgrew it."""
+    if not ann_retrain_lock.acquire(blocking=False):
+        return
+    try:
+        index, model_name = gallery, MODEL_NAME
+        if index.ann_needs_training():
+            index.retrain_ann().save(ann_index_path(model_name))
+    finally:
+        ann_retrain_lock.release()
+
+
+def schedule_ann_refresh():
+    if gallery.ann_needs_training():
+        threading.Thread(target=refresh_ann_index, daemon=True).start()
+
+
+def active_embedding():
+    """The (model, distance metric) this process should serve, as configured above."""
+    active = store.active_embedding() or {}
+    return (
+        MODEL_OVERRIDE or active.get("model", DEFAULT_MODEL),
+        METRIC_OVERRIDE or active.get("distance_metric", "cosine"),
+    )
+
+
+def switch_embedding(model_name, distance_metric):
+    """
+    Serve another embedding version. A new model is loaded and warmed up,
+    and its gallery built, while the current ones keep serving; then model,
+    metric, threshold and gallery are swapped together. Cached embeddings
+    of the old model are dropped. Upload workers load the new model on
+    their first job with it.
+    """
+    global MODEL_NAME, DISTANCE_METRIC, THRESHOLD, gallery
+    with embedding_switch_lock:
+        new_gallery = gallery
+        model_changed = model_name != MODEL_NAME
+        if model_changed:
+            load_models(model_name)
+            warm_up(models.warmup_image or WARMUP_IMAGE, model_name)
+            new_gallery = build_gallery(model_name)
+        MODEL_NAME, DISTANCE_METRIC, THRESHOLD, gallery = (
+            model_name,
+            distance_metric,
+            get_threshold(model_name, distance_metric),
+            new_gallery,
+        )
+        if model_changed:
+            models.model_name = model_name
+            analysis_cache.clear()
+
+
+def save_imported_students(documents):
+    """Commit one batch of a bulk import and add it to the gallery."""
+    store.save_students(documents)
+    for document in documents:
+        # Embedded before a switch to another model: saved, but not comparable
+        if document["model"] != MODEL_NAME:
+            continue
+        gallery.add(
+            document["roll_number"],
+            document["name"],
+            document["embedding"],
+            document["samples"],
+            document["sections"],
+        )
+    schedule_ann_refresh()
+
+
+def import_bulk_archive(archive_path, names, sections, progress=None):
+    """
+    Import an uploaded roster archive, then delete it and its progress file.
+    Both are kept if the import fails, so uploading the archive again resumes it.
+    The upload handler has already counted this import in `bulk_imports`.
+    """
+    succeeded = False
+    try:
+        summary = import_roster(
+            archive_path,
+            save_imported_students,
+            names,
+            f"{archive_path}.progress.jsonl",
+            BULK_IMPORT_WORKERS,
+            sections=sections,
+            progress=progress,
+            model_name=MODEL_NAME,
+            images=enrollment_images,
+        )
+        succeeded = True
+        return summary
+    finally:
+        with bulk_imports_lock:
+            bulk_imports[archive_path] -= 1
+            # Another upload of the same archive may still be importing it
+            if not bulk_imports[archive_path]:
+                del bulk_imports[archive_path]
+                if succeeded:
+                    for path in (archive_path, f"{archive_path}.progress.jsonl"):
+                        if os.path.exists(path):
+                            os.remove(path)
+
+
+def parse_datetime_arg(name):
+    """Optional ISO 8601 date or datetime query argument; naive values are UTC."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: expected an ISO 8601 date or datetime") from None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_sections(values):
+    """Section IDs from repeated and/or comma-separated form values."""
+    return sorted({s.strip() for value in values for s in value.split(",") if s.strip()})
+
+
+def parse_match_scope():
+    """
+    The `section` and `fallback` form fields of an analysis request.
+    Raises ValueError for sections without students.
+    """
+    section = request.form.get("section") or None
+    fallback = request.form.get("fallback", "").lower() in ("1", "true", "yes")
+    if section is not None and section not in gallery.sections():
+        raise ValueError(f"Unknown section: {section}")
+    return section, fallback
+
+
+def match_cached(entry, section=None, fallback=False):
+    """Match a cache entry's faces, reusing the result while the gallery and scope are unchanged."""
+    if entry.model != MODEL_NAME:
+        raise ValueError("The recognition model changed while this image was analysed; please send it again")
+    return analysis_cache.match(
+        entry,
+        (gallery.version, DISTANCE_METRIC, section, fallback),
+        lambda: match_embeddings(entry.face_boxes, entry.embeddings, section, fallback),
+    )
+
+
+def match_embeddings(face_boxes, query_embeddings, section=None, fallback=False):
+    """
+    Match already-computed face embeddings against the gallery.
+    With a `section`, only its students are searched; with `fallback`,
+    faces that match no one there are searched against everyone.
+    Faces and students are paired one-to-one for the whole photo, so a
+    student is never counted twice and a face can fall back to its
+    second-best student when a closer face claims the first.
+    Returns per-face results and the roll numbers of verified matches.
+    """
+    # The assignment weighs every student within the threshold, not just
+    # each face's top k; both come from the same distance pass
+    all_matches, candidates = gallery.search(
+        query_embeddings,
+        distance_metric=DISTANCE_METRIC,
+        threshold=THRESHOLD,
+        top_k=TOP_K,
+        section=section,
+        within_threshold=True,
+    )
+    scopes = ["section" if section is not None else "global"] * len(all_matches)
+
+    if section is not None and fallback:
+        unknown = [i for i, matches in enumerate(all_matches) if not (matches and matches[0]["verified"])]
+        if unknown:
+            global_matches, global_candidates = gallery.search(
+                np.asarray(query_embeddings)[unknown],
+                distance_metric=DISTANCE_METRIC,
+                threshold=THRESHOLD,
+                top_k=TOP_K,
+                within_threshold=True,
+            )
+            for i, matches, within in zip(unknown, global_matches, global_candidates):
+                all_matches[i] = matches
+                candidates[i] = within
+                scopes[i] = "global"
+
+    results = []
+    matched_roll_numbers = []
+
+    assignments = assign_faces(candidates, THRESHOLD)
+    for face_box, matches, scope, (best_match, margin) in zip(face_boxes, all_matches, scopes, assignments):
+        if best_match is not None:
+            matched_roll_numbers.append(best_match["roll_number"])
+
+        results.append(
+            {
+                "face_box": face_box,
+                "best_match": best_match,
+                "top_matches": matches,
+                "assignment_margin": margin,
+                "match_scope": scope,
+            }
+        )
+
+    return results, matched_roll_numbers
+
+
+def save_result(document):
+    """Queue a result document for the store in its compact stored form."""
+    result_writer.put(compact_result(document, top_k=RESULT_STORED_MATCHES))
+
+
+def save_session(session):
+    """Store a closed session as one result, so each student counts once however many photos they were in."""
+    roster = session.roster()
+    present = [row["roll_number"] for row in roster if row["status"] == "Present"]
+    save_result(
+        {
+            "message": f"Session: {len(present)} of {len(roster)} student(s) present in {session.photos} photo(s)",
+            "matched_roll_numbers": present,
+            "section": session.section,
+            "model": MODEL_NAME,
+            "distance_metric": DISTANCE_METRIC,
+            "threshold": THRESHOLD,
+            "faces": [],
+            "session": session.summary(),
+            "roster": [
+                {key: row[key] for key in ("roll_number", "status", "photos", "best_distance")} for row in roster
+            ],
+        }
+    )
+
+
+def embed_upload(img_bytes):
+    """
+    Cache entry holding the faces and embeddings of an uploaded image;
+    unless it was seen recently, detection and embedding run here under the
+    inference limiter. Returns None for undecodable images; raises Overloaded.
+    """
+    model_name = MODEL_NAME
+    with metrics.stage("hash"):
+        cache_key = analysis_cache.make_key(img_bytes)
+        entry = analysis_cache.get(cache_key)
+    if entry is not None and entry.model == model_name:
+        return entry
+
+    with inference_limiter.slot():
+        # Large photos are detected at reduced resolution, then cropped at full
+        with metrics.stage("detect"):
+            detections = detect_faces_from_bytes(img_bytes)
+        if detections is None:
+            return None
+
+        with metrics.stage("quality"):
+            detections, skipped = face_quality.split(detections)
+
+        with metrics.stage("embed"):
+            embeddings = get_embeddings_from_faces(
+                [d["face"] for d in detections], batch_size=EMBEDDING_BATCH_SIZE, model_name=model_name
+            )
+    metrics.model_warm = True
+    return analysis_cache.put(cache_key, [d.get("facial_area") for d in detections], embeddings, skipped, model_name)
+
+
+def no_match_result(entry):
+    """Result for an image without a face worth matching."""
+    skipped = entry.skipped_faces
+    return {
+        "message": (
+            f"Detected {len(skipped)} face(s), none clear enough to recognize"
+            if skipped
+            else "No faces detected in image"
+        ),
+        "matched_roll_numbers": [],
+        "faces": [],
+        "skipped_faces": skipped,
+    }
+
+
+def finish_upload_job(job_id, entry, queued_at=None, output=None, section=None, fallback=False):
+    """
+    Runs in this process once an uploaded image has been embedded, by a
+    worker or from the cache. Matches the faces, saves the result document
+    and returns it. `output` carries the worker's stage timings, if any;
+    `section` and `fallback` scope the matching as in match_embeddings.
+    """
+    # Timed from when the upload was queued, so queue wait counts too
+    model_warm = output["model_warm"] if output else True
+    with metrics.request("analysis_job", start=queued_at, model_warm=model_warm) as timer:
+        if entry is None:
+            timer.outcome = "rejected"
+            raise ValueError("Invalid image format")
+
+        for stage, seconds in (output or {}).get("timings", {}).items():
+            timer.record(stage, seconds)
+
+        face_boxes = entry.face_boxes
+        face_count = len(face_boxes) + len(entry.skipped_faces)
+        timer.faces(face_count, entry.skipped_faces)
+        if not face_boxes:
+            return no_match_result(entry)
+
+        analysis_queue.set_stage(job_id, "matching")
+        with timer.stage("match"):
+            results, matched_roll_numbers = match_cached(entry, section, fallback)
+
+        document = {
+            "message": f"Detected {face_count} face(s), recognized {len(matched_roll_numbers)}",
+            "matched_roll_numbers": matched_roll_numbers,
+            "section": section,
+            "model": MODEL_NAME,
+            "distance_metric": DISTANCE_METRIC,
+            "threshold": THRESHOLD,
+            "faces": results,
+            "skipped_faces": entry.skipped_faces,
+        }
+
+        # queue the result for the store
+        analysis_queue.set_stage(job_id, "saving")
+        with timer.stage("save"):
+            save_result(document)
+
+        return document
+
 
 # ==================== Routes ====================
 
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Requests over MAX_CONTENT_LENGTH are refused before their body is parsed."""
+    return jsonify({"error": f"Request is larger than {MAX_REQUEST_MB} MB"}), 413
+
+
 @app.route("/api/students", methods=["POST"])
+@metrics.instrument("add_student")
 def add_student():
-    """Register a new student with their face embedding."""
+    """
+    Register a new student from one or more face images.
+    Several photos may be sent as repeated `image` fields; photos that do not
+    match the others are discarded and the rest averaged into a centroid.
+    """
     name = request.form.get("name")
     roll_number = request.form.get("roll_number")
-    image = request.files.get("image")
+    images = request.files.getlist("image")
+    sections = parse_sections(request.form.getlist("sections"))
 
-    if not name or not roll_number or not image:
+    if not name or not roll_number or not images:
         return (
             jsonify({"error": "Missing required fields: name, roll_number, image"}),
             400,
         )
 
+    model_name = MODEL_NAME
     try:
-        # Convert image to cv2 format
-        img_bytes = image.read()
-        img_cv2 = bytes_to_cv2_image(img_bytes)
+        # Convert images to cv2 format
+        imgs_bytes, imgs_cv2 = [], []
+        with metrics.stage("decode"):
+            for image in images:
+                img_bytes = read_image_upload(image, MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS)
+                img_cv2 = bytes_to_cv2_image(img_bytes)
+
+                if img_cv2 is None:
+                    return jsonify({"error": "Invalid image format"}), 400
+
+                imgs_bytes.append(img_bytes)
+                imgs_cv2.append(img_cv2)
+
+        # Extract the face embedding of every image in one batched pass
+        with metrics.stage("detect_embed"), inference_limiter.slot():
+            embeddings, found = get_embeddings_from_cv2_images(
+                imgs_cv2, batch_size=EMBEDDING_BATCH_SIZE, model_name=model_name
+            )
+        metrics.model_warm = True
 
-        if img_cv2 is None:
-            return jsonify({"error": "Invalid image format"}), 400
+        try:
+            centroid, inliers = summarize_samples(
+                embeddings, max_distance=get_threshold(model_name, "cosine")
+            )
+        except EnrollmentError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Extract face embedding
-        embedding = get_embedding_from_cv2_image(img_cv2)
+        embedding = centroid.tolist()
+        samples = [sample.tolist() for sample in embeddings[inliers]]
 
-        # Store in Firestore
-        db.collection("students").document(roll_number).set(
-            {"name": name, "roll_number": roll_number, "embedding": embedding}
-        )
+        with metrics.stage("save"):
+            # Photos first: the new version must be re-embeddable from them
+            enrollment_images.save(roll_number, imgs_bytes)
+            store.save_student(
+                {
+                    "name": name,
+                    "roll_number": roll_number,
+                    "embedding": embedding,
+                    "samples": samples,
+                    "sections": sections,
+                    "model": model_name,
+                }
+            )
+        with metrics.stage("index"):
+            if model_name == MODEL_NAME:
+                gallery.add(roll_number, name, embedding, samples, sections)
+        schedule_ann_refresh()
 
         return (
             jsonify(
@@ -68,11 +668,87 @@ def add_student():
                     "message": "Student registered successfully",
                     "roll_number": roll_number,
                     "name": name,
+                    "samples_used": len(samples),
+                    "samples_rejected": len(images) - len(samples),
+                    "sections": sections,
                 }
             ),
             200,
         )
 
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Overloaded:
+        return (
+            jsonify({"error": "Server is busy, please try again shortly"}),
+            503,
+            {"Retry-After": "5"},
+        )
+    except Exception as e:
+        import traceback
+
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/students/bulk", methods=["POST"])
+def bulk_add_students():
+    """
+    Register a whole roster from a zip of '<roll_number>_<name>.jpg' images,
+    with an optional `roster` CSV (roll_number,name) overriding the names and
+    optional `sections` fields assigning every imported student to them.
+    The import runs in the background; poll the returned job for progress.
+    Uploading the same archive again resumes an interrupted import.
+    """
+    archive = request.files.get("archive")
+    roster = request.files.get("roster")
+
+    if archive is None:
+        return jsonify({"error": "Missing required field: archive"}), 400
+
+    try:
+        # Streamed to disk while hashing, so the archive is never held in memory
+        os.makedirs(BULK_IMPORT_DIR, exist_ok=True)
+        fd, upload_path = tempfile.mkstemp(suffix=".zip", dir=BULK_IMPORT_DIR)
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: archive.stream.read(1024 * 1024), b""):
+                digest.update(chunk)
+                f.write(chunk)
+
+        if not zipfile.is_zipfile(upload_path):
+            os.remove(upload_path)
+            return jsonify({"error": "archive must be a zip file"}), 400
+
+        names = None
+        if roster is not None:
+            names = read_roster_csv(io.TextIOWrapper(roster.stream, encoding="utf-8-sig"))
+
+        # Keyed by content, so a re-upload finds the previous run's progress file
+        archive_path = os.path.join(BULK_IMPORT_DIR, f"{digest.hexdigest()}.zip")
+        # Counted before the import starts, so a finishing one cannot delete it first
+        with bulk_imports_lock:
+            if os.path.exists(archive_path):
+                os.remove(upload_path)
+            else:
+                os.replace(upload_path, archive_path)
+            bulk_imports[archive_path] = bulk_imports.get(archive_path, 0) + 1
+
+        job_id = analysis_queue.run_in_thread(
+            import_bulk_archive, archive_path, names, parse_sections(request.form.getlist("sections"))
+        )
+
+        return (
+            jsonify(
+                {
+                    "message": "Roster import started.",
+                    "job_id": job_id,
+                    "status_url": f"/api/jobs/{job_id}",
+                }
+            ),
+            202,
+        )
+
     except Exception as e:
         import traceback
 
@@ -80,19 +756,42 @@ def add_student():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/students/reload", methods=["POST"])
+def reload_students():
+    """
+    Reload the gallery from the store, e.g. after an offline roster import.
+    If the store's active embedding version changed (tools/reembed.py
+    --activate), this process switches to it; until the new model and
+    gallery are ready, the current ones keep serving.
+    """
+    try:
+        model_name, distance_metric = active_embedding()
+        if (model_name, distance_metric) != (MODEL_NAME, DISTANCE_METRIC):
+            switch_embedding(model_name, distance_metric)
+        else:
+            gallery.load_arrays(*store.load_gallery(MODEL_NAME))
+        schedule_ann_refresh()
+        return (
+            jsonify(
+                {
+                    "message": "Gallery reloaded",
+                    "count": len(gallery),
+                    "model": MODEL_NAME,
+                    "distance_metric": DISTANCE_METRIC,
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/api/students", methods=["GET"])
 def get_all_students():
     """Get list of all registered students."""
     try:
-        students = []
-        docs = db.collection("students").stream()
-
-        for doc in docs:
-            data = doc.to_dict()
-            students.append(
-                {"name": data.get("name"), "roll_number": data.get("roll_number")}
-            )
-
+        students = store.list_students()
         return jsonify({"count": len(students), "students": students}), 200
 
     except Exception as e:
@@ -103,7 +802,10 @@ def get_all_students():
 def delete_student(roll_number):
     """Delete a student by roll number."""
     try:
-        db.collection("students").document(roll_number).delete()
+        store.delete_student(roll_number)
+        enrollment_images.delete(roll_number)
+        gallery.remove(roll_number)
+        schedule_ann_refresh()
         return (
             jsonify(
                 {"message": "Student deleted successfully", "roll_number": roll_number}
@@ -115,11 +817,45 @@ def delete_student(roll_number):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/students/<roll_number>/sections", methods=["PUT"])
+def set_student_sections(roll_number):
+    """Replace the sections (classes) a student belongs to."""
+    body = request.get_json(silent=True) or {}
+    sections = body.get("sections")
+
+    if not isinstance(sections, list):
+        return jsonify({"error": "Missing required field: sections (list)"}), 400
+    if roll_number not in gallery:
+        return jsonify({"error": f"Unknown student: {roll_number}"}), 404
+
+    try:
+        sections = parse_sections(str(section) for section in sections)
+        store.set_sections(roll_number, sections)
+        gallery.set_sections(roll_number, sections)
+        return jsonify({"roll_number": roll_number, "sections": sections}), 200
+
+    except Exception as e:
+        import traceback
+
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/sections", methods=["GET"])
+def list_sections():
+    """Every section with its number of enrolled students."""
+    return jsonify({"sections": gallery.sections()}), 200
+
+
 @app.route("/api/analyse", methods=["POST"])
+@metrics.instrument("analyse")
 def analyse_image():
     """
     Analyse an image to detect and recognize faces.
-    Returns matched roll numbers for all recognized faces.
+    Returns matched roll numbers for all recognized faces. Faces too small,
+    blurred or turned away are not matched but listed in `skipped_faces`
+    with a reason. An optional `section` limits matching to that class's
+    students.
     """
     image = request.files.get("image")
 
@@ -127,120 +863,313 @@ def analyse_image():
         return jsonify({"error": "No image provided"}), 400
 
     try:
-        # 1. Load image
-        img_bytes = image.read()
-        img_cv2 = bytes_to_cv2_image(img_bytes)
+        section, fallback = parse_match_scope()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # 1. Load image, rejecting oversized or non-image uploads before decoding
+        with metrics.stage("read"):
+            img_bytes = read_image_upload(image, MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS)
 
-        if img_cv2 is None:
+        # 2. Detect and embed all faces, unless this photo was seen recently
+        entry = embed_upload(img_bytes)
+        if entry is None:
             return jsonify({"error": "Invalid image format"}), 400
 
-        # 2. Detect all faces in image
-        detections = detect_faces(img_cv2)
-
-        if not detections:
-            return (
-                jsonify(
-                    {
-                        "message": "No faces detected in image",
-                        "matched_roll_numbers": [],
-                        "faces": [],
-                    }
-                ),
-                200,
-            )
+        face_count = len(entry.face_boxes) + len(entry.skipped_faces)
+        metrics.faces(face_count, entry.skipped_faces)
+        if not entry.face_boxes:
+            return jsonify(no_match_result(entry)), 200
+
+        # 3. Match the usable faces against the in-memory gallery
+        with metrics.stage("match"):
+            results, matched_roll_numbers = match_cached(entry, section, fallback)
+
+        document = {
+            "message": f"Detected {face_count} face(s), recognized {len(matched_roll_numbers)}",
+            "matched_roll_numbers": matched_roll_numbers,
+            "section": section,
+            "model": MODEL_NAME,
+            "distance_metric": DISTANCE_METRIC,
+            "threshold": THRESHOLD,
+            "faces": results,
+            "skipped_faces": entry.skipped_faces,
+        }
+        with metrics.stage("save"):
+            save_result(document)
+
+        return jsonify(document), 200
+
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Overloaded:
+        return (
+            jsonify({"error": "Server is busy, please try again shortly"}),
+            503,
+            {"Retry-After": "5"},
+        )
+    except Exception as e:
+        import traceback
 
-        # 3. Load all stored student embeddings
-        stored_students = {}
-        docs = db.collection("students").stream()
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
 
-        for doc in docs:
-            data = doc.to_dict()
-            roll_number = data.get("roll_number")
-            stored_students[roll_number] = {
-                "name": data.get("name"),
-                "embedding": data.get("embedding"),
-            }
 
-        # 4. Process each detected face
-        results = []
-        matched_roll_numbers = []
+@app.route("/api/video/analyse", methods=["POST"])
+def analyse_video():
+    """
+    Take attendance from an uploaded `video` clip or a configured `camera`.
+    Streams server-sent events: `present` when a student is identified,
+    `absent` when they have been gone a while, then a `summary`, which is
+    also saved as a result. An optional comma-separated `roll_numbers`
+    lists the class, so the summary reports who never appeared; an optional
+    `section` limits matching to that class's students.
+    """
+    video = request.files.get("video")
+    camera = request.form.get("camera")
+    roll_numbers = request.form.get("roll_numbers")
+    roster = [r.strip() for r in roll_numbers.split(",") if r.strip()] if roll_numbers else None
 
-        for detection in detections:
-            face_img = detection["face"]
-            face_box = detection.get("facial_area")
+    if video is None and camera is None:
+        return jsonify({"error": "Provide a video file or a camera name"}), 400
 
-            # Extract embedding for this face
-            query_embedding = get_embedding_from_face(face_img)
+    try:
+        section, _ = parse_match_scope()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    cleanup = None
+    if video is not None:
+        # OpenCV reads from a path, so the clip is spooled to a temporary file
+        fd, source = tempfile.mkstemp(suffix=os.path.splitext(video.filename or "")[1] or ".mp4")
+        with os.fdopen(fd, "wb") as f:
+            video.save(f)
+        cleanup = source
+    else:
+        if camera not in VIDEO_CAMERAS:
+            return jsonify({"error": f"Unknown camera: {camera}"}), 400
+        source = VIDEO_CAMERAS[camera]
+        source = int(source) if source.isdigit() else source
+
+    # Frames queue for the model with every other synchronous request
+    def detect_frame(frame):
+        with inference_limiter.slot():
+            return detect_faces(frame)
+
+    def embed_faces(faces):
+        with inference_limiter.slot():
+            return get_embeddings_from_faces(faces, batch_size=EMBEDDING_BATCH_SIZE, model_name=MODEL_NAME)
+
+    attendance = VideoAttendance(
+        detect=detect_frame,
+        embed=embed_faces,
+        match=lambda embeddings: gallery.search(
+            embeddings, distance_metric=DISTANCE_METRIC, threshold=THRESHOLD, top_k=1, section=section
+        ),
+    )
 
-            # Find matches
-            matches = []
-            for roll_number, student_data in stored_students.items():
-                stored_embedding = student_data.get("embedding")
+    def events():
+        try:
+            frames = iter_frames(source, sample_fps=VIDEO_SAMPLE_FPS, max_seconds=VIDEO_MAX_SECONDS)
+            for event in attendance.run(frames, roster=roster):
+                if event["type"] == "summary":
+                    save_result(
+                        {
+                            "message": f"Video: recognized {len(event['present'])} student(s)",
+                            "matched_roll_numbers": event["present"],
+                            "section": section,
+                            "model": MODEL_NAME,
+                            "distance_metric": DISTANCE_METRIC,
+                            "threshold": THRESHOLD,
+                            "faces": [],
+                        }
+                    )
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            import traceback
+
+            traceback.print_exc()
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            if cleanup:
+                os.remove(cleanup)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-                if stored_embedding is None:
-                    continue
 
-                # Calculate distance
-                distance = find_distance(
-                    alpha_embedding=query_embedding,
-                    beta_embedding=stored_embedding,
-                    distance_metric=DISTANCE_METRIC,
-                )
+@app.route("/api/results", methods=["GET"])
+def get_all_results():
+    """
+    Get saved analyses, newest first, one page at a time.
+
+    Query args:
+        limit: Page size (default 50, at most 500)
+        cursor: `next_cursor` from the previous page
+        start, end: ISO 8601 date range (start inclusive, end exclusive)
+        roll_number: Only analyses in which this student was recognized
+        detail: "true" to include per-face matches, skipped faces and session rosters
+    """
+    try:
+        limit = min(int(request.args.get("limit", RESULTS_PAGE_SIZE)), RESULTS_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        start = parse_datetime_arg("start")
+        end = parse_datetime_arg("end")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-                matches.append(
-                    {
-                        "roll_number": roll_number,
-                        "name": student_data.get("name"),
-                        "distance": distance,
-                        "verified": distance <= THRESHOLD,
-                    }
-                )
+    try:
+        res, next_cursor = store.list_results(
+            limit=limit,
+            cursor=request.args.get("cursor"),
+            start=start,
+            end=end,
+            roll_number=request.args.get("roll_number"),
+            detail=request.args.get("detail", "").lower() in ("1", "true", "yes"),
+        )
+        return jsonify({"data": res, "next_cursor": next_cursor}), 200
 
-            # Sort by distance (best match first)
-            matches.sort(key=lambda x: x["distance"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-            # Get best verified match
-            best_match = None
-            verified_matches = [m for m in matches if m["verified"]]
 
-            if verified_matches:
-                best_match = verified_matches[0]
-                matched_roll_numbers.append(best_match["roll_number"])
+@app.route("/api/attendance", methods=["GET"])
+def get_attendance_counts():
+    """Number of analyses each student was recognized in, from maintained counters."""
+    try:
+        counts = store.attendance_counts()
+        return jsonify({"count": len(counts), "attendance": counts}), 200
 
-            results.append(
-                {
-                    "face_box": face_box,
-                    "best_match": best_match,
-                    "top_matches": matches[:5],
-                }
-            )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        db.collection("results").add(
-            {
-                "timeStamp": firestore.SERVER_TIMESTAMP,
-                "message": f"Detected {len(detections)} face(s), recognized {len(matched_roll_numbers)}",
-                "matched_roll_numbers": matched_roll_numbers,
-                "model": MODEL_NAME,
-                "distance_metric": DISTANCE_METRIC,
-                "threshold": THRESHOLD,
-                "faces": results,
-            }
-        )
+
+@app.route("/api/attendance/<roll_number>", methods=["GET"])
+def get_student_attendance(roll_number):
+    """Attendance counter for one student."""
+    try:
+        counts = store.attendance_counts(roll_number)
+        if not counts:
+            return jsonify({"roll_number": roll_number, "count": 0, "last_seen": None}), 200
+        return jsonify(counts[0]), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/attendance/rebuild", methods=["POST"])
+def rebuild_attendance_counts():
+    """Recount attendance from all saved results (one full scan)."""
+    try:
+        students = store.rebuild_attendance_counts()
+        return jsonify({"message": "Attendance counts rebuilt", "students": students}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/sessions", methods=["POST"])
+def open_session():
+    """
+    Open an attendance session for one class, then add photos to it.
+    Form fields (all optional):
+        section: Match photos against this section; its students form the roster
+        roll_numbers: Comma-separated roster, instead of the section's students
+        date: ISO date of the class (default: today, UTC)
+    Without a roster, only recognized students are listed.
+    """
+    try:
+        section, _ = parse_match_scope()
+        date = request.form.get("date")
+        if date:
+            try:
+                date = datetime.fromisoformat(date).date().isoformat()
+            except ValueError:
+                raise ValueError("Invalid date: expected an ISO 8601 date") from None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    roll_numbers = request.form.get("roll_numbers")
+    if roll_numbers:
+        names = dict(gallery.members())
+        roster = [(r.strip(), names.get(r.strip())) for r in roll_numbers.split(",") if r.strip()]
+    elif section is not None:
+        roster = gallery.members(section)
+    else:
+        roster = []
+
+    session = sessions.open(section=section, date=date, roster=roster)
+    return jsonify(session.summary()), 201
+
+
+@app.route("/api/sessions/<session_id>/photos", methods=["POST"])
+@metrics.instrument("session_photo")
+def add_session_photo(session_id):
+    """
+    Analyse one more photo of a session's class. Its matches are merged into
+    the session's evidence; no separate result is saved. An optional
+    `fallback` also searches everyone for faces not in the session's section.
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found"}), 404
+    if not session.is_open:
+        return jsonify({"error": "Session is closed"}), 409
+
+    image = request.files.get("image")
+    if image is None:
+        return jsonify({"error": "No image provided"}), 400
+    fallback = request.form.get("fallback", "").lower() in ("1", "true", "yes")
+
+    try:
+        with metrics.stage("read"):
+            img_bytes = read_image_upload(image, MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS)
+
+        entry = embed_upload(img_bytes)
+        if entry is None:
+            return jsonify({"error": "Invalid image format"}), 400
+
+        face_count = len(entry.face_boxes) + len(entry.skipped_faces)
+        metrics.faces(face_count, entry.skipped_faces)
+        results, matched_roll_numbers = [], []
+        if entry.face_boxes:
+            with metrics.stage("match"):
+                results, matched_roll_numbers = match_cached(entry, session.section, fallback)
+
+        with metrics.stage("aggregate"):
+            first_seen = session.add_photo(results)
 
         return (
             jsonify(
                 {
-                    "message": f"Detected {len(detections)} face(s), recognized {len(matched_roll_numbers)}",
+                    "message": f"Detected {face_count} face(s), recognized {len(matched_roll_numbers)}",
                     "matched_roll_numbers": matched_roll_numbers,
-                    "model": MODEL_NAME,
-                    "distance_metric": DISTANCE_METRIC,
-                    "threshold": THRESHOLD,
+                    "first_seen": first_seen,
                     "faces": results,
+                    "skipped_faces": entry.skipped_faces,
+                    "session": session.summary(),
                 }
             ),
             200,
         )
 
+    except SessionClosed as e:
+        return jsonify({"error": str(e)}), 409
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Overloaded:
+        return (
+            jsonify({"error": "Server is busy, please try again shortly"}),
+            503,
+            {"Retry-After": "5"},
+        )
     except Exception as e:
         import traceback
 
@@ -248,28 +1177,50 @@ def analyse_image():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/results", methods=["GET"])
-def get_all_results():
-    """Get list of all saved analysis."""
-    try:
-        res = []
-        docs = db.collection("results").stream()
-
-        for doc in docs:
-            data = doc.to_dict()
-            res.append(data)
+@app.route("/api/sessions/<session_id>", methods=["GET"])
+def get_session(session_id):
+    """A session's progress and its roster so far (final once closed)."""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({**session.summary(), "roster": session.roster()}), 200
 
-        return jsonify({"data": res}), 200
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@app.route("/api/sessions/<session_id>/close", methods=["POST"])
+def close_session(session_id):
+    """
+    Close a session and save its roster as one result. Closing again
+    returns the same roster without saving twice.
+    """
+    session = sessions.close(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({**session.summary(), "roster": session.roster()}), 200
+
+
+@app.route("/api/sessions/<session_id>/attendance.csv", methods=["GET"])
+def export_session(session_id):
+    """The session's roster as CSV: roll number and Present/Absent, then the evidence."""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found"}), 404
+    section = "".join(c if c.isalnum() or c in "-_" else "_" for c in session.section or "all")
+    filename = f"attendance-{section}-{session.date}.csv"
+    return Response(
+        session.to_csv(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @app.route("/api/upload_for_analyse", methods=["POST"])
+@metrics.instrument("upload_for_analyse")
 def upload_for_analyse():
     """
-    Analyse an image to detect and recognize faces.
-    Saves matched roll numbers for all recognized faces in firebase.
+    Queue an image for face detection and recognition.
+    Returns a job ID straight away; a worker saves the matched roll numbers
+    in the store and the outcome can be polled at /api/jobs/<job_id>.
+    An optional `section` limits matching to that class's students.
     """
     image = request.files.get("image")
 
@@ -277,116 +1228,118 @@ def upload_for_analyse():
         return jsonify({"error": "No image provided"}), 400
 
     try:
-        # 1. Load image
-        img_bytes = image.read()
-        img_cv2 = bytes_to_cv2_image(img_bytes)
+        section, fallback = parse_match_scope()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        if img_cv2 is None:
-            return jsonify({"error": "Invalid image format"}), 400
-
-        # 2. Detect all faces in image
-        detections = detect_faces(img_cv2)
-
-        if not detections:
-            return (
-                jsonify(
-                    {
-                        "message": "No faces detected in image",
-                        "matched_roll_numbers": [],
-                        "faces": [],
-                    }
-                ),
-                200,
-            )
+    try:
+        with metrics.stage("read"):
+            img_bytes = read_image_upload(image, MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    with metrics.stage("hash"):
+        cache_key = analysis_cache.make_key(img_bytes)
+        entry = analysis_cache.get(cache_key)
+    if entry is not None and entry.model != MODEL_NAME:
+        entry = None
+    queued_at = time.perf_counter()
+
+    def finish_cached(job_id, cached):
+        return finish_upload_job(job_id, cached, queued_at, section=section, fallback=fallback)
+
+    def cache_and_finish(job_id, output):
+        if output is None:
+            return finish_upload_job(job_id, None, queued_at)
+        cached = analysis_cache.put(
+            cache_key, output["face_boxes"], output["embeddings"], output["skipped_faces"], output["model"]
+        )
+        return finish_upload_job(job_id, cached, queued_at, output, section, fallback)
 
-        # 3. Load all stored student embeddings
-        stored_students = {}
-        docs = db.collection("students").stream()
+    try:
+        with metrics.stage("enqueue"):
+            if entry is not None:
+                # Seen recently: skip the workers, only match and save
+                job_id = analysis_queue.submit_result(entry, on_result=finish_cached)
+            else:
+                job_id = analysis_queue.submit(
+                    detect_and_embed,
+                    img_bytes,
+                    EMBEDDING_BATCH_SIZE,
+                    face_quality,
+                    MODEL_NAME,
+                    on_result=cache_and_finish,
+                )
+    except QueueFull:
+        return (
+            jsonify({"error": "Server is busy, please try again shortly"}),
+            503,
+            {"Retry-After": "5"},
+        )
 
-        for doc in docs:
-            data = doc.to_dict()
-            roll_number = data.get("roll_number")
-            stored_students[roll_number] = {
-                "name": data.get("name"),
-                "embedding": data.get("embedding"),
+    return (
+        jsonify(
+            {
+                "message": "Image queued for processing.",
+                "job_id": job_id,
+                "status_url": f"/api/jobs/{job_id}",
             }
+        ),
+        202,
+    )
 
-        # 4. Process each detected face
-        results = []
-        matched_roll_numbers = []
-
-        for detection in detections:
-            face_img = detection["face"]
-            face_box = detection.get("facial_area")
 
-            # Extract embedding for this face
-            query_embedding = get_embedding_from_face(face_img)
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Get progress and, once done, the result of a queued analysis."""
+    job = analysis_queue.get(job_id)
 
-            # Find matches
-            matches = []
-            for roll_number, student_data in stored_students.items():
-                stored_embedding = student_data.get("embedding")
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
 
-                if stored_embedding is None:
-                    continue
+    return jsonify(job), 200
 
-                # Calculate distance
-                distance = find_distance(
-                    alpha_embedding=query_embedding,
-                    beta_embedding=stored_embedding,
-                    distance_metric=DISTANCE_METRIC,
-                )
 
-                matches.append(
-                    {
-                        "roll_number": roll_number,
-                        "name": student_data.get("name"),
-                        "distance": distance,
-                        "verified": distance <= THRESHOLD,
-                    }
-                )
+@app.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    """Get analysis cache hit/miss counters and size, for tuning its limits."""
+    return jsonify(analysis_cache.stats()), 200
 
-            # Sort by distance (best match first)
-            matches.sort(key=lambda x: x["distance"])
 
-            # Get best verified match
-            best_match = None
-            verified_matches = [m for m in matches if m["verified"]]
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving, whatever the model state."""
+    return jsonify({"status": "alive", "models": models.state}), 200
 
-            if verified_matches:
-                best_match = verified_matches[0]
-                matched_roll_numbers.append(best_match["roll_number"])
 
-            results.append(
-                {
-                    "face_box": face_box,
-                    "best_match": best_match,
-                    "top_matches": matches[:5],
-                }
-            )
-
-        try:
-            # save results to firebase
-            db.collection("results").add(
-                {
-                    "timeStamp": firestore.SERVER_TIMESTAMP,
-                    "message": f"Detected {len(detections)} face(s), recognized {len(matched_roll_numbers)}",
-                    "matched_roll_numbers": matched_roll_numbers,
-                    "model": MODEL_NAME,
-                    "distance_metric": DISTANCE_METRIC,
-                    "threshold": THRESHOLD,
-                    "faces": results,
-                }
-            )
-            return jsonify({"message": "Image processed successfully."})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness: 200 once the models are loaded and warmed up (and, with
+    WARM_WORKERS_ON_START, every upload worker has warmed up too), 503
+    before that or if loading failed. Includes the startup timings.
+    """
+    queue = analysis_queue.stats()
+    workers_ready = queue["workers_ready"] >= queue["workers"] or not WARM_WORKERS_ON_START
+    ready = models.ready and workers_ready
+    return (
+        jsonify(
+            {
+                "ready": ready,
+                "pid": os.getpid(),
+                **models.status(),
+                "workers": queue["workers"],
+                "workers_ready": queue["workers_ready"],
+            }
+        ),
+        200 if ready else 503,
+    )
 
-    except Exception as e:
-        import traceback
 
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Stage latencies, faces per image, gallery size and model state, in Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/config", methods=["GET"])
@@ -396,8 +1349,10 @@ def get_config():
         jsonify(
             {
                 "model": MODEL_NAME,
+                "inference_backend": INFERENCE_BACKEND,
                 "distance_metric": DISTANCE_METRIC,
                 "threshold": THRESHOLD,
+                "face_quality": vars(face_quality),
             }
         ),
         200,
@@ -0,0 +1,77 @@
+"""
+Export DeepFace's ArcFace recognizer to ONNX for INFERENCE_BACKEND=onnx.
+
+Converts the TensorFlow model with tf2onnx and optionally shrinks the
+weights. Run from the server/ directory:
+    python -m tools.export_onnx --precision int8
+    python -m tools.export_onnx --precision fp16 --output models/arcface-fp16.onnx
+
+Precisions:
+    fp32  plain conversion; embeddings match TensorFlow to float rounding
+    int8  dynamic quantization of the weights; about 4x smaller and usually
+          the fastest on x86 CPUs
+    fp16  half-precision weights with float32 inputs and outputs; 2x smaller,
+          but only faster on CPUs with native fp16 arithmetic
+
+Needs tf2onnx and onnx (plus onnxconverter-common for fp16), which the
+server itself does not. Check the result against TensorFlow with
+    python -m benchmarks.backend_accuracy --images <held-out dir> --onnx-model <output>
+before pointing ONNX_MODEL_PATH at it.
+"""
+
+import argparse
+import os
+import tempfile
+
+from utils.deepface import ONNX_MODEL_PATH, load_library
+from utils.onnx_backend import ARCFACE_INPUT_SIZE
+
+
+def export_fp32(path, opset):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = load_library().build_model(model_name="ArcFace", task="facial_recognition").model
+    # Dynamic batch dimension, so get_embeddings_from_faces can batch faces
+    spec = (tf.TensorSpec((None, *ARCFACE_INPUT_SIZE, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=path)
+
+
+def quantize_int8(source, path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source, path, weight_type=QuantType.QInt8)
+
+
+def convert_fp16(source, path):
+    import onnx
+    from onnxconverter_common import float16
+
+    model = float16.convert_float_to_float16(onnx.load(source), keep_io_types=True)
+    onnx.save(model, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--precision", choices=["fp32", "fp16", "int8"], default="int8")
+    parser.add_argument("--output", default=ONNX_MODEL_PATH, help="Where to write the .onnx file")
+    parser.add_argument("--opset", type=int, default=13)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if args.precision == "fp32":
+        export_fp32(args.output, args.opset)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            fp32_path = os.path.join(directory, "arcface-fp32.onnx")
+            export_fp32(fp32_path, args.opset)
+            if args.precision == "int8":
+                quantize_int8(fp32_path, args.output)
+            else:
+                convert_fp16(fp32_path, args.output)
+
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / 2**20:.1f} MB, {args.precision})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Import a class roster offline, without going through the HTTP server.
+
+Takes a directory or zip of '<roll_number>_<name>.jpg' images (several
+images per roll number are combined) and an optional CSV with roll_number
+and name columns. Run from the server/ directory:
+    python -m tools.import_roster ../intake-2026.zip --roster ../intake-2026.csv
+
+Progress is recorded next to the source, so re-running the same command
+after an interruption skips students that were already committed. A running
+server picks the new students up after POST /api/students/reload. The
+store is chosen like the server's, via STORAGE_BACKEND or --storage, and
+students are embedded with the model the server serves (the store's active
+one, unless RECOGNITION_MODEL or --model pins another). Their photos are
+kept in ENROLLMENT_IMAGE_DIR, as by the server, so tools/reembed.py can
+move them to a later model.
+"""
+
+import argparse
+import json
+import os
+
+from utils.enrollment import EnrollmentImages, import_roster, read_roster_csv
+from utils.storage import DEFAULT_MODEL, create_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory or zip file of student images")
+    parser.add_argument("--roster", help="CSV with roll_number,name columns")
+    parser.add_argument("--state", help="Progress file (default: <source>.progress.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Embedding processes (0 = inline)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Students embedded per worker task")
+    parser.add_argument("--sections", nargs="*", default=[], help="Sections every imported student joins")
+    parser.add_argument("--storage", choices=["firestore", "local"], help="Overrides STORAGE_BACKEND")
+    parser.add_argument("--model", help="Recognition model (default: RECOGNITION_MODEL or the store's active one)")
+    parser.add_argument(
+        "--images", default=os.environ.get("ENROLLMENT_IMAGE_DIR", "./enrollment_images"), help="Kept photos"
+    )
+    parser.add_argument("--report", help="Write the full summary, including failures, as JSON")
+    args = parser.parse_args()
+
+    store = create_store(args.storage)
+    names = read_roster_csv(args.roster) if args.roster else None
+    state_path = args.state or f"{args.source.rstrip(os.sep)}.progress.jsonl"
+    active = store.active_embedding() or {}
+    model_name = args.model or os.environ.get("RECOGNITION_MODEL") or active.get("model", DEFAULT_MODEL)
+    print(f"Embedding with {model_name}", flush=True)
+
+    summary = import_roster(
+        args.source,
+        store.save_students,
+        names=names,
+        state_path=state_path,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        sections=args.sections,
+        progress=lambda stage: print(stage, flush=True),
+        model_name=model_name,
+        images=EnrollmentImages(args.images),
+    )
+
+    print(
+        f"{summary['imported']} imported, {summary['skipped']} already done, "
+        f"{len(summary['failed'])} failed, {len(summary['ignored_files'])} files ignored "
+        f"(of {summary['total']} students)"
+    )
+    for failure in summary["failed"]:
+        print(f"  {failure['roll_number']}: {failure['error']}")
+    for error in summary["file_errors"]:
+        print(f"  skipped image {error}")
+    for filename in summary["ignored_files"]:
+        print(f"  ignored {filename}: expected <roll_number>_<name>.jpg")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Re-embed the whole gallery with another recognition model, offline.
+
+Every student is embedded again from their kept enrollment photos (see
+ENROLLMENT_IMAGE_DIR) and saved as a new version next to the one the server
+is using, which keeps serving until the switch. Run from the server/ directory:
+    python -m tools.reembed Facenet512 --metric cosine --activate
+
+Re-running the same command after an interruption skips students that
+already have the new version. Progress lines report throughput and the
+estimated time remaining. With --activate, and only once every student has
+the new version, the store's active model and metric are switched in one
+write; the server then moves over on POST /api/students/reload
+(or on restart). Switching only the metric needs no re-embedding:
+    python -m tools.reembed ArcFace --metric euclidean_l2 --activate
+
+Students enrolled before photos were kept have nothing to re-embed from;
+--seed-roster adds their photos from a roster directory or zip first.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from utils.deepface import get_threshold
+from utils.enrollment import EnrollmentImages, reembed_gallery, read_roster_csv, retain_roster_images
+from utils.storage import DEFAULT_MODEL, create_store
+
+METRICS = ["cosine", "euclidean", "euclidean_l2"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help="Recognition model, e.g. ArcFace, Facenet512 or GhostFaceNet")
+    parser.add_argument("--metric", choices=METRICS, help="Distance metric to activate (default: the active one)")
+    parser.add_argument("--activate", action="store_true", help="Switch the store to the model once complete")
+    parser.add_argument(
+        "--images", default=os.environ.get("ENROLLMENT_IMAGE_DIR", "./enrollment_images"), help="Kept photos"
+    )
+    parser.add_argument("--seed-roster", help="Roster directory or zip to take missing photos from")
+    parser.add_argument("--roster-names", help="CSV with roll_number,name columns for --seed-roster")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Embedding processes (0 = inline)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Students embedded per worker task")
+    parser.add_argument("--commit-size", type=int, default=400, help="Students saved per store commit")
+    parser.add_argument("--storage", choices=["firestore", "local"], help="Overrides STORAGE_BACKEND")
+    parser.add_argument("--report", help="Write the full summary, including failures, as JSON")
+    args = parser.parse_args()
+
+    store = create_store(args.storage)
+    images = EnrollmentImages(args.images)
+    active = store.active_embedding() or {"model": DEFAULT_MODEL, "distance_metric": "cosine"}
+    metric = args.metric or active["distance_metric"]
+    print(f"Active: {active['model']} / {active['distance_metric']}; target: {args.model} / {metric}")
+
+    if args.seed_roster:
+        names = read_roster_csv(args.roster_names) if args.roster_names else None
+        added = retain_roster_images(args.seed_roster, images, names)
+        print(f"Kept photos of {added} more student(s) from {args.seed_roster}")
+
+    summary = reembed_gallery(
+        store,
+        images,
+        args.model,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        commit_size=args.commit_size,
+        progress=lambda stage: print(stage, flush=True),
+    )
+
+    print(
+        f"{summary['reembedded']} re-embedded, {summary['skipped']} already done, "
+        f"{len(summary['failed'])} failed (of {summary['total']} students) "
+        f"in {summary['seconds']}s, {summary['images_per_second']} images/s"
+    )
+    for failure in summary["failed"]:
+        print(f"  {failure['roll_number']}: {failure['error']}")
+    for error in summary["file_errors"]:
+        print(f"  skipped image {error}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    if summary["missing"]:
+        print(f"{len(summary['missing'])} student(s) still lack a {args.model} embedding; not switching")
+        sys.exit(1)
+    if args.activate:
+        store.set_active_embedding(args.model, metric)
+        print(
+            f"Active: {args.model} / {metric} (threshold {get_threshold(args.model, metric)}); "
+            "POST /api/students/reload to switch the server to it"
+        )
+
+
+if __name__ == "__main__":
+    main()
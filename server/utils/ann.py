@@ -0,0 +1,295 @@
+"""
+Approximate nearest-neighbour search for large student galleries.
+Pure-NumPy inverted-file (IVF) index over L2-normalized embeddings, which
+keeps their original lengths for euclidean search.
+"""
+
+import os
+
+import numpy as np
+
+
+# ==================== IVF Index ====================
+
+class IVFIndex:
+    """
+    Inverted-file index: a spherical k-means coarse quantizer splits the
+    gallery into `n_lists` cells and a query only scans the `n_probe` cells
+    whose centroids are closest to it.
+
+    Knobs:
+        n_lists: Number of cells (default about 4 * sqrt(N)). More cells
+            make each probe cheaper but need a higher n_probe for recall.
+        n_probe: Cells scanned per query. Higher = better recall, slower.
+
+    Cells are probed and candidates ranked by cosine similarity, or by L2
+    distance between the raw vectors for the "euclidean" metric; callers
+    rescore them with the exact distance metric.
+    """
+
+    def __init__(self, n_lists=None, n_probe=16, train_iterations=10, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iterations = train_iterations
+        self.seed = seed
+
+        self.centroids = None
+        self.trained_size = 0
+        self._vectors = None
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._ids = []
+        self._positions = {}
+        self._lists = None
+        # Per-cell sum and count of the raw vectors, kept up to date for euclidean probes
+        self._cell_sums = None
+        self._cell_counts = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def ids(self):
+        return list(self._ids)
+
+    def needs_training(self, size=None):
+        """True when the gallery has drifted far from the size it was trained on."""
+        size = len(self._ids) if size is None else size
+        return not self.is_trained or size > 2 * self.trained_size or size < self.trained_size // 2
+
+    # ---------- Building ----------
+
+    def rebuild(self, ids, vectors):
+        """Train the quantizer on `vectors` and index all of them."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._vectors = None
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._ids = []
+        self._positions = {}
+        self._train(_normalize(vectors))
+        self.add_many(ids, vectors)
+
+    def _train(self, vectors):
+        size = len(vectors)
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(size)))
+        # Each cell needs a few dozen points for k-means to be meaningful
+        n_lists = max(1, min(n_lists, size // 39 or 1))
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(size, n_lists * 256)
+        sample = vectors[rng.choice(size, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            assignments = _nearest_centroid(sample, centroids)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=n_lists)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+
+            # Reseed empty cells with random sample points
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+            centroids = _normalize(sums)
+
+        self.centroids = centroids.astype(np.float32)
+        self.trained_size = size
+        self._count_cells()
+
+    # ---------- Updates ----------
+
+    def add(self, id_, vector):
+        """Index one vector (normalized here), replacing any previous one for `id_`."""
+        self.add_many([id_], np.asarray(vector, dtype=np.float32)[np.newaxis, :])
+
+    def add_many(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        lengths = np.linalg.norm(vectors, axis=1)
+        vectors = _normalize(vectors)
+        assignments = _nearest_centroid(vectors, self.centroids)
+
+        for id_, vector, length, cell in zip(ids, vectors, lengths, assignments):
+            position = self._positions.get(id_)
+            if position is not None:
+                self._uncount(position)
+            else:
+                position = len(self._ids)
+                self._ensure_capacity(position + 1, vectors.shape[1])
+                self._ids.append(id_)
+                self._positions[id_] = position
+            self._vectors[position] = vector
+            self._lengths[position] = length
+            self._assignments[position] = cell
+            self._cell_sums[cell] += vector * length
+            self._cell_counts[cell] += 1
+
+        self._lists = None
+
+    def remove(self, id_):
+        position = self._positions.pop(id_, None)
+        if position is None:
+            return False
+        self._uncount(position)
+
+        last = len(self._ids) - 1
+        if position != last:
+            self._vectors[position] = self._vectors[last]
+            self._lengths[position] = self._lengths[last]
+            self._assignments[position] = self._assignments[last]
+            self._ids[position] = self._ids[last]
+            self._positions[self._ids[position]] = position
+        self._ids.pop()
+
+        self._lists = None
+        return True
+
+    def _uncount(self, position):
+        cell = self._assignments[position]
+        self._cell_sums[cell] -= self._vectors[position] * self._lengths[position]
+        self._cell_counts[cell] -= 1
+
+    def _count_cells(self):
+        """Recompute the per-cell sums and counts from the indexed vectors."""
+        size = len(self._ids)
+        assignments = self._assignments[:size]
+        self._cell_sums = np.zeros(self.centroids.shape, dtype=np.float64)
+        if size:
+            np.add.at(self._cell_sums, assignments, self._vectors[:size] * self._lengths[:size, np.newaxis])
+        self._cell_counts = np.bincount(assignments, minlength=len(self.centroids)).astype(np.int64)
+
+    def _ensure_capacity(self, size, dim):
+        if self._vectors is None:
+            self._vectors = np.zeros((max(size, 256), dim), dtype=np.float32)
+            self._lengths = np.zeros(max(size, 256), dtype=np.float32)
+            self._assignments = np.zeros(max(size, 256), dtype=np.int32)
+        elif size > len(self._vectors):
+            capacity = max(size, 2 * len(self._vectors))
+            vectors = np.zeros((capacity, dim), dtype=np.float32)
+            vectors[: len(self._vectors)] = self._vectors
+            lengths = np.zeros(capacity, dtype=np.float32)
+            lengths[: len(self._lengths)] = self._lengths
+            assignments = np.zeros(capacity, dtype=np.int32)
+            assignments[: len(self._assignments)] = self._assignments
+            self._vectors = vectors
+            self._lengths = lengths
+            self._assignments = assignments
+
+    def _inverted_lists(self):
+        """Cell membership as CSR arrays, rebuilt lazily after updates."""
+        if self._lists is None:
+            assignments = self._assignments[: len(self._ids)]
+            order = np.argsort(assignments, kind="stable").astype(np.int64)
+            counts = np.bincount(assignments, minlength=len(self.centroids))
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            self._lists = (order, offsets)
+        return self._lists
+
+    # ---------- Search ----------
+
+    def search(self, queries, k, n_probe=None, metric="cosine"):
+        """
+        Return, per query, up to `k` indexed ids ranked by cosine similarity,
+        or nearest first by L2 distance for metric "euclidean".
+        """
+        raw_queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = _normalize(raw_queries)
+        if not self._ids:
+            return [[] for _ in range(len(queries))]
+
+        euclidean = metric == "euclidean"
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        order, offsets = self._inverted_lists()
+        vectors = self._vectors[: len(self._ids)]
+        lengths = self._lengths[: len(self._ids)]
+
+        if euclidean:
+            # Minus the squared L2 distance to each cell's mean raw vector, up to |q|^2
+            filled = self._cell_counts > 0
+            means = np.zeros(self.centroids.shape, dtype=np.float32)
+            means[filled] = self._cell_sums[filled] / self._cell_counts[filled, np.newaxis]
+            squared = np.where(filled, np.einsum("ij,ij->i", means, means), np.inf)
+            cell_scores = 2 * raw_queries @ means.T - squared
+        else:
+            cell_scores = queries @ self.centroids.T
+        probed = np.argpartition(-cell_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        results = []
+        for query, raw_query, cells in zip(queries, raw_queries, probed):
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in cells])
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            scores = vectors[candidates] @ query
+            if euclidean:
+                # |q|^2 + |x|^2 - 2|q||x|cos, negated and without the constant |q|^2
+                candidate_lengths = lengths[candidates]
+                scores = 2 * np.linalg.norm(raw_query) * candidate_lengths * scores - candidate_lengths ** 2
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best], kind="stable")]
+            results.append([self._ids[p] for p in candidates[best]])
+        return results
+
+    # ---------- Persistence ----------
+
+    def save(self, path):
+        """Write the index to `path` (NumPy .npz) atomically."""
+        size = len(self._ids)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            vectors=self._vectors[:size] if size else np.zeros((0, 0), dtype=np.float32),
+            lengths=self._lengths[:size],
+            assignments=self._assignments[:size],
+            ids=np.array(self._ids, dtype=str),
+            params=np.array(
+                [self.n_lists or 0, self.n_probe, self.train_iterations, self.seed, self.trained_size]
+            ),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            n_lists, n_probe, train_iterations, seed, trained_size = (int(v) for v in data["params"])
+            index = cls(n_lists or None, n_probe, train_iterations, seed)
+            index.centroids = data["centroids"]
+            index.trained_size = trained_size
+            ids = data["ids"].tolist()
+            if ids:
+                index._vectors = data["vectors"].copy()
+                # Indexes saved before lengths were kept get them on the gallery's next sync
+                index._lengths = (
+                    data["lengths"].copy() if "lengths" in data.files else np.ones(len(ids), dtype=np.float32)
+                )
+                index._assignments = data["assignments"].astype(np.int32)
+                index._ids = ids
+                index._positions = {id_: i for i, id_ in enumerate(ids)}
+            if index.is_trained:
+                index._count_cells()
+        return index
+
+
+# ==================== Helpers ====================
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _nearest_centroid(vectors, centroids, chunk_size=8192):
+    """Index of the most similar centroid for every vector, in bounded memory."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        scores = vectors[start:start + chunk_size] @ centroids.T
+        assignments[start:start + chunk_size] = np.argmax(scores, axis=1)
+    return assignments
@@ -0,0 +1,134 @@
+"""
+One-to-one assignment of detected faces to students.
+Each face takes at most one student and each student at most one face per
+photo, chosen so the photo as a whole has the best total match, rather than
+every face independently grabbing its nearest student.
+"""
+
+import numpy as np
+
+# Cost of a forbidden pair (distance above threshold); finite so the
+# potentials in the solver stay well defined
+_FORBIDDEN = 1e6
+
+
+# ==================== Solver ====================
+
+def linear_sum_assignment(cost):
+    """
+    Minimum-cost assignment for a rectangular cost matrix (Hungarian
+    algorithm with potentials, O(n^2 m)), vectorized over columns.
+
+    Returns:
+        tuple: (rows, cols) index arrays of the assigned pairs, one per row
+        of the smaller side, sorted by row
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # 1-based as in the textbook formulation; column 0 is a virtual start
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # row assigned to each column, 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while True:
+            used[col] = True
+            current = owner[col]
+            free = np.flatnonzero(~used[1:]) + 1
+
+            slack = cost[current - 1, free - 1] - u[current] - v[free]
+            better = slack < min_slack[free]
+            min_slack[free[better]] = slack[better]
+            way[free[better]] = col
+
+            nearest = free[np.argmin(min_slack[free])]
+            delta = min_slack[nearest]
+
+            used_cols = np.flatnonzero(used)
+            u[owner[used_cols]] += delta
+            v[used_cols] -= delta
+            min_slack[free] -= delta
+
+            col = nearest
+            if owner[col] == 0:
+                break
+
+        # Flip the augmenting path
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+
+    cols = np.flatnonzero(owner[1:])
+    rows = owner[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+# ==================== Face Assignment ====================
+
+def assign_faces(all_matches, threshold):
+    """
+    Choose at most one student per face and one face per student.
+
+    `all_matches` holds, per face, every student within `threshold` of it,
+    as returned by GalleryIndex.search with within_threshold; from a top-k
+    list, a student outside a face's top k could never be assigned to it. Only
+    pairs within `threshold` become candidates, so the problem is faces x
+    (students near some face), never the full gallery.
+    Leaving a face unmatched costs `threshold`, so any verified pair is
+    preferred, and the total distance of matched pairs is minimized.
+
+    Returns:
+        list: Per face, (match dict or None, margin). The margin is how much
+        closer the assigned student is than the face's next-best distinct
+        candidate (or than the threshold when there is none). Small margins
+        flag assignments that could easily have gone the other way; a
+        negative one means the face ceded a closer student to another face.
+    """
+    num_faces = len(all_matches)
+    candidates = sorted(
+        {m["roll_number"] for matches in all_matches for m in matches if m["distance"] <= threshold}
+    )
+    if num_faces == 0 or not candidates:
+        return [(None, None) for _ in range(num_faces)]
+
+    columns = {roll_number: j for j, roll_number in enumerate(candidates)}
+    num_candidates = len(candidates)
+
+    # Candidate columns, then one "unmatched" column per face
+    cost = np.full((num_faces, num_candidates + num_faces), _FORBIDDEN)
+    cost[np.arange(num_faces), num_candidates + np.arange(num_faces)] = threshold
+    for i, matches in enumerate(all_matches):
+        for match in matches:
+            if match["distance"] <= threshold:
+                cost[i, columns[match["roll_number"]]] = match["distance"]
+
+    rows, cols = linear_sum_assignment(cost)
+
+    assignments = [(None, None)] * num_faces
+    for i, j in zip(rows, cols):
+        if j >= num_candidates:
+            continue
+        roll_number = candidates[j]
+        match = next(m for m in all_matches[i] if m["roll_number"] == roll_number)
+        alternatives = [
+            m["distance"] for m in all_matches[i] if m["roll_number"] != roll_number and m["distance"] <= threshold
+        ]
+        runner_up = min(alternatives) if alternatives else threshold
+        assignments[i] = (match, round(runner_up - match["distance"], 6))
+    return assignments
@@ -0,0 +1,200 @@
+"""
+Content-addressed cache of face analysis results.
+Repeated uploads reuse earlier detections and embeddings instead of
+re-running RetinaFace and ArcFace; near-identical ones only when enabled.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from utils.deepface import read_image_size
+
+
+# ==================== Hashing ====================
+
+def exact_hash(image_bytes):
+    """SHA-256 of the raw upload bytes."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(img):
+    """
+    64-bit difference hash (dHash) of a cv2 image.
+    Survives re-encoding, resizing and small brightness changes, so a
+    re-sent photo lands within a few bits of the original.
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def perceptual_hash_from_bytes(image_bytes):
+    """dHash from a cheap 1/8-scale grayscale decode, or None if undecodable."""
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    return None if img is None else perceptual_hash(img)
+
+
+# ==================== Cache ====================
+
+class CacheEntry:
+    """
+    Detections and embeddings for one image, plus its latest match result.
+    `skipped_faces` reports the faces the quality filter left unembedded and
+    `model` names the recognition model that produced the embeddings.
+    """
+
+    # Rough per-entry overhead for face boxes, keys and bookkeeping
+    OVERHEAD_BYTES = 1024
+
+    def __init__(self, key, face_boxes, embeddings, skipped_faces=(), model="ArcFace"):
+        self.key = key
+        self.face_boxes = face_boxes
+        self.embeddings = embeddings
+        self.skipped_faces = list(skipped_faces)
+        self.model = model
+        self.created_at = time.monotonic()
+        boxes = len(face_boxes) + len(self.skipped_faces)
+        self.size = self.OVERHEAD_BYTES + 256 * boxes + np.asarray(embeddings).nbytes
+        self.match_version = None
+        self.match_result = None
+
+
+class AnalysisCache:
+    """
+    LRU cache of CacheEntry objects with TTL expiry and a memory cap.
+
+    Keys are (sha256, dhash, (width, height)) triples. Lookups hit on the
+    exact hash. With `max_hamming` set, they then fall back to any entry of
+    the same dimensions whose perceptual hash is within that many bits.
+    That is off by default: two shots from a fixed classroom camera can be
+    that close while different students sit in front of it, and a resized
+    copy would get boxes in the wrong coordinates.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=600, max_hamming=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_hamming = max_hamming
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.counters = {
+            "hits": 0,
+            "perceptual_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "match_hits": 0,
+            "match_misses": 0,
+        }
+
+    def make_key(self, image_bytes, img=None):
+        """
+        Cache key for an upload; `img` is its decoded image when already
+        available. The perceptual hash and dimensions are only computed when
+        near-duplicate lookups are enabled.
+        """
+        if self.max_hamming is None:
+            return exact_hash(image_bytes), None, None
+        if img is not None:
+            return exact_hash(image_bytes), perceptual_hash(img), (img.shape[1], img.shape[0])
+        size = read_image_size(image_bytes)
+        phash = perceptual_hash_from_bytes(image_bytes) if size is not None else None
+        return exact_hash(image_bytes), phash, size
+
+    def get(self, key):
+        """Return the cached entry for `key`, or None."""
+        digest, phash, size = key
+        with self._lock:
+            self._expire()
+
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self.counters["hits"] += 1
+                self._entries.move_to_end(digest)
+                return entry
+
+            if self.max_hamming is not None and phash is not None and size is not None:
+                for cached_digest, entry in reversed(self._entries.items()):
+                    _, cached_phash, cached_size = entry.key
+                    if cached_size != size or cached_phash is None:
+                        continue
+                    if (cached_phash ^ phash).bit_count() <= self.max_hamming:
+                        self.counters["perceptual_hits"] += 1
+                        self._entries.move_to_end(cached_digest)
+                        return entry
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, face_boxes, embeddings, skipped_faces=(), model="ArcFace"):
+        """Cache detections and embeddings for `key` and return the new entry."""
+        entry = CacheEntry(key, face_boxes, embeddings, skipped_faces, model)
+        with self._lock:
+            old = self._entries.pop(key[0], None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key[0]] = entry
+            self._bytes += entry.size
+            self._evict()
+        return entry
+
+    def match(self, entry, gallery_version, compute):
+        """
+        Match result for a cached entry against the current gallery.
+        Only this step is invalidated by gallery changes: `compute()` runs
+        again when the version differs, detections and embeddings are kept.
+        """
+        with self._lock:
+            if entry.match_version == gallery_version:
+                self.counters["match_hits"] += 1
+                return entry.match_result
+            self.counters["match_misses"] += 1
+
+        result = compute()
+        with self._lock:
+            entry.match_version, entry.match_result = gallery_version, result
+        return result
+
+    def clear(self):
+        """Drop every entry, e.g. when embeddings from the current model stop being comparable."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    # ---------- Eviction ----------
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [d for d, e in self._entries.items() if now - e.created_at >= self.ttl]
+        for digest in expired:
+            self._drop(digest)
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest)
+        self._bytes -= entry.size
+        self.counters["evictions"] += 1
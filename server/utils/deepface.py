@@ -1,14 +1,104 @@
 """
 DeepFace utility functions for face recognition.
 All face processing, embedding extraction, and distance calculations.
+
+DeepFace (and with it TensorFlow) is imported on first use rather than with
+this module, so importing the server stays fast; see Model Lifecycle below.
 """
 
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-from deepface import DeepFace
 
-# Preload model at module level
-arcface_model = DeepFace.build_model("ArcFace")
+WARMUP_IMAGE = os.path.join(os.path.dirname(__file__), "..", "..", "samples", "brad.jpg")
+
+# Recognizer runtime: "tensorflow" (DeepFace) or "onnx" (an ArcFace graph
+# exported by tools/export_onnx.py). Detection always runs on RetinaFace, and
+# recognition models other than ArcFace always run on TensorFlow.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "tensorflow")
+ONNX_MODEL_PATH = os.environ.get(
+    "ONNX_MODEL_PATH", os.path.join(os.path.dirname(__file__), "..", "models", "arcface.onnx")
+)
+
+_onnx_recognizer = None
+_onnx_lock = threading.Lock()
+
+
+# ==================== Model Lifecycle ====================
+
+def load_library():
+    """Import DeepFace and TensorFlow. Returns the DeepFace module."""
+    from deepface import DeepFace
+
+    return DeepFace
+
+
+def load_models(model_name="ArcFace"):
+    """
+    Build RetinaFace and the `model_name` recognizer in parallel; both are
+    cached, so later calls reuse them. Returns the seconds each model took
+    to load.
+    """
+    DeepFace = load_library()
+
+    def build(model_name, task):
+        start = time.perf_counter()
+        DeepFace.build_model(model_name=model_name, task=task)
+        return time.perf_counter() - start
+
+    def build_onnx():
+        start = time.perf_counter()
+        onnx_recognizer()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        detector = pool.submit(build, "retinaface", "face_detector")
+        if _use_onnx(model_name):
+            recognizer = pool.submit(build_onnx)
+        else:
+            recognizer = pool.submit(build, model_name, "facial_recognition")
+        return {"load_detector": detector.result(), "load_recognizer": recognizer.result()}
+
+
+def warm_up(image_path=WARMUP_IMAGE, model_name="ArcFace"):
+    """
+    Run detection and embedding once on a sample photo, so graph tracing and
+    allocator setup happen now instead of on the first real upload.
+    Returns the number of faces found.
+    """
+    img = cv2.imread(image_path)
+    if img is None:
+        raise FileNotFoundError(f"Warm-up image not found: {image_path}")
+    detections = [d for d in detect_faces(img) if d.get("confidence", 0) > 0]
+    get_embeddings_from_faces([d["face"] for d in detections], model_name=model_name)
+    return len(detections)
+
+
+def onnx_recognizer():
+    """The ONNX ArcFace session, created on first use."""
+    global _onnx_recognizer
+    with _onnx_lock:
+        if _onnx_recognizer is None:
+            from utils.onnx_backend import OnnxRecognizer
+
+            # Same per-process thread budget gunicorn.conf.py gives TensorFlow
+            threads = int(os.environ.get("TF_NUM_INTRAOP_THREADS", 0))
+            _onnx_recognizer = OnnxRecognizer(ONNX_MODEL_PATH, num_threads=threads)
+        return _onnx_recognizer
+
+
+def _recognizer(model_name):
+    return load_library().build_model(model_name=model_name, task="facial_recognition")
+
+
+def _use_onnx(model_name, backend=None):
+    """Whether `model_name` runs on ONNX Runtime, which only serves the exported ArcFace graph."""
+    return (backend or INFERENCE_BACKEND) == "onnx" and model_name == "ArcFace"
 
 
 # ==================== Image Processing ====================
@@ -19,46 +109,336 @@ def bytes_to_cv2_image(image_bytes):
     return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
 
 
-def get_embedding_from_cv2_image(img):
+def get_embedding_from_cv2_image(img, model_name="ArcFace"):
     """
-    Extract ArcFace embedding from cv2 image.
+    Extract a `model_name` embedding from cv2 image.
     Returns raw (unnormalized) embedding as list.
     """
+    if _use_onnx(model_name):
+        detections = [d for d in detect_faces(img) if d.get("confidence", 0) > 0]
+        if not detections:
+            raise ValueError("Face could not be detected in the image")
+        largest = max(detections, key=lambda d: d["facial_area"]["w"] * d["facial_area"]["h"])
+        return get_embedding_from_face(largest["face"])
+
+    DeepFace = load_library()
     embedding_obj = DeepFace.represent(
         img_path=img,
-        model_name="ArcFace",
+        model_name=model_name,
         detector_backend="retinaface",
         enforce_detection=True
     )
     return embedding_obj[0]['embedding']
 
 
+def get_embeddings_from_cv2_images(imgs, batch_size=32, model_name="ArcFace"):
+    """
+    Extract one `model_name` embedding per image (its largest face) in batched passes.
+    Returns (embeddings, found) where `found` lists the indexes of the images
+    that contained a face; embeddings has one row per such image.
+    """
+    faces = []
+    found = []
+
+    for index, img in enumerate(imgs):
+        # enforce_detection=False returns the whole image with confidence 0 if no face
+        detections = [d for d in detect_faces(img) if d.get("confidence", 0) > 0]
+        if not detections:
+            continue
+        largest = max(detections, key=lambda d: d["facial_area"]["w"] * d["facial_area"]["h"])
+        faces.append(largest["face"])
+        found.append(index)
+
+    return get_embeddings_from_faces(faces, batch_size=batch_size, model_name=model_name), found
+
+
 def detect_faces(img):
     """
     Detect all faces in an image.
     Returns list of face detections with facial areas and face images.
     """
-    return DeepFace.extract_faces(
+    return load_library().extract_faces(
         img_path=img,
         detector_backend='retinaface',
         enforce_detection=False
     )
 
 
-def get_embedding_from_face(face_img):
+def get_embedding_from_face(face_img, model_name="ArcFace"):
     """
     Extract embedding from already-detected face image.
     Skips face detection for speed.
     """
-    embedding_obj = DeepFace.represent(
+    if _use_onnx(model_name):
+        return onnx_recognizer().embed([face_img])[0].tolist()
+    embedding_obj = load_library().represent(
         img_path=face_img,
-        model_name="ArcFace",
+        model_name=model_name,
         detector_backend="skip",
         enforce_detection=False
     )[0]
     return embedding_obj["embedding"]
 
 
+def get_embeddings_from_faces(face_imgs, batch_size=32, backend=None, model_name="ArcFace"):
+    """
+    Extract embeddings for many already-detected faces at once.
+    Faces are stacked and run through `model_name` in chunks of `batch_size`,
+    giving the same embeddings as calling get_embedding_from_face per face.
+    `backend` overrides INFERENCE_BACKEND, e.g. to compare the two.
+    Returns float32 array of shape (N, D), D = 512 for ArcFace.
+    """
+    if _use_onnx(model_name, backend):
+        return onnx_recognizer().embed(face_imgs, batch_size=batch_size)
+
+    DeepFace = load_library()
+    embeddings = []
+
+    for start in range(0, len(face_imgs), batch_size):
+        batch = list(face_imgs[start:start + batch_size])
+        embedding_objs = DeepFace.represent(
+            img_path=batch,
+            model_name=model_name,
+            detector_backend="skip",
+            enforce_detection=False
+        )
+        # A single-image batch is not wrapped in an outer list
+        if len(batch) == 1:
+            embedding_objs = [embedding_objs]
+        embeddings.extend(objs[0]["embedding"] for objs in embedding_objs)
+
+    if not embeddings:
+        return np.zeros((0, _recognizer(model_name).output_shape), dtype=np.float32)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+# ==================== High-Resolution Detection ====================
+# Phone photos of 12-48 MP are decoded at reduced resolution for RetinaFace:
+# one coarse pass over the whole frame for near faces plus overlapping tiles
+# at twice that scale for small back-row faces. Boxes are mapped back to the
+# original image, and faces are cropped from full resolution for embedding.
+
+DETECTION_MAX_SIDE = 1600  # Longest side RetinaFace is given in one pass
+DETECTION_TILE_OVERLAP = 0.25  # Fraction of a tile shared with its neighbour
+DETECTION_NMS_IOU = 0.4
+
+
+def read_image_size(image_bytes):
+    """
+    Read (width, height) from a JPEG or PNG header without decoding pixels.
+    JPEG segments are walked by their lengths, however large the metadata
+    before the frame header. Returns None for other formats, malformed
+    headers, or when `image_bytes` ends before the frame header.
+    """
+    data = memoryview(image_bytes).cast("B")
+
+    if len(data) >= 24 and data[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # No length field
+            i += 2
+            continue
+        if marker == 0xDA:  # Start of scan; the frame header must come before it
+            return None
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        # SOF0-SOF15 carry the frame size; C4, C8 and CC are other segments
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def detect_faces_from_bytes(image_bytes, max_side=DETECTION_MAX_SIDE):
+    """
+    Decode an uploaded image and detect all faces in it.
+    Images no larger than `max_side` take the plain detect_faces path; larger
+    ones go through the reduced-resolution pyramid described above.
+    Returns None if the bytes are not a decodable image, otherwise the same
+    list of detections as detect_faces, in original-image coordinates and
+    without its whole-image placeholder when there is no face.
+    """
+    np_arr = np.frombuffer(image_bytes, np.uint8)
+    size = read_image_size(image_bytes)
+
+    if size is None or max(size) <= max_side:
+        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        if max(img.shape[:2]) <= max_side:
+            # enforce_detection=False returns the whole image with confidence 0 if no face
+            return [d for d in detect_faces(img) if d.get("confidence", 0) > 0]
+        reduced, reduction = img, 1
+    else:
+        # Decode at the smallest JPEG scale that still covers the fine level
+        fine_side = min(max(size), 2 * max_side)
+        reduction, flag = 1, cv2.IMREAD_COLOR
+        for factor, reduced_flag in (
+            (8, cv2.IMREAD_REDUCED_COLOR_8),
+            (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2),
+        ):
+            if max(size) / factor >= fine_side:
+                reduction, flag = factor, reduced_flag
+                break
+        reduced = cv2.imdecode(np_arr, flag)
+        if reduced is None:
+            return None
+
+    areas = _detect_pyramid(reduced, max_side)
+    reduced_shape = reduced.shape[:2]
+    if reduction > 1:
+        del reduced
+        full = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    else:
+        full = reduced
+
+    # Map boxes from the reduced decode to full resolution
+    scale = full.shape[1] / reduced_shape[1]
+    detections = []
+    for area, confidence in areas:
+        area = _scale_area(area, scale, full.shape)
+        detections.append(
+            {
+                "face": _crop_aligned_face(full, area),
+                "facial_area": area,
+                "confidence": confidence,
+            }
+        )
+    return detections
+
+
+def _detect_pyramid(img, max_side):
+    """Coarse whole-image pass plus overlapping fine tiles, merged with NMS."""
+    long_side = max(img.shape[:2])
+    candidates = []
+
+    # Coarse level: whole frame at max_side
+    coarse_scale = max_side / long_side
+    coarse = cv2.resize(img, None, fx=coarse_scale, fy=coarse_scale, interpolation=cv2.INTER_AREA)
+    candidates += _detect_areas(coarse, 0, 0, 1 / coarse_scale)
+    del coarse
+
+    # Fine level: up to twice the coarse resolution, in max_side tiles
+    fine_scale = min(1.0, 2 * max_side / long_side)
+    fine = img if fine_scale == 1.0 else cv2.resize(
+        img, None, fx=fine_scale, fy=fine_scale, interpolation=cv2.INTER_AREA
+    )
+    step = int(max_side * (1 - DETECTION_TILE_OVERLAP))
+    height, width = fine.shape[:2]
+    for y in _tile_starts(height, max_side, step):
+        for x in _tile_starts(width, max_side, step):
+            tile = fine[y:y + max_side, x:x + max_side]
+            candidates += _detect_areas(tile, x, y, 1 / fine_scale)
+
+    return _non_max_suppression(candidates, DETECTION_NMS_IOU)
+
+
+def _tile_starts(length, tile, step):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, step))
+    return starts + [length - tile]
+
+
+def _detect_areas(img, offset_x, offset_y, scale):
+    """Run RetinaFace on one tile and return (facial_area, confidence) in parent coordinates."""
+    detections = load_library().extract_faces(
+        img_path=img,
+        detector_backend='retinaface',
+        enforce_detection=False,
+        align=False
+    )
+    areas = []
+    for detection in detections:
+        # enforce_detection=False returns the whole tile with confidence 0 if no face
+        if not detection.get("confidence"):
+            continue
+        area = dict(detection["facial_area"])
+        area["x"] += offset_x
+        area["y"] += offset_y
+        for key, value in area.items():
+            if isinstance(value, (tuple, list)):
+                area[key] = (value[0] + offset_x, value[1] + offset_y)
+        areas.append((_scale_area(area, scale), detection["confidence"]))
+    return areas
+
+
+def _scale_area(area, scale, shape=None):
+    """Scale a facial_area dict (box and landmarks), clipping to `shape` if given."""
+    scaled = {}
+    for key, value in area.items():
+        if value is None:
+            scaled[key] = None
+        elif isinstance(value, (tuple, list)):
+            scaled[key] = (int(round(value[0] * scale)), int(round(value[1] * scale)))
+        else:
+            scaled[key] = int(round(value * scale))
+    if shape is not None:
+        scaled["x"] = min(max(0, scaled["x"]), shape[1] - 1)
+        scaled["y"] = min(max(0, scaled["y"]), shape[0] - 1)
+        scaled["w"] = min(scaled["w"], shape[1] - scaled["x"])
+        scaled["h"] = min(scaled["h"], shape[0] - scaled["y"])
+    return scaled
+
+
+def _non_max_suppression(candidates, iou_threshold):
+    """
+    Keep the most confident box among overlapping ones. A box mostly inside
+    a kept box (a face cut at a tile edge) is dropped as well.
+    """
+    candidates = sorted(candidates, key=lambda c: c[1], reverse=True)
+    kept = []
+    for area, confidence in candidates:
+        x1, y1 = area["x"], area["y"]
+        x2, y2 = x1 + area["w"], y1 + area["h"]
+        duplicate = False
+        for other, _ in kept:
+            ox1, oy1 = other["x"], other["y"]
+            ox2, oy2 = ox1 + other["w"], oy1 + other["h"]
+            inter = max(0, min(x2, ox2) - max(x1, ox1)) * max(0, min(y2, oy2) - max(y1, oy1))
+            area_a, area_b = area["w"] * area["h"], other["w"] * other["h"]
+            union = area_a + area_b - inter
+            if union > 0 and (inter / union > iou_threshold or inter / max(1, min(area_a, area_b)) > 0.7):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append((area, confidence))
+    return kept
+
+
+def _crop_aligned_face(img, area):
+    """
+    Crop and eye-align one face from a BGR image the way DeepFace.extract_faces
+    does. Returns an RGB float image in [0, 1].
+    """
+    from deepface.modules.detection import align_img_wrt_eyes, extract_sub_image, project_facial_area
+
+    x, y, w, h = area["x"], area["y"], area["w"], area["h"]
+    sub_img, relative_x, relative_y = extract_sub_image(img=img, facial_area=(x, y, w, h))
+    aligned, angle = align_img_wrt_eyes(
+        img=sub_img, left_eye=area.get("left_eye"), right_eye=area.get("right_eye")
+    )
+    x1, y1, x2, y2 = project_facial_area(
+        facial_area=(relative_x, relative_y, relative_x + w, relative_y + h),
+        angle=angle,
+        size=(sub_img.shape[0], sub_img.shape[1]),
+    )
+    face = aligned[int(y1):int(y2), int(x1):int(x2)]
+    return face[:, :, ::-1] / 255
+
+
 # ==================== Distance Calculations (DeepFace's Exact Implementation) ====================
 
 def find_cosine_distance(source_representation, test_representation):
@@ -128,6 +508,65 @@ def find_distance(alpha_embedding, beta_embedding, distance_metric="cosine"):
     return float(np.round(distance, 6))
 
 
+def pairwise_distances(queries, gallery, distance_metric="cosine", gallery_norms=None, dtype=np.float64,
+                       chunk_size=8192):
+    """
+    Distances from every query to every gallery embedding in one call;
+    in float64 these agree with find_distance to well under its rounding
+    (euclidean distances of near-identical embeddings are then taken from
+    their differences, so identical ones are exactly 0, as there).
+
+    Args:
+        queries: (Q, D) embeddings, or a single (D,) embedding
+        gallery: (G, D) embeddings
+        distance_metric: "cosine", "euclidean", or "euclidean_l2"
+        gallery_norms: Precomputed lengths of the gallery rows, e.g. kept
+            by the caller across searches; computed here if None
+        dtype: np.float32 halves the memory traffic when only ranking
+        chunk_size: Gallery rows converted and multiplied at a time, which
+            bounds the temporary copies for large galleries
+
+    Returns:
+        (Q, G) array of distances; zero-length embeddings count as
+        unit-length, so they give finite distances.
+    """
+    if distance_metric not in ("cosine", "euclidean", "euclidean_l2"):
+        raise ValueError(f"Invalid distance_metric: {distance_metric}")
+
+    queries = np.atleast_2d(np.asarray(queries, dtype=dtype))
+    gallery = np.asarray(gallery)
+    exact = np.dtype(dtype) == np.float64
+    query_norms = np.linalg.norm(queries, axis=1)
+    safe_query_norms = np.where(query_norms > 0, query_norms, 1)[:, np.newaxis]
+    if gallery_norms is not None:
+        gallery_norms = np.asarray(gallery_norms, dtype=dtype)
+
+    distances = np.empty((len(queries), len(gallery)), dtype=dtype)
+    for start in range(0, len(gallery), chunk_size):
+        rows = gallery[start:start + chunk_size].astype(dtype, copy=False)
+        if gallery_norms is None:
+            norms = np.linalg.norm(rows, axis=1)
+        else:
+            norms = gallery_norms[start:start + chunk_size]
+        dot = queries @ rows.T
+        if distance_metric == "euclidean":
+            scale = query_norms[:, np.newaxis] ** 2 + norms[np.newaxis, :] ** 2
+            chunk = np.sqrt(np.maximum(scale - 2 * dot, 0))
+            if exact:
+                # |q|^2 + |g|^2 - 2 q.g cancels badly for near-identical
+                # vectors; take those few from their differences instead
+                for q, g in zip(*np.nonzero(chunk ** 2 <= 1e-6 * scale)):
+                    chunk[q, g] = np.linalg.norm(rows[g] - queries[q])
+            distances[:, start:start + len(rows)] = chunk
+            continue
+        similarity = dot / safe_query_norms / np.where(norms > 0, norms, 1)[np.newaxis, :]
+        if distance_metric == "cosine":
+            distances[:, start:start + len(rows)] = 1 - similarity
+        else:
+            distances[:, start:start + len(rows)] = np.sqrt(np.maximum(2 - 2 * similarity, 0))
+    return distances
+
+
 # ==================== Thresholds (DeepFace's Official Values) ====================
 
 def get_threshold(model_name="ArcFace", distance_metric="cosine"):
@@ -170,34 +609,37 @@ def find_best_match(query_embedding, stored_embeddings_dict, distance_metric="co
     """
     if threshold is None:
         threshold = get_threshold("ArcFace", distance_metric)
-    
+
+    students = [
+        (roll_number, student_data)
+        for roll_number, student_data in stored_embeddings_dict.items()
+        if student_data.get("embedding") is not None
+    ]
     matches = []
-    
-    for roll_number, student_data in stored_embeddings_dict.items():
-        stored_embedding = student_data.get("embedding")
-        if stored_embedding is None:
-            continue
-        
-        distance = find_distance(query_embedding, stored_embedding, distance_metric)
-        
-        matches.append({
-            "roll_number": roll_number,
-            "name": student_data.get("name"),
-            "distance": distance,
-            "verified": distance <= threshold
-        })
-    
-    # Sort by distance (closest first)
-    matches.sort(key=lambda x: x["distance"])
-    
+
+    if students:
+        # One vectorized pass over all students, rounded like find_distance
+        stored = np.array([student_data["embedding"] for _, student_data in students], dtype=np.float64)
+        distances = np.round(pairwise_distances(query_embedding, stored, distance_metric)[0], 6)
+        # Stable, so ties keep the dictionary's order as the per-student loop did
+        for i in np.argsort(distances, kind="stable")[:5]:
+            roll_number, student_data = students[i]
+            distance = float(distances[i])
+            matches.append({
+                "roll_number": roll_number,
+                "name": student_data.get("name"),
+                "distance": distance,
+                "verified": distance <= threshold
+            })
+
     # Return best match if verified
     if matches and matches[0]["verified"]:
         return {
             "best_match": matches[0],
-            "all_matches": matches[:5]
+            "all_matches": matches
         }
-    
+
     return {
         "best_match": None,
-        "all_matches": matches[:5]
-    }
\ No newline at end of file
+        "all_matches": matches
+    }
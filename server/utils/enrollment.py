@@ -0,0 +1,599 @@
+"""
+Student enrollment helpers.
+Combines several registration photos of one student into a single
+gallery entry, discarding samples that do not look like the rest,
+bulk-imports whole class rosters, and keeps the photos so the gallery can
+be re-embedded when the recognition model changes.
+"""
+
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+
+class EnrollmentError(ValueError):
+    """Raised when registration images cannot form a consistent student entry."""
+
+
+# ==================== Sample Aggregation ====================
+
+def summarize_samples(embeddings, max_distance=0.68):
+    """
+    Reject outlier samples and compute the student's centroid embedding.
+
+    A sample is an outlier when its median cosine distance to the other
+    samples exceeds `max_distance` (the ArcFace cosine threshold by default),
+    i.e. it would not verify as the same person as most other photos.
+
+    Args:
+        embeddings: (N, D) raw embeddings, one per registration photo
+
+    Returns:
+        tuple: (centroid, inlier_mask). The centroid points along the mean of
+        the L2-normalized inliers and is scaled to their mean length, so it
+        works for cosine, euclidean and euclidean_l2 matching alike.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    if len(embeddings) == 0:
+        raise EnrollmentError("No face found in any registration image")
+
+    norms = np.linalg.norm(embeddings, axis=1)
+    normalized = embeddings / norms[:, np.newaxis]
+
+    inliers = np.ones(len(embeddings), dtype=bool)
+    if len(embeddings) >= 2:
+        distances = 1 - normalized @ normalized.T
+        np.fill_diagonal(distances, np.nan)
+        median_distances = np.nanmedian(distances, axis=1)
+        inliers = median_distances <= max_distance
+
+        # More than half the photos must agree on who the student is
+        if inliers.sum() * 2 <= len(embeddings):
+            raise EnrollmentError("Registration images do not appear to show the same person")
+
+    direction = normalized[inliers].mean(axis=0)
+    centroid = direction / np.linalg.norm(direction) * norms[inliers].mean()
+    return centroid.astype(np.float32), inliers
+
+
+# ==================== Bulk Import ====================
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+
+def parse_roster_filename(filename):
+    """'<roll_number>_<name>.jpg' -> (roll_number, name), or None if it does not match."""
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    if ext.lower() not in IMAGE_EXTENSIONS:
+        return None
+    roll_number, sep, name = stem.partition("_")
+    if not roll_number or not sep or not name:
+        return None
+    return roll_number, name.replace("_", " ").strip()
+
+
+def read_roster_csv(csv_file):
+    """Read an optional roster CSV with roll_number and name columns into {roll_number: name}."""
+    if isinstance(csv_file, str):
+        with open(csv_file, newline="", encoding="utf-8-sig") as f:
+            return read_roster_csv(f)
+    return {
+        row["roll_number"].strip(): row["name"].strip()
+        for row in csv.DictReader(csv_file)
+        if row.get("roll_number") and row.get("name")
+    }
+
+
+def list_roster_files(source):
+    """Image file names in a directory or zip archive."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return [
+                info.filename
+                for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+    return sorted(
+        name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+class RosterReader:
+    """
+    Reads images from a directory or zip archive. A zip is opened once and
+    kept open until close(), since every open parses its whole central
+    directory; use one reader per import (or per worker process).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+
+    def read(self, filename):
+        """Bytes of one image."""
+        if self._archive is not None:
+            if self._archive.getinfo(filename).file_size > MAX_IMAGE_BYTES:
+                raise ValueError("Image file too large")
+            return self._archive.read(filename)
+        path = os.path.join(self.source, os.path.basename(filename))
+        if os.path.getsize(path) > MAX_IMAGE_BYTES:
+            raise ValueError("Image file too large")
+        with open(path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_roster_file(source, filename):
+    """Bytes of one image from a directory or zip archive; use RosterReader for many."""
+    with RosterReader(source) as roster:
+        return roster.read(filename)
+
+
+def _read_all(roster, filenames):
+    """Bytes of each readable image among `filenames`, skipping the rest."""
+    contents = []
+    for filename in filenames:
+        try:
+            contents.append(roster.read(filename))
+        except (OSError, KeyError, ValueError):
+            continue
+    return contents
+
+
+def group_roster(filenames, names=None):
+    """
+    Group image files by roll number.
+    Returns ([(roll_number, name, [filenames])], ignored_filenames); names from
+    the CSV take precedence over names in file names.
+    """
+    names = names or {}
+    students = {}
+    ignored = []
+
+    for filename in filenames:
+        parsed = parse_roster_filename(filename)
+        if parsed is None:
+            ignored.append(filename)
+            continue
+        roll_number, name = parsed
+        entry = students.setdefault(roll_number, [names.get(roll_number, name), []])
+        entry[1].append(filename)
+
+    return [(roll, name, files) for roll, (name, files) in students.items()], ignored
+
+
+def embed_roster_chunk(source, students, max_distance=0.68, batch_size=32, model_name="ArcFace"):
+    """
+    Worker task: embed the images of a few students in one batched pass.
+    Returns one dict per student, either a student document or an error.
+    """
+    if _worker_roster is not None and _worker_roster.source == source:
+        return _embed_roster(_worker_roster, students, max_distance, batch_size, model_name)
+    with RosterReader(source) as roster:
+        return _embed_roster(roster, students, max_distance, batch_size, model_name)
+
+
+def _embed_roster(roster, students, max_distance, batch_size, model_name):
+    return _embed_students(
+        students, lambda roll_number, filename: roster.read(filename), max_distance, batch_size, model_name
+    )
+
+
+def _embed_students(students, read_image, max_distance, batch_size, model_name):
+    """
+    Embed the photos of (roll_number, name, [filenames]) students in one
+    batched pass, reading each with `read_image(roll_number, filename)`.
+    Returns one dict per student, either a student document or an error.
+    """
+    from utils.deepface import bytes_to_cv2_image, get_embeddings_from_cv2_images
+
+    imgs, owners = [], []
+    errors = {roll_number: [] for roll_number, _, _ in students}
+
+    for index, (roll_number, _, filenames) in enumerate(students):
+        for filename in filenames:
+            try:
+                img = bytes_to_cv2_image(read_image(roll_number, filename))
+            except Exception as e:
+                errors[roll_number].append(f"{filename}: {e}")
+                continue
+            if img is None:
+                errors[roll_number].append(f"{filename}: Invalid image format")
+                continue
+            imgs.append(img)
+            owners.append(index)
+
+    embeddings, found = get_embeddings_from_cv2_images(imgs, batch_size=batch_size, model_name=model_name)
+    found_owners = np.array([owners[i] for i in found], dtype=np.int64)
+
+    results = []
+    for index, (roll_number, name, filenames) in enumerate(students):
+        student_embeddings = embeddings[found_owners == index]
+        try:
+            centroid, inliers = summarize_samples(student_embeddings, max_distance=max_distance)
+        except EnrollmentError as e:
+            results.append(
+                {
+                    "roll_number": roll_number,
+                    "files": filenames,
+                    "error": "; ".join(errors[roll_number] + [str(e)]),
+                }
+            )
+            continue
+
+        results.append(
+            {
+                "roll_number": roll_number,
+                "files": filenames,
+                "file_errors": errors[roll_number],
+                "document": {
+                    "name": name,
+                    "roll_number": roll_number,
+                    "embedding": centroid.tolist(),
+                    "samples": [s.tolist() for s in student_embeddings[inliers]],
+                    "model": model_name,
+                },
+            }
+        )
+    return results
+
+
+def _read_state(state_path):
+    done = set()
+    if state_path and os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written last line after a crash
+                if record.get("status") == "ok":
+                    done.add(record["roll_number"])
+    return done
+
+
+def _append_state(state_path, records):
+    if not state_path or not records:
+        return
+    with open(state_path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Roster opened by _init_worker, read by every chunk the process embeds
+_worker_roster = None
+
+
+def _init_worker(model_name="ArcFace", source=None):
+    """Load both models once per import process, before it takes chunks, and open the roster."""
+    global _worker_roster
+    importlib.import_module("utils.deepface").load_models(model_name)
+    if source is not None:
+        _worker_roster = RosterReader(source)
+
+
+def import_roster(
+    source,
+    save_batch,
+    names=None,
+    state_path=None,
+    workers=2,
+    chunk_size=16,
+    commit_size=400,
+    max_distance=0.68,
+    batch_size=32,
+    sections=None,
+    progress=None,
+    model_name="ArcFace",
+    images=None,
+):
+    """
+    Enroll every student in a directory or zip of '<roll_number>_<name>.jpg' files.
+
+    Students are embedded with `model_name` in chunks of `chunk_size` by a
+    pool of `workers` processes (0 runs inline) and written by
+    `save_batch(documents)` in groups of `commit_size`, e.g. a store's
+    save_students. Per-student failures are collected, not raised.
+    With `state_path`, committed roll numbers are recorded so an interrupted
+    run resumes where it stopped. Every imported student is put in `sections`,
+    and their photos are kept in `images` (EnrollmentImages), if given.
+
+    Returns:
+        dict: total, imported, skipped (already done), failed students,
+        file_errors (unusable images of students that were still enrolled)
+        and ignored_files (names not matching the pattern)
+    """
+    with RosterReader(source) as roster:
+        progress = progress or (lambda stage: None)
+        students, ignored = group_roster(list_roster_files(source), names)
+        done = _read_state(state_path)
+        pending = [s for s in students if s[0] not in done]
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+        summary = {
+            "total": len(students),
+            "imported": 0,
+            "skipped": len(students) - len(pending),
+            "failed": [],
+            "file_errors": [],
+            "ignored_files": ignored,
+        }
+        buffer = []
+
+        def flush():
+            if buffer:
+                if images is not None:
+                    for result in buffer:
+                        images.save(result["roll_number"], _read_all(roster, result["files"]))
+                save_batch([r["document"] for r in buffer])
+                _append_state(state_path, [{"roll_number": r["roll_number"], "status": "ok"} for r in buffer])
+                summary["imported"] += len(buffer)
+                buffer.clear()
+
+        def collect(results):
+            for result in results:
+                if "error" in result:
+                    summary["failed"].append(result)
+                    _append_state(state_path, [{**result, "status": "failed"}])
+                else:
+                    summary["file_errors"].extend(result["file_errors"])
+                    result["document"]["sections"] = list(sections or ())
+                    buffer.append(result)
+            if len(buffer) >= commit_size:
+                flush()
+            processed = summary["imported"] + len(buffer) + len(summary["failed"])
+            progress(f"processed {processed}/{len(pending)}")
+
+        args = (max_distance, batch_size, model_name)
+        if workers == 0:
+            for chunk in chunks:
+                collect(_embed_roster(roster, chunk, *args))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, source),
+            ) as executor:
+                futures = [executor.submit(embed_roster_chunk, source, chunk, *args) for chunk in chunks]
+                # Collected in submission order so the state file grows predictably
+                for future, chunk in zip(futures, chunks):
+                    try:
+                        collect(future.result())
+                    except Exception as e:
+                        collect(
+                            [{"roll_number": r, "files": f, "error": str(e)} for r, _, f in chunk]
+                        )
+        flush()
+        return summary
+
+
+# ==================== Retained Images ====================
+
+class EnrollmentImages:
+    """
+    Registration photos kept on disk, one directory per student, so every
+    student can be embedded again with another recognition model.
+    Saving replaces a student's previous photos as a whole.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, roll_number):
+        # Roll numbers are user input; dots are escaped too, so ".." stays a plain name
+        return os.path.join(self.directory, quote(roll_number, safe="").replace(".", "%2E"))
+
+    def save(self, roll_number, images):
+        """Keep the raw bytes of `images` as the student's photos."""
+        path = self._path(roll_number)
+        staging = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(staging)
+        for index, data in enumerate(images):
+            with open(os.path.join(staging, f"{index:03d}{_image_extension(data)}"), "wb") as f:
+                f.write(data)
+        # Swapped in with renames, so a crash leaves either the old photos or the new ones
+        retired = f"{staging}.old"
+        if os.path.exists(path):
+            os.replace(path, retired)
+        os.replace(staging, path)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    def files(self, roll_number):
+        """Names of a student's kept photos; empty if there are none."""
+        path = self._path(roll_number)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def read(self, roll_number, filename):
+        with open(os.path.join(self._path(roll_number), os.path.basename(filename)), "rb") as f:
+            return f.read()
+
+    def delete(self, roll_number):
+        shutil.rmtree(self._path(roll_number), ignore_errors=True)
+
+    def roll_numbers(self):
+        return {
+            unquote(name)
+            for name in os.listdir(self.directory)
+            if not name.endswith((".tmp", ".old")) and os.path.isdir(os.path.join(self.directory, name))
+        }
+
+
+def _image_extension(data):
+    if data[:2] == b"\xff\xd8":
+        return ".jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    return ".img"
+
+
+def retain_roster_images(source, images, names=None):
+    """
+    Keep the photos of a roster (as for import_roster) for the students that
+    have none yet, e.g. ones enrolled before photos were kept.
+    Returns the number of students whose photos were added.
+    """
+    students, _ = group_roster(list_roster_files(source), names)
+    kept = images.roll_numbers()
+    added = 0
+    with RosterReader(source) as roster:
+        for roll_number, _, filenames in students:
+            if roll_number not in kept:
+                images.save(roll_number, _read_all(roster, filenames))
+                added += 1
+    return added
+
+
+# ==================== Re-embedding ====================
+
+def reembed_chunk(directory, students, max_distance, batch_size, model_name):
+    """Worker task: embed a few (roll_number, name) students again from their kept photos."""
+    images = EnrollmentImages(directory)
+    students = [(roll_number, name, images.files(roll_number)) for roll_number, name in students]
+    missing = [
+        {"roll_number": roll_number, "files": [], "error": "No kept enrollment photos"}
+        for roll_number, _, filenames in students
+        if not filenames
+    ]
+    students = [student for student in students if student[2]]
+    if not students:
+        return missing
+    return missing + _embed_students(students, images.read, max_distance, batch_size, model_name)
+
+
+def reembed_gallery(
+    store,
+    images,
+    model_name,
+    workers=2,
+    chunk_size=16,
+    commit_size=400,
+    max_distance=None,
+    batch_size=32,
+    progress=None,
+):
+    """
+    Compute a `model_name` version of every student's embedding from the
+    photos kept in `images` (EnrollmentImages), alongside the versions the
+    server is using.
+
+    Students are embedded in chunks of `chunk_size` by a pool of `workers`
+    processes (0 runs inline) and written with store.save_embeddings in
+    groups of `commit_size`. Students that already have the version are
+    skipped, so an interrupted run resumes where it stopped. `progress`
+    receives a line with the throughput and estimated time remaining after
+    every chunk. `max_distance` defaults to the model's cosine threshold.
+
+    Returns:
+        dict: total, reembedded, skipped (already done), failed students,
+        file_errors, missing (students still without the version, e.g.
+        failed or enrolled meanwhile), seconds and images_per_second
+    """
+    if max_distance is None:
+        from utils.deepface import get_threshold
+
+        max_distance = get_threshold(model_name, "cosine")
+    progress = progress or (lambda stage: None)
+
+    students = [(s["roll_number"], s["name"]) for s in store.list_students()]
+    done = store.embedded_roll_numbers(model_name)
+    pending = [s for s in students if s[0] not in done]
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    summary = {
+        "total": len(students),
+        "reembedded": 0,
+        "skipped": len(students) - len(pending),
+        "failed": [],
+        "file_errors": [],
+    }
+    buffer = []
+    started = time.perf_counter()
+    processed = [0, 0]  # students, images
+
+    def flush():
+        if buffer:
+            store.save_embeddings(model_name, [r["document"] for r in buffer])
+            summary["reembedded"] += len(buffer)
+            buffer.clear()
+
+    def collect(results):
+        for result in results:
+            processed[1] += len(result["files"])
+            if "error" in result:
+                summary["failed"].append(result)
+            else:
+                summary["file_errors"].extend(result["file_errors"])
+                buffer.append(result)
+        processed[0] += len(results)
+        if len(buffer) >= commit_size:
+            flush()
+
+        elapsed = time.perf_counter() - started
+        rate = processed[0] / elapsed if elapsed > 0 else 0.0
+        remaining = (len(pending) - processed[0]) / rate if rate > 0 else float("inf")
+        progress(
+            f"processed {processed[0]}/{len(pending)} students, "
+            f"{rate:.2f} students/s, {processed[1] / max(elapsed, 1e-9):.1f} images/s, "
+            f"ETA {_format_duration(remaining)}"
+        )
+
+    args = (max_distance, batch_size, model_name)
+    if workers == 0:
+        for chunk in chunks:
+            collect(reembed_chunk(images.directory, chunk, *args))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name,),
+        ) as executor:
+            futures = [executor.submit(reembed_chunk, images.directory, chunk, *args) for chunk in chunks]
+            for future, chunk in zip(futures, chunks):
+                try:
+                    collect(future.result())
+                except Exception as e:
+                    collect([{"roll_number": r, "files": [], "error": str(e)} for r, _ in chunk])
+    flush()
+
+    seconds = time.perf_counter() - started
+    current = {s["roll_number"] for s in store.list_students()}
+    summary["missing"] = sorted(current - store.embedded_roll_numbers(model_name))
+    summary["seconds"] = round(seconds, 1)
+    summary["images_per_second"] = round(processed[1] / seconds, 2) if seconds > 0 else 0.0
+    return summary
+
+
+def _format_duration(seconds):
+    if seconds == float("inf"):
+        return "unknown"
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
@@ -0,0 +1,441 @@
+"""
+In-memory gallery of enrolled student embeddings.
+Keeps every embedding in one contiguous float32 matrix so all detected faces
+can be matched with a single matrix multiply instead of a per-student loop.
+"""
+
+import threading
+
+import numpy as np
+
+from utils.ann import IVFIndex
+from utils.deepface import pairwise_distances
+
+
+# ==================== Gallery Index ====================
+
+class GalleryIndex:
+    """
+    Process-resident index of student embeddings.
+
+    Rows of `_matrix` hold the raw float32 embeddings (ArcFace emits float32,
+    so this is lossless) and `_norms` their precomputed lengths.
+    One float32 pass of `pairwise_distances` ranks every face against every
+    student; the short list is then rescored in float64, so distances match
+    `find_distance` after its rounding to 6 decimals.
+
+    Students may belong to sections (a class or course). Each section has a
+    small sub-matrix copy of its members' rows, built on load and rebuilt
+    lazily, per section, when its membership or a member's row changes.
+    """
+
+    # Extra candidates rescored per query to absorb float32 ranking error
+    RESCORE_SLACK = 8
+    # Candidates within this multiple of the threshold are re-ranked against
+    # their individual enrollment samples, not just the centroid
+    RERANK_MARGIN = 1.25
+
+    def __init__(self, capacity=256):
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._matrix = None
+        self._norms = np.zeros(capacity, dtype=np.float64)
+        self._roll_numbers = []
+        self._names = []
+        self._rows = {}
+        self._samples = {}
+        self._sections = {}  # roll number -> frozenset of sections
+        self._members = {}  # section -> set of roll numbers
+        self._section_indexes = {}  # section -> (rows, matrix, norms)
+        self._ann = None
+        self._ann_min_size = 0
+        # Bumped on every change so cached match results can be invalidated
+        self.version = 0
+
+    def __len__(self):
+        return len(self._roll_numbers)
+
+    def __contains__(self, roll_number):
+        return roll_number in self._rows
+
+    # ---------- Updates ----------
+
+    def load(self, students):
+        """
+        Replace the index contents.
+        `students` is an iterable of dicts with roll_number, name and embedding.
+        """
+        with self._lock:
+            self._matrix = None
+            self._norms = np.zeros(self._capacity, dtype=np.float64)
+            self._roll_numbers = []
+            self._names = []
+            self._rows = {}
+            self._samples = {}
+            self._sections = {}
+            self._members = {}
+            self._section_indexes = {}
+            self.version += 1
+
+            for student in students:
+                embedding = student.get("embedding")
+                if embedding is None:
+                    continue
+                samples = [sample["embedding"] for sample in student.get("samples") or []]
+                self._put(student.get("roll_number"), student.get("name"), embedding, samples)
+                self._set_sections(student.get("roll_number"), student.get("sections") or ())
+
+            self._build_section_indexes()
+            if self._ann_ready():
+                self._sync_ann()
+
+    def load_arrays(self, roll_numbers, names, embeddings, samples=None, sections=None):
+        """
+        Replace the index contents from arrays in one vectorized copy.
+        `embeddings` is an (N, D) matrix aligned with `roll_numbers` and
+        `names`; `samples` maps roll numbers to (S, D) sample arrays and
+        `sections` maps roll numbers to their sections.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        size = len(roll_numbers)
+
+        with self._lock:
+            capacity = max(self._capacity, size)
+            self._matrix = None
+            self._norms = np.zeros(capacity, dtype=np.float64)
+            if size:
+                self._matrix = np.zeros((capacity, embeddings.shape[1]), dtype=np.float32)
+                self._matrix[:size] = embeddings
+                self._norms[:size] = np.linalg.norm(self._matrix[:size].astype(np.float64), axis=1)
+            self._roll_numbers = list(roll_numbers)
+            self._names = list(names)
+            self._rows = {roll_number: row for row, roll_number in enumerate(self._roll_numbers)}
+            self._samples = {
+                roll_number: np.asarray(student_samples, dtype=np.float32)
+                for roll_number, student_samples in (samples or {}).items()
+                if len(student_samples) > 1
+            }
+            self._sections = {}
+            self._members = {}
+            self._section_indexes = {}
+            for roll_number, student_sections in (sections or {}).items():
+                if roll_number in self._rows:
+                    self._set_sections(roll_number, student_sections)
+            self.version += 1
+
+            self._build_section_indexes()
+            if self._ann_ready():
+                self._sync_ann()
+
+    def add(self, roll_number, name, embedding, samples=None, sections=None):
+        """
+        Insert a student, or overwrite the existing row for this roll number.
+        `embedding` is the student's centroid; `samples` are the individual
+        enrollment embeddings used to re-rank close candidates. `sections`
+        replaces the student's memberships; None keeps the current ones.
+        """
+        with self._lock:
+            self._put(roll_number, name, embedding, samples)
+            self._invalidate_sections(roll_number)
+            if sections is not None:
+                self._set_sections(roll_number, sections)
+            if self._ann is not None and self._ann.is_trained:
+                self._ann.add(roll_number, embedding)
+
+    def set_sections(self, roll_number, sections):
+        """Replace a student's section memberships. Returns False for unknown students."""
+        with self._lock:
+            if roll_number not in self._rows:
+                return False
+            self._set_sections(roll_number, sections)
+            self.version += 1
+            return True
+
+    def sections(self):
+        """Number of students in each section."""
+        with self._lock:
+            return {section: len(members) for section, members in self._members.items()}
+
+    def members(self, section=None):
+        """(roll_number, name) of a section's students, or of all students, by roll number."""
+        with self._lock:
+            roll_numbers = self._roll_numbers if section is None else self._members.get(section, ())
+            return sorted((roll_number, self._names[self._rows[roll_number]]) for roll_number in roll_numbers)
+
+    def remove(self, roll_number):
+        """Drop a student. The last row is moved into the freed slot."""
+        with self._lock:
+            row = self._rows.pop(roll_number, None)
+            if row is None:
+                return False
+            self._samples.pop(roll_number, None)
+            self._set_sections(roll_number, ())
+            self.version += 1
+
+            last = len(self._roll_numbers) - 1
+            if row != last:
+                # The moved student's sections point at its old row
+                self._invalidate_sections(self._roll_numbers[last])
+                self._matrix[row] = self._matrix[last]
+                self._norms[row] = self._norms[last]
+                self._roll_numbers[row] = self._roll_numbers[last]
+                self._names[row] = self._names[last]
+                self._rows[self._roll_numbers[row]] = row
+
+            self._roll_numbers.pop()
+            self._names.pop()
+
+            if self._ann is not None and self._ann.is_trained:
+                self._ann.remove(roll_number)
+            return True
+
+    def _put(self, roll_number, name, embedding, samples=None):
+        self.version += 1
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector.astype(np.float64))
+
+        if self._matrix is None:
+            self._matrix = np.zeros((self._capacity, vector.shape[0]), dtype=np.float32)
+
+        row = self._rows.get(roll_number)
+        if row is None:
+            row = len(self._roll_numbers)
+            if row == self._matrix.shape[0]:
+                self._grow()
+            self._roll_numbers.append(roll_number)
+            self._names.append(name)
+            self._rows[roll_number] = row
+        else:
+            self._names[row] = name
+
+        self._matrix[row] = vector
+        self._norms[row] = norm
+
+        if samples is not None and len(samples) > 1:
+            self._samples[roll_number] = np.asarray(samples, dtype=np.float32)
+        else:
+            self._samples.pop(roll_number, None)
+
+    def _set_sections(self, roll_number, sections):
+        self._invalidate_sections(roll_number)
+        for section in self._sections.pop(roll_number, ()):
+            self._members[section].discard(roll_number)
+            if not self._members[section]:
+                del self._members[section]
+        sections = frozenset(sections)
+        if sections:
+            self._sections[roll_number] = sections
+            for section in sections:
+                self._members.setdefault(section, set()).add(roll_number)
+        self._invalidate_sections(roll_number)
+
+    def _invalidate_sections(self, roll_number):
+        for section in self._sections.get(roll_number, ()):
+            self._section_indexes.pop(section, None)
+
+    def _build_section_indexes(self):
+        for section in self._members:
+            self._section_index(section)
+
+    def _section_index(self, section):
+        """(global rows, sub-matrix, norms) for a section, rebuilt if stale."""
+        index = self._section_indexes.get(section)
+        if index is None:
+            rows = np.array(sorted(self._rows[r] for r in self._members.get(section, ())), dtype=np.int64)
+            if len(rows):
+                index = (rows, self._matrix[rows], self._norms[rows])
+            else:
+                index = (rows, np.zeros((0, 0), dtype=np.float32), np.zeros(0))
+            self._section_indexes[section] = index
+        return index
+
+    def _grow(self):
+        size = self._matrix.shape[0]
+        matrix = np.zeros((size * 2, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:size] = self._matrix
+        norms = np.zeros(size * 2, dtype=np.float64)
+        norms[:size] = self._norms
+        self._matrix = matrix
+        self._norms = norms
+
+    # ---------- Approximate Search ----------
+
+    def attach_ann(self, index, min_size=20000):
+        """
+        Use an approximate IVF index once the gallery has `min_size` students;
+        smaller galleries keep using exact search. A previously saved index is
+        brought in sync with the gallery incrementally, without retraining.
+        """
+        with self._lock:
+            self._ann = index
+            self._ann_min_size = min_size
+            if self._ann_ready():
+                self._sync_ann()
+
+    def ann_needs_training(self):
+        """True when the gallery is large enough for ANN but the index is missing or stale."""
+        size = len(self._roll_numbers)
+        return (
+            self._ann is not None
+            and size >= self._ann_min_size
+            and self._ann.needs_training(size)
+        )
+
+    def retrain_ann(self):
+        """
+        Retrain the IVF index on the current gallery and return it.
+        Training runs on a snapshot without holding the lock; updates made
+        meanwhile are merged in before the new index is swapped in.
+        """
+        with self._lock:
+            ids = list(self._roll_numbers)
+            vectors = self._matrix[:len(ids)].copy()
+            old = self._ann
+
+        index = IVFIndex(old.n_lists, old.n_probe, old.train_iterations, old.seed)
+        index.rebuild(ids, vectors)
+
+        with self._lock:
+            self._ann = index
+            self._sync_ann()
+        return index
+
+    def _ann_ready(self):
+        return self._ann is not None and self._ann.is_trained
+
+    def _use_ann(self, size):
+        return (
+            self._ann is not None
+            and size >= self._ann_min_size
+            and not self._ann.needs_training(size)
+        )
+
+    def _sync_ann(self):
+        """Make the ANN index hold exactly the gallery's current rows."""
+        size = len(self._roll_numbers)
+        for roll_number in self._ann.ids():
+            if roll_number not in self._rows:
+                self._ann.remove(roll_number)
+        if size:
+            self._ann.add_many(self._roll_numbers, self._matrix[:size])
+
+    # ---------- Matching ----------
+
+    def search(
+        self, query_embeddings, distance_metric="cosine", threshold=None, top_k=5, section=None, within_threshold=False
+    ):
+        """
+        Match every query embedding against the whole gallery at once.
+
+        Args:
+            query_embeddings: Sequence of raw embeddings, one per detected face
+            distance_metric: "cosine", "euclidean", or "euclidean_l2"
+            threshold: Verification threshold for the `verified` flag
+            top_k: Number of closest students returned per query
+            section: Only match against this section's students
+            within_threshold: Also return every student within `threshold`
+                of each query, from the same distance pass; for large
+                galleries, those in the IVF short list
+
+        Returns:
+            list: One list of match dicts per query, closest first, in the
+            same format as the per-student `find_distance` loop; with
+            `within_threshold`, a (top-k lists, within-threshold lists) pair
+        """
+        if within_threshold and threshold is None:
+            raise ValueError("within_threshold needs a threshold")
+        queries = np.asarray(query_embeddings, dtype=np.float64)
+        if queries.ndim == 1:
+            queries = queries[np.newaxis, :]
+        if len(queries) == 0:
+            return ([], []) if within_threshold else []
+
+        with self._lock:
+            if section is None:
+                section_rows = None
+                size = len(self._roll_numbers)
+                matrix = self._matrix[:size] if size else None
+                norms = self._norms[:size]
+            else:
+                section_rows, matrix, norms = self._section_index(section)
+                size = len(section_rows)
+
+            if size == 0:
+                empty = [[] for _ in range(len(queries))]
+                return (empty, [[] for _ in range(len(queries))]) if within_threshold else empty
+
+            shortlist_size = min(top_k + self.RESCORE_SLACK, size)
+
+            if section_rows is None and self._use_ann(size):
+                # Only the probed IVF cells are scanned for large galleries
+                shortlists = [
+                    np.array([self._rows[r] for r in candidates], dtype=np.int64)
+                    for candidates in self._ann.search(queries, shortlist_size, metric=distance_metric)
+                ]
+            else:
+                # Rank every face against every student with one float32 multiply
+                approx = pairwise_distances(
+                    queries, matrix, distance_metric, gallery_norms=norms, dtype=np.float32
+                )
+
+                if shortlist_size < size:
+                    shortlists = np.argpartition(approx, shortlist_size - 1, axis=1)[:, :shortlist_size]
+                else:
+                    shortlists = np.tile(np.arange(size), (len(queries), 1))
+                if within_threshold:
+                    # Plus everyone near enough to pass after the exact
+                    # rescore, or after reranking by their samples
+                    limit = threshold * (self.RERANK_MARGIN if self._samples else 1) + 1e-3
+                    shortlists = [
+                        np.union1d(rows, np.flatnonzero(distances <= limit))
+                        for rows, distances in zip(shortlists, approx)
+                    ]
+                if section_rows is not None:
+                    shortlists = [section_rows[rows] for rows in shortlists]
+
+            results, within = [], []
+            for query, rows in zip(queries, shortlists):
+                # Rescore the short list exactly, in float64
+                distances = pairwise_distances(
+                    query, self._matrix[rows], distance_metric, gallery_norms=self._norms[rows]
+                )[0]
+                if self._samples:
+                    distances = self._rerank(query, rows, distances, distance_metric, threshold)
+                distances = np.round(distances, 6)
+                order = np.lexsort((rows, distances))
+                results.append(self._matches(rows, distances, order[:top_k], threshold))
+                if within_threshold:
+                    within.append(self._matches(rows, distances, order[distances[order] <= threshold], threshold))
+
+            return (results, within) if within_threshold else results
+
+    def _matches(self, rows, distances, order, threshold):
+        matches = []
+        for row, distance in zip(rows[order], distances[order]):
+            distance = float(distance)
+            matches.append(
+                {
+                    "roll_number": self._roll_numbers[row],
+                    "name": self._names[row],
+                    "distance": distance,
+                    "verified": threshold is not None and distance <= threshold,
+                }
+            )
+        return matches
+
+    def _rerank(self, query, rows, distances, distance_metric, threshold):
+        """
+        For candidates close to the query, use the distance to their nearest
+        enrollment sample when it beats the centroid distance.
+        """
+        distances = distances.copy()
+        close = np.ones(len(rows), dtype=bool)
+        if threshold is not None:
+            close = distances <= threshold * self.RERANK_MARGIN
+
+        for i in np.flatnonzero(close):
+            samples = self._samples.get(self._roll_numbers[rows[i]])
+            if samples is not None:
+                sample_distances = pairwise_distances(query, samples, distance_metric)[0]
+                distances[i] = min(distances[i], sample_distances.min())
+        return distances
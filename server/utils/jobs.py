@@ -0,0 +1,334 @@
+"""
+Local job queue for background image analysis.
+A pool of spawned worker processes, each with its own preloaded model,
+runs the CPU-heavy steps while the Flask request returns immediately.
+"""
+
+import importlib
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class QueueFull(Exception):
+    """Raised when the queue already holds `max_pending` unfinished jobs."""
+
+
+# ==================== Worker Side ====================
+
+_progress_queue = None
+# Whether this worker has already run the model once (the first call is slow)
+_model_warm = False
+
+
+def _init_worker(progress_queue, preload, warmup):
+    """Runs once in every worker process before it takes jobs."""
+    global _progress_queue, _model_warm
+    _progress_queue = progress_queue
+    for module_name in preload:
+        importlib.import_module(module_name)
+    if warmup is not None:
+        warmup()
+        _model_warm = True
+    # job_id None tells the parent this worker is ready
+    progress_queue.put((None, "ready"))
+
+
+def _ping():
+    return None
+
+
+def report_progress(job_id, stage):
+    """Send a progress update for a job back to the parent process."""
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, stage))
+
+
+def _run_job(job_id, fn, args):
+    report_progress(job_id, "running")
+    return fn(*args, progress=lambda stage: report_progress(job_id, stage))
+
+
+def detect_and_embed(img_bytes, batch_size=32, quality=None, model_name="ArcFace", progress=None):
+    """
+    Worker task: decode an uploaded image, detect faces and embed them with
+    `model_name`. With a `quality` filter (utils.quality.FaceQualityFilter),
+    faces it rejects are reported in "skipped_faces" instead of embedded.
+    Returns None for undecodable images, otherwise the face boxes, an
+    (N, D) embedding array, the model and per-stage timings. Face crops are
+    not sent back to the parent.
+    """
+    from utils.deepface import detect_faces_from_bytes, get_embeddings_from_faces
+
+    global _model_warm
+    progress = progress or (lambda stage: None)
+    model_warm = _model_warm
+
+    progress("detecting")
+    start = time.perf_counter()
+    detections = detect_faces_from_bytes(img_bytes)
+    detect_seconds = time.perf_counter() - start
+    if detections is None:
+        return None
+
+    start = time.perf_counter()
+    detections, skipped = quality.split(detections) if quality is not None else (detections, [])
+    quality_seconds = time.perf_counter() - start
+
+    progress("embedding")
+    start = time.perf_counter()
+    embeddings = get_embeddings_from_faces(
+        [d["face"] for d in detections], batch_size=batch_size, model_name=model_name
+    )
+    embed_seconds = time.perf_counter() - start
+    _model_warm = True
+
+    return {
+        "face_boxes": [d.get("facial_area") for d in detections],
+        "skipped_faces": skipped,
+        "embeddings": embeddings,
+        "model": model_name,
+        "timings": {"detect": detect_seconds, "quality": quality_seconds, "embed": embed_seconds},
+        "model_warm": model_warm,
+    }
+
+
+# ==================== Job Queue ====================
+
+class JobQueue:
+    """
+    Bounded queue of jobs drained by a process pool.
+
+    Jobs are tracked in memory by ID. When a worker finishes, the optional
+    `on_result(job_id, output)` callback runs in a parent-side thread (for
+    matching and persistence) and its return value becomes the job result.
+    Worker processes are started lazily on the first submit, or up front
+    with start_workers(). `warmup`, a picklable function, runs in each worker
+    after the `preload` imports, e.g. to load and exercise the model.
+    """
+
+    def __init__(self, num_workers=2, max_pending=32, preload=(), warmup=None, max_finished=1000):
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._preload = tuple(preload)
+        self._warmup = warmup
+        self._workers_ready = 0
+
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._collected = set()
+        self._executor = None
+        self._finisher = None
+        self._progress_queue = None
+
+    def _start(self):
+        self._progress_queue = multiprocessing.get_context("spawn").Queue()
+        self._executor = self._new_executor()
+        self._finisher = ThreadPoolExecutor(max_workers=2)
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._progress_queue, self._preload, self._warmup),
+        )
+
+    def start_workers(self):
+        """Spawn and warm up every worker now instead of on the first upload."""
+        with self._lock:
+            if self._executor is None:
+                self._start()
+        # The pool spawns a process per task while none is idle
+        for _ in range(self.num_workers):
+            self._executor.submit(_ping)
+
+    def submit(self, fn, *args, on_result=None):
+        """
+        Queue `fn(*args, progress=...)` on the worker pool.
+        Returns the job ID, or raises QueueFull when the queue is at capacity.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs already pending")
+            if self._executor is None:
+                self._start()
+
+            job_id = self._new_job()
+            executor = self._executor
+
+        try:
+            future = executor.submit(_run_job, job_id, fn, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory) and took the pool with it;
+            # its jobs have failed, so replace the pool and try once more
+            try:
+                future = self._replace_executor(executor).submit(_run_job, job_id, fn, args)
+            except Exception:
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+                    self._pending -= 1
+                raise
+        future.add_done_callback(
+            lambda f: self._finisher.submit(self._finish, job_id, f, on_result)
+        )
+        return job_id
+
+    def submit_result(self, output, on_result):
+        """
+        Track a job whose worker output is already known (e.g. from a cache).
+        Only `on_result` runs, in a parent-side thread; no worker is used.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs already pending")
+            if self._executor is None:
+                self._start()
+            job_id = self._new_job()
+
+        self._finisher.submit(self._finish_with, job_id, lambda: output, on_result)
+        return job_id
+
+    def run_in_thread(self, fn, *args):
+        """
+        Track a long parent-side task (e.g. a bulk import that manages its own
+        process pool) as a job. `fn(*args, progress=...)` runs in a dedicated
+        thread and does not count against `max_pending`.
+        """
+        with self._lock:
+            job_id = self._new_job(counted=False)
+
+        def run():
+            self.set_stage(job_id, "running")
+            self._finish_with(
+                job_id,
+                lambda: fn(*args, progress=lambda stage: self.set_stage(job_id, stage)),
+                None,
+                counted=False,
+            )
+
+        threading.Thread(target=run, daemon=True).start()
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of a job's state, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def set_stage(self, job_id, stage):
+        """Record progress for parent-side steps, e.g. from `on_result`."""
+        self._update(job_id, status="running", stage=stage)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "workers_ready": self._workers_ready,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._finisher.shutdown(wait=True)
+            self._progress_queue.put(None)
+
+    # ---------- Internal ----------
+
+    def _replace_executor(self, broken):
+        """Swap a broken pool for a new one (unless another thread already did). Returns the current pool."""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = self._new_executor()
+                self._workers_ready = 0
+                replaced = True
+            else:
+                replaced = False
+            executor = self._executor
+        if replaced:
+            broken.shutdown(wait=False)
+            for _ in range(self.num_workers):
+                executor.submit(_ping)
+        return executor
+
+    def _new_job(self, counted=True):
+        """Register a queued job; the caller holds the lock."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "stage": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+        }
+        if counted:
+            self._pending += 1
+        self._prune()
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["updated_at"] = time.time()
+
+    def _listen(self):
+        while True:
+            message = self._progress_queue.get()
+            if message is None:
+                return
+            job_id, stage = message
+            if job_id is None:
+                with self._lock:
+                    self._workers_ready += 1
+                continue
+            with self._lock:
+                # Worker messages can arrive after the parent took the job over
+                if job_id not in self._jobs or job_id in self._collected:
+                    continue
+            self._update(job_id, status="running", stage=stage)
+
+    def _finish(self, job_id, future, on_result):
+        with self._lock:
+            self._collected.add(job_id)
+        self._finish_with(job_id, future.result, on_result)
+
+    def _finish_with(self, job_id, get_output, on_result, counted=True):
+        try:
+            output = get_output()
+            result = output
+            if on_result is not None:
+                result = on_result(job_id, output)
+            self._update(job_id, status="done", stage="done", result=result)
+        except Exception as e:
+            import traceback
+
+            traceback.print_exc()
+            self._update(job_id, status="failed", stage="failed", error=str(e))
+        finally:
+            with self._lock:
+                if counted:
+                    self._pending -= 1
+                self._collected.discard(job_id)
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond `max_finished`."""
+        finished = [
+            job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")
+        ]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,139 @@
+"""
+Model lifecycle of the server process.
+TensorFlow, DeepFace and both models load in a background thread while the
+rest of the server starts, then one warm-up inference runs on a sample
+photo. Readiness stays false until then, so a load balancer only routes
+traffic to processes whose first request will be as fast as the rest.
+"""
+
+import importlib
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModelLifecycle:
+    """
+    Loads the detector and recognizer once, off the request path.
+
+    States: pending, loading (imports and weights), loaded, warming
+    (sample inference), ready or failed. Each step's duration is kept for
+    /readyz and logged once the models are ready.
+
+    A pre-forking server calls start() in each worker after it forks, never
+    in the master, since TensorFlow's runtime and thread pools are not
+    fork-safe.
+    """
+
+    def __init__(self, module="utils.deepface", warmup_image=None, model_name="ArcFace"):
+        self.module = module
+        self.model_name = model_name
+        self.warmup_image = warmup_image
+        self.state = "pending"
+        self.error = None
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._callbacks = []
+        self._thread = None
+        self._module = None
+        self._started_at = time.perf_counter()
+
+    def start(self):
+        """Load and warm up in a daemon thread. Returns self."""
+        return self._start_thread(self.load)
+
+    def load(self):
+        """Import, build and warm up the models in this thread. Returns False if that failed."""
+        try:
+            self._set_state("loading")
+            module = self._step("import_module", importlib.import_module, self.module)
+            self._step("import_library", module.load_library)
+            for step, seconds in module.load_models(self.model_name).items():
+                self.record(step, seconds)
+        except Exception as e:
+            self._fail(e)
+            return False
+
+        self._module = module
+        self._set_state("loaded")
+        return self._warm()
+
+    def record(self, step, seconds):
+        """Add a step timed elsewhere, e.g. the server's own import."""
+        with self._lock:
+            self.timings[step] = seconds
+
+    def when_ready(self, callback):
+        """Call `callback()` once the models are ready (now, if they already are)."""
+        with self._lock:
+            if not self._ready.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """Block until ready; returns False on timeout."""
+        return self._ready.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "ready": self._ready.is_set(),
+                "error": self.error,
+                "timings_ms": {step: round(seconds * 1000, 1) for step, seconds in self.timings.items()},
+            }
+
+    # ---------- Internal ----------
+
+    def _start_thread(self, target):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=target, name="model-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    def _warm(self):
+        if self._module is None:
+            return self.load()
+        try:
+            self._set_state("warming")
+            image = self.warmup_image or self._module.WARMUP_IMAGE
+            self._step("warmup", self._module.warm_up, image, self.model_name)
+        except Exception as e:
+            self._fail(e)
+            return False
+
+        with self._lock:
+            self.timings["startup"] = time.perf_counter() - self._started_at
+            self.state = "ready"
+            self._ready.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        logger.info("models ready %s", json.dumps(self.status()["timings_ms"]))
+        return True
+
+    def _fail(self, error):
+        logger.exception("model loading failed")
+        with self._lock:
+            self.state = "failed"
+            self.error = f"{type(error).__name__}: {error}"
+
+    def _step(self, name, fn, *args):
+        start = time.perf_counter()
+        value = fn(*args)
+        self.record(name, time.perf_counter() - start)
+        return value
+
+    def _set_state(self, state):
+        with self._lock:
+            self.state = state
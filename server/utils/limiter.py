@@ -0,0 +1,70 @@
+"""
+Bounded concurrency for model inference within one server process.
+Requests beyond `max_concurrent` wait their turn instead of all running the
+model at once and oversubscribing the CPU; when too many are already
+waiting, or the wait runs out, they are turned away with Overloaded.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """Raised when no inference slot frees up in time; the route answers 503."""
+
+
+class ConcurrencyLimiter:
+    """
+    A semaphore with a bounded, timed waiting line.
+
+    Args:
+        max_concurrent: Requests running inference at once
+        max_waiting: Requests allowed to wait for a slot; more are rejected
+        timeout: Seconds a request waits for a slot before being rejected
+    """
+
+    def __init__(self, max_concurrent=1, max_waiting=32, timeout=30.0):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._rejected = 0
+
+    @contextmanager
+    def slot(self):
+        """Hold one inference slot for the duration of the block."""
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                self._rejected += 1
+                raise Overloaded(f"{self._waiting} requests already waiting")
+            self._waiting += 1
+        try:
+            acquired = self._semaphore.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            raise Overloaded(f"No inference slot within {self.timeout:g}s")
+
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self._active,
+                "waiting": self._waiting,
+                "rejected": self._rejected,
+            }
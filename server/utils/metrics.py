@@ -0,0 +1,266 @@
+"""
+In-process metrics in the Prometheus text format.
+Stage timers wrap the hot path of each request; observing a value is a
+perf_counter call, a bisect and a short lock, cheap enough to leave on.
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FACE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current_timer = contextvars.ContextVar("request_timer", default=None)
+
+
+# ==================== Metric Types ====================
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by label values."""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_join_labels(labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_wrap(labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{_wrap(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_wrap(_format_labels(self.labels, label_values))} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time, so the hot path never updates it."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+def _format_labels(names, values):
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+def _join_labels(labels, bound):
+    le = f'le="{bound}"'
+    return "{" + (f"{labels},{le}" if labels else le) + "}"
+
+
+def _wrap(labels):
+    return "{" + labels + "}" if labels else ""
+
+
+# ==================== Registry ====================
+
+class Metrics:
+    """
+    The server's metrics: per-stage and per-request latency, faces per image,
+    request outcomes and any gauges registered by the server.
+    """
+
+    def __init__(self, prefix="sensattend", slow_request_seconds=None):
+        self.slow_request_seconds = slow_request_seconds
+        self.stage_seconds = Histogram(
+            f"{prefix}_stage_seconds", "Time spent in each request stage", LATENCY_BUCKETS, ("endpoint", "stage")
+        )
+        self.request_seconds = Histogram(
+            f"{prefix}_request_seconds",
+            "Request latency; model is cold until this process has run an embedding",
+            LATENCY_BUCKETS,
+            ("endpoint", "model"),
+        )
+        self.faces_per_image = Histogram(
+            f"{prefix}_faces_per_image", "Faces detected per analysed image", FACE_BUCKETS, ("endpoint",)
+        )
+        self.faces_skipped = Counter(
+            f"{prefix}_faces_skipped_total", "Detected faces not embedded, by quality check", ("endpoint", "reason")
+        )
+        self.requests = Counter(f"{prefix}_requests_total", "Requests by outcome", ("endpoint", "outcome"))
+        self._gauges = []
+        self.model_warm = False
+
+    def gauge(self, name, help_text, read):
+        self._gauges.append(Gauge(name, help_text, read))
+
+    @contextmanager
+    def request(self, endpoint, start=None, model_warm=None):
+        """
+        Time one request. Yields a RequestTimer whose `stage()` context
+        manager times the steps; the total and outcome are recorded on exit.
+        `start` (a perf_counter value) backdates the request, e.g. to when a
+        job was queued; `model_warm` overrides this process's model state.
+        """
+        timer = RequestTimer(self, endpoint, start, model_warm)
+        try:
+            yield timer
+        except Exception:
+            timer.outcome = "error"
+            raise
+        finally:
+            timer.finish()
+
+    def instrument(self, endpoint):
+        """
+        Decorator timing a Flask view. The outcome follows the response
+        status, and `stage()` / `faces()` inside the view report to it.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                with self.request(endpoint) as timer:
+                    token = _current_timer.set(timer)
+                    try:
+                        response = view(*args, **kwargs)
+                    finally:
+                        _current_timer.reset(token)
+                    timer.outcome = _outcome(response)
+                    return response
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage of the current instrumented request; a no-op outside one."""
+        timer = _current_timer.get()
+        if timer is None:
+            yield
+            return
+        with timer.stage(name):
+            yield
+
+    def faces(self, count, skipped=()):
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.faces(count, skipped)
+
+    def render(self):
+        lines = []
+        for metric in (
+            self.stage_seconds,
+            self.request_seconds,
+            self.faces_per_image,
+            self.faces_skipped,
+            self.requests,
+            *self._gauges,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _outcome(response):
+    status = getattr(response, "status_code", 200)
+    if isinstance(response, tuple) and len(response) > 1 and isinstance(response[1], int):
+        status = response[1]
+    if status >= 500:
+        return "error"
+    return "rejected" if status >= 400 else "ok"
+
+
+class RequestTimer:
+    """Per-request stage breakdown, also used for the slow-request log."""
+
+    def __init__(self, metrics, endpoint, start=None, model_warm=None):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.outcome = "ok"
+        self.stages = {}
+        warm = metrics.model_warm if model_warm is None else model_warm
+        self._model = "warm" if warm else "cold"
+        self._start = time.perf_counter() if start is None else start
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Record a stage timed elsewhere, e.g. in a worker process."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.metrics.stage_seconds.observe(seconds, self.endpoint, name)
+
+    def faces(self, count, skipped=()):
+        """Faces detected in the image; `skipped` lists the quality reports of those not embedded."""
+        self.metrics.faces_per_image.observe(count, self.endpoint)
+        for face in skipped:
+            self.metrics.faces_skipped.inc(self.endpoint, face["reason"])
+
+    def finish(self):
+        total = time.perf_counter() - self._start
+        self.metrics.request_seconds.observe(total, self.endpoint, self._model)
+        self.metrics.requests.inc(self.endpoint, self.outcome)
+
+        slow = self.metrics.slow_request_seconds
+        if slow and total >= slow:
+            logger.warning(
+                "slow request %s",
+                json.dumps(
+                    {
+                        "endpoint": self.endpoint,
+                        "outcome": self.outcome,
+                        "model": self._model,
+                        "total_ms": round(total * 1000, 1),
+                        "stages_ms": {name: round(s * 1000, 1) for name, s in self.stages.items()},
+                    }
+                ),
+            )
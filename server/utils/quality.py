@@ -0,0 +1,99 @@
+"""
+Face-quality checks between detection and embedding.
+Tiny, blurred, low-confidence and profile faces cost a full ArcFace pass but
+rarely verify against anyone, so they are skipped and reported with a reason
+instead. Every check reads the detection alone and costs microseconds.
+"""
+
+import cv2
+import numpy as np
+
+# Crops are scored at one size, so sharpness does not grow with resolution
+SHARPNESS_SIZE = 64
+
+
+class FaceQualityFilter:
+    """
+    Sorts detections into faces worth embedding and skipped ones.
+
+    Args:
+        min_confidence: Detector confidence below which a face is skipped
+        min_size: Shorter side of the face box, in pixels of the full image
+        min_sharpness: Variance of the Laplacian of the grayscale crop at
+            64x64; a 2-pixel blur at that size scores about 20
+        max_yaw: Nose offset from the eye midpoint along the eye line, as a
+            fraction of half the eye distance; 0 is frontal and about 1 is a
+            half profile
+    A threshold of 0 (None for max_yaw) turns that check off.
+    """
+
+    def __init__(self, min_confidence=0.9, min_size=24, min_sharpness=20.0, max_yaw=1.0):
+        self.min_confidence = min_confidence
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+
+    def assess(self, detection):
+        """
+        Score one detection (as returned by detect_faces). Returns (quality,
+        reason): the scores, and the first failed check ("low_confidence",
+        "too_small", "profile" or "blurry"), or None if the face passes.
+        """
+        area = detection.get("facial_area") or {}
+        quality = {
+            "confidence": round(float(detection.get("confidence") or 0), 3),
+            "size": int(min(area.get("w", 0), area.get("h", 0))),
+            "yaw": face_yaw(area),
+            "sharpness": sharpness(detection["face"]),
+        }
+
+        if self.min_confidence and quality["confidence"] < self.min_confidence:
+            return quality, "low_confidence"
+        if self.min_size and quality["size"] < self.min_size:
+            return quality, "too_small"
+        if self.max_yaw is not None and quality["yaw"] is not None and quality["yaw"] > self.max_yaw:
+            return quality, "profile"
+        if self.min_sharpness and quality["sharpness"] < self.min_sharpness:
+            return quality, "blurry"
+        return quality, None
+
+    def split(self, detections):
+        """
+        Returns (kept, skipped): the detections to embed, in order, and for
+        the rest a {"face_box", "reason", "quality"} report.
+        """
+        kept, skipped = [], []
+        for detection in detections:
+            quality, reason = self.assess(detection)
+            if reason is None:
+                kept.append(detection)
+            else:
+                skipped.append({"face_box": detection.get("facial_area"), "reason": reason, "quality": quality})
+        return kept, skipped
+
+
+def sharpness(face):
+    """Laplacian variance of a face crop (RGB float in [0, 1], as detect_faces returns)."""
+    if face is None or face.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(np.asarray(face, dtype=np.float32), cv2.COLOR_RGB2GRAY) * 255
+    gray = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return round(float(cv2.Laplacian(gray, cv2.CV_32F).var()), 1)
+
+
+def face_yaw(area):
+    """
+    Head turn estimated from the eye and nose landmarks of a facial_area.
+    Measured along the eye line, so in-plane tilt does not count.
+    Returns None when the landmarks are missing.
+    """
+    left, right, nose = area.get("left_eye"), area.get("right_eye"), area.get("nose")
+    if left is None or right is None or nose is None:
+        return None
+    left, right, nose = (np.asarray(point, dtype=np.float64) for point in (left, right, nose))
+    eye_line = right - left
+    half_distance = np.linalg.norm(eye_line) / 2
+    if half_distance < 1:
+        return None
+    offset = np.dot(nose - (left + right) / 2, eye_line / (2 * half_distance))
+    return round(float(abs(offset) / half_distance), 3)
@@ -0,0 +1,242 @@
+"""
+Attendance sessions: one class on one date, photographed from several angles.
+Each photo's matches are folded into per-student evidence as it arrives, so
+earlier photos are never reprocessed. Closing the session turns the evidence
+into a single present/absent roster, which is saved once.
+
+Sessions live in the memory of the process that opened them. Under gunicorn
+with several workers, a session's requests must reach the same worker.
+"""
+
+import csv
+import io
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+# The README's "Roll Number | Status" table, then the evidence behind it
+CSV_HEADER = ["Roll Number", "Status", "Name", "Photos", "Best Distance"]
+
+
+class SessionClosed(Exception):
+    """Raised when a photo is added to a session that has already closed."""
+
+
+# ==================== Session ====================
+
+class AttendanceSession:
+    """
+    Evidence for one class session. Each student is a column of two small
+    arrays: the best distance they were matched at and the number of photos
+    they were recognized in. Students matched from outside the expected
+    roster get a column when they first appear.
+
+    Args:
+        session_id: Unique ID
+        section: Section the photos are matched against, if any
+        date: ISO date of the class
+        roster: (roll_number, name) pairs expected to attend
+    """
+
+    def __init__(self, session_id, section=None, date=None, roster=()):
+        self.id = session_id
+        self.section = section
+        self.date = date or datetime.now(timezone.utc).date().isoformat()
+        self.opened_at = datetime.now(timezone.utc)
+        self.closed_at = None
+        self.photos = 0
+        self.last_activity = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._columns = {}
+        self._roll_numbers = []
+        self._names = []
+        self._expected = []
+        self._best = np.full(max(16, len(roster)), np.inf, dtype=np.float32)
+        self._seen = np.zeros(len(self._best), dtype=np.int32)
+        for roll_number, name in roster:
+            self._column(roll_number, name, expected=True)
+
+    @property
+    def is_open(self):
+        return self.closed_at is None
+
+    def add_photo(self, faces):
+        """
+        Fold in one photo's per-face results (as from match_embeddings); only
+        assigned, verified matches count. Returns the roll numbers seen for
+        the first time in this session. Raises SessionClosed.
+        """
+        with self._lock:
+            if not self.is_open:
+                raise SessionClosed(f"Session {self.id} is closed")
+            first_seen = []
+            for face in faces:
+                match = face.get("best_match")
+                if match is None or not match.get("verified"):
+                    continue
+                column = self._column(match["roll_number"], match.get("name"), expected=False)
+                if self._seen[column] == 0:
+                    first_seen.append(match["roll_number"])
+                self._seen[column] += 1
+                self._best[column] = min(self._best[column], match["distance"])
+            self.photos += 1
+            self.last_activity = time.monotonic()
+            return first_seen
+
+    def close(self):
+        """Stop accepting photos. Returns False if the session was already closed."""
+        with self._lock:
+            if not self.is_open:
+                return False
+            self.closed_at = datetime.now(timezone.utc)
+            return True
+
+    def roster(self):
+        """
+        One row per student, by roll number: "Present" if recognized in any
+        photo, otherwise "Absent". `expected` is False for students who were
+        recognized but are not on the session's roster.
+        """
+        with self._lock:
+            rows = []
+            for column, roll_number in enumerate(self._roll_numbers):
+                photos = int(self._seen[column])
+                rows.append(
+                    {
+                        "roll_number": roll_number,
+                        "name": self._names[column],
+                        "status": "Present" if photos else "Absent",
+                        "photos": photos,
+                        "best_distance": round(float(self._best[column]), 6) if photos else None,
+                        "expected": self._expected[column],
+                    }
+                )
+        return sorted(rows, key=lambda row: row["roll_number"])
+
+    def summary(self):
+        with self._lock:
+            present = int(np.count_nonzero(self._seen[:len(self._roll_numbers)]))
+            return {
+                "id": self.id,
+                "section": self.section,
+                "date": self.date,
+                "status": "open" if self.is_open else "closed",
+                "photos": self.photos,
+                "expected": sum(self._expected),
+                "present": present,
+                "opened_at": self.opened_at.isoformat(),
+                "closed_at": self.closed_at.isoformat() if self.closed_at else None,
+            }
+
+    def to_csv(self):
+        """The roster as CSV text, in the README's output format."""
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(CSV_HEADER)
+        for row in self.roster():
+            best = "" if row["best_distance"] is None else f"{row['best_distance']:.4f}"
+            writer.writerow([row["roll_number"], row["status"], row["name"] or "", row["photos"], best])
+        return out.getvalue()
+
+    # ---------- Internal ----------
+
+    def _column(self, roll_number, name, expected):
+        """Column of a student, added if new; the caller holds the lock."""
+        column = self._columns.get(roll_number)
+        if column is not None:
+            return column
+        column = len(self._roll_numbers)
+        if column == len(self._best):
+            self._best = np.concatenate([self._best, np.full(column, np.inf, dtype=np.float32)])
+            self._seen = np.concatenate([self._seen, np.zeros(column, dtype=np.int32)])
+        self._columns[roll_number] = column
+        self._roll_numbers.append(roll_number)
+        self._names.append(name)
+        self._expected.append(expected)
+        return column
+
+
+# ==================== Registry ====================
+
+class SessionRegistry:
+    """
+    Open sessions of this process, plus recently closed ones for export.
+
+    Args:
+        on_close: Called once with each session as it closes, e.g. to save it
+        idle_timeout: Seconds without a photo after which a session closes
+            by itself, so forgotten sessions are still saved; None disables
+        max_closed: Closed sessions kept for GET and CSV export
+    """
+
+    def __init__(self, on_close=None, idle_timeout=4 * 3600, max_closed=200):
+        self.on_close = on_close
+        self.idle_timeout = idle_timeout
+        self.max_closed = max_closed
+        self._lock = threading.Lock()
+        self._open = {}
+        self._closed = OrderedDict()
+
+    def open(self, section=None, date=None, roster=()):
+        self._close_idle()
+        session = AttendanceSession(uuid.uuid4().hex, section, date, roster)
+        with self._lock:
+            self._open[session.id] = session
+        return session
+
+    def get(self, session_id):
+        """The open or recently closed session with this ID, or None."""
+        self._close_idle()
+        with self._lock:
+            return self._open.get(session_id) or self._closed.get(session_id)
+
+    def close(self, session_id):
+        """
+        Close a session and run `on_close` for it, once; closing again just
+        returns it. Returns None for unknown IDs.
+        """
+        with self._lock:
+            session = self._open.pop(session_id, None)
+            if session is None:
+                return self._closed.get(session_id)
+        self._finish(session)
+        return session
+
+    def close_all(self):
+        """Close every open session, e.g. on shutdown."""
+        with self._lock:
+            sessions = list(self._open.values())
+            self._open.clear()
+        for session in sessions:
+            self._finish(session)
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._open), "closed": len(self._closed)}
+
+    # ---------- Internal ----------
+
+    def _finish(self, session):
+        closed = session.close()
+        with self._lock:
+            self._closed[session.id] = session
+            while len(self._closed) > self.max_closed:
+                self._closed.popitem(last=False)
+        if closed and self.on_close is not None:
+            self.on_close(session)
+
+    def _close_idle(self):
+        if self.idle_timeout is None:
+            return
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [s for s in self._open.values() if s.last_activity < cutoff]
+            for session in idle:
+                del self._open[session.id]
+        for session in idle:
+            self._finish(session)
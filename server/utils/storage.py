@@ -0,0 +1,747 @@
+"""
+Storage backends for students and analysis results.
+The routes talk to a store instead of Firestore directly, so the server can
+also run fully offline on a local SQLite database plus embedding files.
+
+Embeddings are versioned by the recognition model that produced them: a
+student can hold one version per model, and the gallery is loaded for one
+model at a time. The store also records the active version (model and
+distance metric), which tools/reembed.py switches once a new version is
+complete. Re-enrolling a student drops their versions from other models,
+since those were computed from the old photos.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+FIRESTORE_BATCH_LIMIT = 400  # Firestore allows at most 500 writes per batch
+# Result fields returned without detail=True, by every backend; the bulky
+# rest (per-face matches, skipped faces, a session's roster) needs detail=True
+RESULT_SUMMARY_FIELDS = [
+    "timeStamp",
+    "message",
+    "matched_roll_numbers",
+    "section",
+    "model",
+    "distance_metric",
+    "threshold",
+    "session",
+]
+# Model of the embeddings saved before they were versioned
+DEFAULT_MODEL = "ArcFace"
+
+
+def create_store(backend=None):
+    """
+    Build the store selected by `backend` or the STORAGE_BACKEND variable:
+    "firestore" (default, needs FIREBASE_CREDENTIALS) or "local" (LOCAL_STORE_DIR).
+    """
+    backend = backend or os.environ.get("STORAGE_BACKEND", "firestore")
+    if backend == "firestore":
+        return FirestoreStore(os.environ.get("FIREBASE_CREDENTIALS", "./utils/firebase-key.json"))
+    if backend == "local":
+        return LocalStore(os.environ.get("LOCAL_STORE_DIR", "./local_store"))
+    raise ValueError(f"Invalid storage backend: {backend}")
+
+
+def _embedding_version(student, model):
+    """A stored student's {"embedding", "samples"} for `model`, or None."""
+    version = (student.get("embeddings") or {}).get(model)
+    if version is None and model == DEFAULT_MODEL and student.get("embedding") is not None:
+        return student  # Saved before versioning
+    return version
+
+
+def _gallery_arrays(students, model=DEFAULT_MODEL):
+    """(roll_numbers, names, embeddings, samples, sections) of one model's embeddings, for GalleryIndex.load_arrays."""
+    roll_numbers, names, embeddings, samples, sections = [], [], [], {}, {}
+    for student in students:
+        version = _embedding_version(student, model)
+        if version is None or version.get("embedding") is None:
+            continue
+        roll_numbers.append(student.get("roll_number"))
+        names.append(student.get("name"))
+        embeddings.append(version["embedding"])
+        student_samples = [sample["embedding"] for sample in version.get("samples") or []]
+        if len(student_samples) > 1:
+            samples[student.get("roll_number")] = np.asarray(student_samples, dtype=np.float32)
+        if student.get("sections"):
+            sections[student.get("roll_number")] = student["sections"]
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+    return roll_numbers, names, matrix, samples, sections
+
+
+# ==================== Firestore ====================
+
+class FirestoreStore:
+    """
+    Students and results in Cloud Firestore.
+    Each student document keeps its versions in an `embeddings` map keyed
+    by model. Embeddings are stored as float lists; samples are wrapped in
+    maps because Firestore does not allow arrays of arrays. The active
+    version is the config/embedding document.
+    """
+
+    def __init__(self, credentials_path):
+        from firebase_admin import credentials, firestore, initialize_app
+
+        initialize_app(credentials.Certificate(credentials_path))
+        self._firestore = firestore
+        self.db = firestore.client()
+
+    def load_gallery(self, model=DEFAULT_MODEL):
+        return _gallery_arrays((doc.to_dict() for doc in self.db.collection("students").stream()), model)
+
+    def embedded_roll_numbers(self, model):
+        """Roll numbers of the students that have a `model` embedding."""
+        fields = ["roll_number", self._firestore.FieldPath("embeddings", model).to_api_repr()]
+        if model == DEFAULT_MODEL:
+            fields.append("embedding")
+        docs = self.db.collection("students").select(fields).stream()
+        return {
+            data.get("roll_number")
+            for data in (doc.to_dict() for doc in docs)
+            if _embedding_version(data, model) is not None
+        }
+
+    def list_students(self):
+        """Names, roll numbers and sections only; embeddings are not downloaded."""
+        docs = self.db.collection("students").select(["name", "roll_number", "sections"]).stream()
+        return [
+            {"name": data.get("name"), "roll_number": data.get("roll_number"), "sections": data.get("sections") or []}
+            for data in (doc.to_dict() for doc in docs)
+        ]
+
+    def save_student(self, student):
+        self.save_students([student])
+
+    def save_students(self, students):
+        """
+        Write student documents with as few batched commits as possible.
+        Each student's embedding and samples become its version for
+        `student["model"]` (DEFAULT_MODEL if absent), replacing any others.
+        """
+        for start in range(0, len(students), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for student in students[start:start + FIRESTORE_BATCH_LIMIT]:
+                document = {
+                    key: value
+                    for key, value in student.items()
+                    if key not in ("embedding", "samples", "model")
+                }
+                document["embeddings"] = {student.get("model", DEFAULT_MODEL): self._version(student)}
+                batch.set(self.db.collection("students").document(student["roll_number"]), document)
+            batch.commit()
+
+    def save_embeddings(self, model, students):
+        """
+        Add or replace the `model` version of existing students, leaving
+        their other versions untouched. `students` are dicts with
+        roll_number, embedding and samples; students deleted meanwhile are
+        skipped.
+        """
+        from google.api_core.exceptions import NotFound
+
+        field = self._firestore.FieldPath("embeddings", model).to_api_repr()
+        for start in range(0, len(students), FIRESTORE_BATCH_LIMIT):
+            chunk = students[start:start + FIRESTORE_BATCH_LIMIT]
+            batch = self.db.batch()
+            for student in chunk:
+                batch.update(
+                    self.db.collection("students").document(student["roll_number"]), {field: self._version(student)}
+                )
+            try:
+                batch.commit()
+            except NotFound:
+                # A student was deleted since the batch was built; write the rest one by one
+                for student in chunk:
+                    try:
+                        self.db.collection("students").document(student["roll_number"]).update(
+                            {field: self._version(student)}
+                        )
+                    except NotFound:
+                        pass
+
+    @staticmethod
+    def _version(student):
+        return {
+            "embedding": student["embedding"],
+            "samples": [{"embedding": sample} for sample in student.get("samples") or []],
+        }
+
+    def active_embedding(self):
+        """The active version as {"model", "distance_metric"}, or None if never set."""
+        snapshot = self.db.collection("config").document("embedding").get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        return {"model": data["model"], "distance_metric": data["distance_metric"]}
+
+    def set_active_embedding(self, model, distance_metric):
+        """Switch the active version in one write."""
+        self.db.collection("config").document("embedding").set(
+            {"model": model, "distance_metric": distance_metric, "activated_at": self._firestore.SERVER_TIMESTAMP}
+        )
+
+    def set_sections(self, roll_number, sections):
+        self.db.collection("students").document(roll_number).update({"sections": list(sections)})
+
+    def delete_student(self, roll_number):
+        self.db.collection("students").document(roll_number).delete()
+
+    def add_result(self, document):
+        """Save a result and bump its students' attendance counters in one batch."""
+        self.add_results([document])
+
+    def add_results(self, documents):
+        """
+        Save results and their counter updates in as few batched commits as
+        possible; each batch bumps a student's counter once, by the number of
+        its results that matched them. A document's own `timeStamp` (e.g.
+        when it was analysed) takes precedence over the server time.
+        """
+        start = 0
+        while start < len(documents):
+            counts = {}
+            end = start
+            while end < len(documents):
+                roll_numbers = set(documents[end].get("matched_roll_numbers") or [])
+                writes = end - start + 1 + len(counts.keys() | roll_numbers)
+                if end > start and writes > FIRESTORE_BATCH_LIMIT:
+                    break
+                for roll_number in roll_numbers:
+                    counts[roll_number] = counts.get(roll_number, 0) + 1
+                end += 1
+
+            batch = self.db.batch()
+            for document in documents[start:end]:
+                batch.set(
+                    self.db.collection("results").document(),
+                    {"timeStamp": self._firestore.SERVER_TIMESTAMP, **document},
+                )
+            for roll_number, count in counts.items():
+                batch.set(
+                    self.db.collection("attendance_counts").document(roll_number),
+                    {
+                        "roll_number": roll_number,
+                        "count": self._firestore.Increment(count),
+                        "last_seen": self._firestore.SERVER_TIMESTAMP,
+                    },
+                    merge=True,
+                )
+            batch.commit()
+            start = end
+
+    def list_results(self, limit=50, cursor=None, start=None, end=None, roll_number=None, detail=False):
+        """
+        One page of results, newest first.
+        `cursor` is the `next_cursor` of the previous page; `start`/`end` are
+        an inclusive/exclusive datetime range. Filtering by roll number with
+        a date range needs a composite index on matched_roll_numbers and
+        timeStamp. Returns (results, next_cursor or None).
+        """
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        collection = self.db.collection("results")
+        query = collection.order_by("timeStamp", direction=self._firestore.Query.DESCENDING)
+        if start is not None:
+            query = query.where(filter=FieldFilter("timeStamp", ">=", start))
+        if end is not None:
+            query = query.where(filter=FieldFilter("timeStamp", "<", end))
+        if roll_number is not None:
+            query = query.where(filter=FieldFilter("matched_roll_numbers", "array_contains", roll_number))
+        if not detail:
+            query = query.select(RESULT_SUMMARY_FIELDS)
+        if cursor:
+            snapshot = collection.document(cursor).get()
+            if not snapshot.exists:
+                raise ValueError("Invalid cursor")
+            query = query.start_after(snapshot)
+
+        docs = list(query.limit(limit + 1).stream())
+        results = [{"id": doc.id, **doc.to_dict()} for doc in docs[:limit]]
+        next_cursor = docs[limit - 1].id if len(docs) > limit else None
+        return results, next_cursor
+
+    def attendance_counts(self, roll_number=None):
+        """Maintained per-student counters, without scanning results."""
+        collection = self.db.collection("attendance_counts")
+        if roll_number is not None:
+            snapshot = collection.document(roll_number).get()
+            return [snapshot.to_dict()] if snapshot.exists else []
+        return [doc.to_dict() for doc in collection.stream()]
+
+    def rebuild_attendance_counts(self):
+        """Recount attendance from every saved result, e.g. for results saved before counters existed."""
+        counts, last_seen = {}, {}
+        query = self.db.collection("results").select(["timeStamp", "matched_roll_numbers"])
+        for doc in query.stream():
+            data = doc.to_dict()
+            for roll_number in set(data.get("matched_roll_numbers") or []):
+                counts[roll_number] = counts.get(roll_number, 0) + 1
+                if data.get("timeStamp") and (roll_number not in last_seen or data["timeStamp"] > last_seen[roll_number]):
+                    last_seen[roll_number] = data["timeStamp"]
+
+        for doc in self.db.collection("attendance_counts").stream():
+            if doc.id not in counts:
+                doc.reference.delete()
+
+        roll_numbers = list(counts)
+        for start in range(0, len(roll_numbers), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for roll_number in roll_numbers[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(
+                    self.db.collection("attendance_counts").document(roll_number),
+                    {"roll_number": roll_number, "count": counts[roll_number], "last_seen": last_seen.get(roll_number)},
+                )
+            batch.commit()
+        return len(counts)
+
+
+# ==================== Local ====================
+
+class _EmbeddingFile:
+    """
+    Append-only float32 rows of one model, memory-mapped for reading. The
+    caller serializes access.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.rows = 0
+        self._mmap = None
+        self._truncate_partial_row()
+
+    def _truncate_partial_row(self):
+        """Drop a row left half-written by a crash during append."""
+        if not os.path.exists(self.path):
+            return
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self.path)
+        if size % row_bytes:
+            with open(self.path, "r+b") as f:
+                f.truncate(size - size % row_bytes)
+        self.rows = size // row_bytes
+
+    def append(self, runs):
+        """Write (N, dim) runs durably. Returns the first row of each."""
+        first_rows = []
+        with open(self.path, "ab") as f:
+            for run in runs:
+                if run.shape[1] != self.dim:
+                    raise ValueError(f"Embedding has {run.shape[1]} dimensions, store uses {self.dim}")
+                f.write(run.tobytes())
+                first_rows.append(self.rows)
+                self.rows += len(run)
+            f.flush()
+            os.fsync(f.fileno())
+        return first_rows
+
+    def matrix(self):
+        """Read-only memory map of every row written so far."""
+        if self._mmap is None or len(self._mmap) != self.rows:
+            if self.rows == 0:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._mmap
+
+
+class LocalStore:
+    """
+    Offline store: metadata and results in SQLite, embeddings in one
+    append-only float32 file per model that is memory-mapped for reading.
+
+    Each student version owns a contiguous run of rows in its model's file:
+    the centroid, then the enrollment samples. Re-enrolling appends a new
+    run, so rows are never rewritten in place; SQLite only records which
+    run is current.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "store.db"), check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS students (
+                roll_number TEXT PRIMARY KEY,
+                name TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS student_embeddings (
+                model TEXT NOT NULL,
+                roll_number TEXT NOT NULL,
+                embedding_row INTEGER NOT NULL,
+                sample_count INTEGER NOT NULL,
+                PRIMARY KEY (model, roll_number)
+            );
+            CREATE INDEX IF NOT EXISTS student_embeddings_roll_number ON student_embeddings (roll_number);
+            CREATE TABLE IF NOT EXISTS student_sections (
+                roll_number TEXT NOT NULL,
+                section TEXT NOT NULL,
+                PRIMARY KEY (section, roll_number)
+            );
+            CREATE INDEX IF NOT EXISTS student_sections_roll_number ON student_sections (roll_number);
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                time_stamp TEXT NOT NULL,
+                document TEXT NOT NULL,
+                faces TEXT NOT NULL,
+                detail TEXT
+            );
+            CREATE INDEX IF NOT EXISTS results_time_stamp ON results (time_stamp);
+            CREATE TABLE IF NOT EXISTS result_students (
+                result_id INTEGER NOT NULL,
+                roll_number TEXT NOT NULL,
+                PRIMARY KEY (roll_number, result_id)
+            );
+            CREATE TABLE IF NOT EXISTS attendance_counts (
+                roll_number TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                last_seen TEXT NOT NULL
+            );
+            """
+        )
+        self._upgrade_unversioned()
+        self._upgrade_result_detail()
+        self._files = {}
+        for key, value in self._conn.execute("SELECT key, value FROM meta WHERE key LIKE 'dim:%'"):
+            model = key[len("dim:"):]
+            self._files[model] = _EmbeddingFile(self._embeddings_path(model), int(value))
+
+    def _embeddings_path(self, model):
+        return os.path.join(self._directory, f"embeddings-{model}.f32")
+
+    def _upgrade_result_detail(self):
+        """Add the column holding a result's bulky fields other than faces, which summaries skip."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(results)")]
+        if "detail" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE results ADD COLUMN detail TEXT")
+
+    def _upgrade_unversioned(self):
+        """
+        Move a store from before versioning, whose students table held the
+        rows of a single embeddings.f32, to DEFAULT_MODEL's version.
+        """
+        legacy_path = os.path.join(self._directory, "embeddings.f32")
+        if os.path.exists(legacy_path) and not os.path.exists(self._embeddings_path(DEFAULT_MODEL)):
+            os.replace(legacy_path, self._embeddings_path(DEFAULT_MODEL))
+
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(students)")]
+        if "embedding_row" not in columns:
+            return
+        try:
+            self._conn.executescript(
+                f"""
+                BEGIN;
+                INSERT INTO student_embeddings (model, roll_number, embedding_row, sample_count)
+                    SELECT '{DEFAULT_MODEL}', roll_number, embedding_row, sample_count FROM students;
+                CREATE TABLE students_versioned (roll_number TEXT PRIMARY KEY, name TEXT NOT NULL);
+                INSERT INTO students_versioned (roll_number, name)
+                    SELECT roll_number, name FROM students ORDER BY rowid;
+                DROP TABLE students;
+                ALTER TABLE students_versioned RENAME TO students;
+                UPDATE meta SET key = 'dim:{DEFAULT_MODEL}' WHERE key = 'dim';
+                COMMIT;
+                """
+            )
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+
+    def _file(self, model, dim=None):
+        """Embedding file of `model`, created with `dim` columns if new; the caller holds the lock."""
+        if model not in self._files:
+            if dim is None:
+                return None
+            with self._conn:
+                self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (f"dim:{model}", str(dim)))
+            self._files[model] = _EmbeddingFile(self._embeddings_path(model), dim)
+        return self._files[model]
+
+    def load_gallery(self, model=DEFAULT_MODEL):
+        """One model's gallery arrays straight from the memory map, with no parsing."""
+        with self._lock:
+            records = self._conn.execute(
+                """
+                SELECT s.roll_number, s.name, e.embedding_row, e.sample_count
+                FROM students s JOIN student_embeddings e ON e.roll_number = s.roll_number AND e.model = ?
+                ORDER BY s.rowid
+                """,
+                (model,),
+            ).fetchall()
+            sections = {}
+            for roll_number, section in self._conn.execute("SELECT roll_number, section FROM student_sections"):
+                sections.setdefault(roll_number, []).append(section)
+            embedding_file = self._file(model)
+            embeddings = embedding_file.matrix() if embedding_file else np.zeros((0, 0), dtype=np.float32)
+
+        roll_numbers = [r[0] for r in records]
+        names = [r[1] for r in records]
+        rows = np.array([r[2] for r in records], dtype=np.int64)
+        matrix = embeddings[rows] if len(rows) else np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        # Sample runs are views into the map, paged in only when re-ranking touches them
+        samples = {
+            roll_number: embeddings[row + 1:row + 1 + count]
+            for roll_number, _, row, count in records
+            if count > 1
+        }
+        return roll_numbers, names, matrix, samples, sections
+
+    def embedded_roll_numbers(self, model):
+        """Roll numbers of the students that have a `model` embedding."""
+        with self._lock:
+            records = self._conn.execute("SELECT roll_number FROM student_embeddings WHERE model = ?", (model,))
+            return {roll_number for (roll_number,) in records}
+
+    def list_students(self):
+        with self._lock:
+            records = self._conn.execute(
+                """
+                SELECT s.name, s.roll_number, GROUP_CONCAT(m.section, char(31))
+                FROM students s LEFT JOIN student_sections m ON m.roll_number = s.roll_number
+                GROUP BY s.roll_number ORDER BY s.rowid
+                """
+            ).fetchall()
+        return [
+            {"name": name, "roll_number": roll_number, "sections": sorted(sections.split("\x1f")) if sections else []}
+            for name, roll_number, sections in records
+        ]
+
+    def save_student(self, student):
+        self.save_students([student])
+
+    def save_students(self, students):
+        """
+        Append the embeddings, then point the students at them in one
+        transaction. Each student's embedding and samples become its version
+        for `student["model"]` (DEFAULT_MODEL if absent), replacing any others.
+        """
+        if not students:
+            return
+        with self._lock:
+            versions = self._append_versions(
+                [(student.get("model", DEFAULT_MODEL), student) for student in students]
+            )
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO students (roll_number, name) VALUES (?, ?)",
+                    [(student["roll_number"], student["name"]) for student in students],
+                )
+                self._conn.executemany(
+                    "DELETE FROM student_embeddings WHERE roll_number = ?",
+                    [(student["roll_number"],) for student in students],
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO student_embeddings (model, roll_number, embedding_row, sample_count) "
+                    "VALUES (?, ?, ?, ?)",
+                    versions,
+                )
+                for student in students:
+                    self._replace_sections(student["roll_number"], student.get("sections") or ())
+
+    def save_embeddings(self, model, students):
+        """
+        Add or replace the `model` version of existing students, leaving
+        their other versions untouched. `students` are dicts with
+        roll_number, embedding and samples; students deleted meanwhile are
+        skipped.
+        """
+        if not students:
+            return
+        with self._lock:
+            versions = self._append_versions([(model, student) for student in students])
+            with self._conn:
+                self._conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO student_embeddings (model, roll_number, embedding_row, sample_count)
+                    SELECT ?, roll_number, ?, ? FROM students WHERE roll_number = ?
+                    """,
+                    [(model, row, count, roll_number) for model, roll_number, row, count in versions],
+                )
+
+    def _append_versions(self, versions):
+        """
+        Append (model, student) embedding runs to their models' files.
+        Returns (model, roll_number, embedding_row, sample_count) rows; the
+        caller holds the lock.
+        """
+        runs = {}
+        for model, student in versions:
+            run = np.asarray([student["embedding"], *(student.get("samples") or [])], dtype=np.float32)
+            runs.setdefault(model, []).append((student["roll_number"], run))
+
+        records = []
+        for model, model_runs in runs.items():
+            first_rows = self._file(model, model_runs[0][1].shape[1]).append([run for _, run in model_runs])
+            records.extend(
+                (model, roll_number, row, len(run) - 1) for (roll_number, run), row in zip(model_runs, first_rows)
+            )
+        return records
+
+    def set_sections(self, roll_number, sections):
+        with self._lock, self._conn:
+            self._replace_sections(roll_number, sections)
+
+    def _replace_sections(self, roll_number, sections):
+        """The caller holds the lock and an open transaction."""
+        self._conn.execute("DELETE FROM student_sections WHERE roll_number = ?", (roll_number,))
+        self._conn.executemany(
+            "INSERT INTO student_sections (roll_number, section) VALUES (?, ?)",
+            [(roll_number, section) for section in set(sections)],
+        )
+
+    def delete_student(self, roll_number):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM students WHERE roll_number = ?", (roll_number,))
+            self._conn.execute("DELETE FROM student_embeddings WHERE roll_number = ?", (roll_number,))
+            self._conn.execute("DELETE FROM student_sections WHERE roll_number = ?", (roll_number,))
+
+    def active_embedding(self):
+        """The active version as {"model", "distance_metric"}, or None if never set."""
+        with self._lock:
+            meta = dict(
+                self._conn.execute(
+                    "SELECT key, value FROM meta WHERE key IN ('active_model', 'active_distance_metric')"
+                )
+            )
+        if "active_model" not in meta:
+            return None
+        return {"model": meta["active_model"], "distance_metric": meta["active_distance_metric"]}
+
+    def set_active_embedding(self, model, distance_metric):
+        """Switch the active version in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("active_model", model), ("active_distance_metric", distance_metric)],
+            )
+
+    def add_result(self, document):
+        """Save a result, its roll-number index rows and counter updates in one transaction."""
+        self.add_results([document])
+
+    def add_results(self, documents):
+        """Save several results in one transaction; a document's `timeStamp` overrides the current time."""
+        now = datetime.now(timezone.utc)
+        with self._lock, self._conn:
+            for document in documents:
+                time_stamp = _timestamp(document.get("timeStamp") or now)
+                summary = {key: value for key, value in document.items() if key in RESULT_SUMMARY_FIELDS}
+                summary.pop("timeStamp", None)
+                detail = {
+                    key: value
+                    for key, value in document.items()
+                    if key not in RESULT_SUMMARY_FIELDS and key != "faces"
+                }
+                roll_numbers = sorted(set(document.get("matched_roll_numbers") or []))
+
+                result_id = self._conn.execute(
+                    "INSERT INTO results (time_stamp, document, faces, detail) VALUES (?, ?, ?, ?)",
+                    (time_stamp, json.dumps(summary), json.dumps(document.get("faces", [])), json.dumps(detail)),
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT INTO result_students (result_id, roll_number) VALUES (?, ?)",
+                    [(result_id, roll_number) for roll_number in roll_numbers],
+                )
+                self._conn.executemany(
+                    """
+                    INSERT INTO attendance_counts (roll_number, count, last_seen) VALUES (?, 1, ?)
+                    ON CONFLICT (roll_number) DO UPDATE SET
+                        count = count + 1, last_seen = max(last_seen, excluded.last_seen)
+                    """,
+                    [(roll_number, time_stamp) for roll_number in roll_numbers],
+                )
+
+    def list_results(self, limit=50, cursor=None, start=None, end=None, roll_number=None, detail=False):
+        """
+        One page of results, newest first; same contract as FirestoreStore.list_results.
+        Ordered by timeStamp, then row ID: results replayed from a spill log
+        keep their time but are inserted later. The cursor is the last row ID
+        seen, and the page after it starts from that row's position.
+        """
+        clauses, params = [], []
+        if cursor:
+            try:
+                cursor_id = int(cursor)
+            except ValueError:
+                raise ValueError("Invalid cursor") from None
+            with self._lock:
+                record = self._conn.execute("SELECT time_stamp FROM results WHERE id = ?", (cursor_id,)).fetchone()
+            if record is None:
+                raise ValueError("Invalid cursor")
+            clauses.append("(r.time_stamp < ? OR (r.time_stamp = ? AND r.id < ?))")
+            params.extend([record[0], record[0], cursor_id])
+        if start is not None:
+            clauses.append("r.time_stamp >= ?")
+            params.append(_timestamp(start))
+        if end is not None:
+            clauses.append("r.time_stamp < ?")
+            params.append(_timestamp(end))
+        join = ""
+        if roll_number is not None:
+            join = "JOIN result_students s ON s.result_id = r.id AND s.roll_number = ?"
+            params.insert(0, roll_number)
+
+        columns = "r.faces, r.detail" if detail else "NULL, NULL"
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            records = self._conn.execute(
+                f"SELECT r.id, r.time_stamp, r.document, {columns} FROM results r {join} {where} "
+                "ORDER BY r.time_stamp DESC, r.id DESC LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+
+        results = []
+        for result_id, time_stamp, document, result_faces, result_detail in records[:limit]:
+            document = json.loads(document)
+            if detail:
+                # Rows saved before the detail column kept every field but faces in `document`
+                document.update(json.loads(result_detail or "{}"), faces=json.loads(result_faces))
+            else:
+                document = {key: value for key, value in document.items() if key in RESULT_SUMMARY_FIELDS}
+            results.append({"id": str(result_id), "timeStamp": datetime.fromisoformat(time_stamp), **document})
+        next_cursor = str(records[limit - 1][0]) if len(records) > limit else None
+        return results, next_cursor
+
+    def attendance_counts(self, roll_number=None):
+        query = "SELECT roll_number, count, last_seen FROM attendance_counts"
+        params = ()
+        if roll_number is not None:
+            query += " WHERE roll_number = ?"
+            params = (roll_number,)
+        with self._lock:
+            records = self._conn.execute(query + " ORDER BY roll_number", params).fetchall()
+        return [
+            {"roll_number": roll, "count": count, "last_seen": datetime.fromisoformat(last_seen)}
+            for roll, count, last_seen in records
+        ]
+
+    def rebuild_attendance_counts(self):
+        """Recount attendance from the roll-number index."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM attendance_counts")
+            self._conn.execute(
+                """
+                INSERT INTO attendance_counts (roll_number, count, last_seen)
+                SELECT s.roll_number, COUNT(*), MAX(r.time_stamp)
+                FROM result_students s JOIN results r ON r.id = s.result_id
+                GROUP BY s.roll_number
+                """
+            )
+            return self._conn.execute("SELECT COUNT(*) FROM attendance_counts").fetchone()[0]
+
+
+def _timestamp(value):
+    """Fixed-width UTC ISO 8601 text, so SQLite string order is time order."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
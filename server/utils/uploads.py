@@ -0,0 +1,144 @@
+"""
+Bounded reading of uploaded images.
+Werkzeug already spools large multipart files to a temporary file and Flask's
+MAX_CONTENT_LENGTH caps the whole request; here each image's size, format
+and pixel dimensions are checked from the spool and its first bytes before
+the body is read into memory or decoded. JPEG dimensions that come after
+more metadata than the first bytes hold are checked once the body is read,
+still before decoding.
+"""
+
+from utils.deepface import read_image_size
+
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+# Above what any phone camera produces; a small JPEG can still claim a
+# frame that would take gigabytes to decode
+MAX_IMAGE_PIXELS = 120_000_000
+HEADER_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+
+# Formats cv2.imdecode reads, by magic bytes
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+
+class UploadError(Exception):
+    """An upload rejected before decoding; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_format(head):
+    """Image format from the first bytes of a file, or None if not a supported image."""
+    head = bytes(head[:16])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, name in _SIGNATURES:
+        if head.startswith(signature):
+            return name
+    return None
+
+
+def check_image_header(head, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Validate an image from its first bytes. Dimensions are only known for
+    JPEG and PNG, and for JPEG only if its frame header is within `head`;
+    other formats are left to the decoder.
+    Returns (format, (width, height) or None); raises UploadError.
+    """
+    if not head:
+        raise UploadError("Empty image file")
+    image_format = sniff_format(head)
+    if image_format is None:
+        raise UploadError("Unsupported image format; upload a JPEG, PNG, WebP, BMP or TIFF image", 415)
+
+    size = read_image_size(head) if image_format in ("jpeg", "png") else None
+    if size is not None:
+        check_image_size(size, max_pixels)
+    return image_format, size
+
+
+def check_image_size(size, max_pixels=MAX_IMAGE_PIXELS):
+    """Reject a (width, height) that is empty or above `max_pixels`; raises UploadError."""
+    width, height = size
+    if width == 0 or height == 0:
+        raise UploadError("Malformed image header")
+    if width * height > max_pixels:
+        raise UploadError(
+            f"Image is {width}x{height}; at most {max_pixels // 1_000_000} megapixels are accepted", 413
+        )
+
+
+def read_image_upload(upload, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Validate and read one uploaded image (a werkzeug FileStorage).
+    Oversized and non-image uploads are rejected before their body is
+    read, decompression bombs before it is decoded. Returns the bytes as a
+    bytearray, read into a buffer of the final size; np.frombuffer and
+    cv2.imdecode use it without another copy, and it pickles for the
+    worker queue. Raises UploadError.
+    """
+    stream = upload.stream
+    size = _remaining(stream)
+    if size is not None and size > max_bytes:
+        raise UploadError(f"Image is larger than {max_bytes // 2**20} MB", 413)
+
+    head = stream.read(HEADER_BYTES)
+    image_format, dimensions = check_image_header(head, max_pixels)
+    data = _read_body(stream, head, size, max_bytes)
+
+    if image_format in ("jpeg", "png") and dimensions is None:
+        # The frame header came after large EXIF or other APP segments
+        dimensions = read_image_size(data)
+        if dimensions is None:
+            raise UploadError("Malformed image header")
+        check_image_size(dimensions, max_pixels)
+    return data
+
+
+def _read_body(stream, head, size, max_bytes):
+    """The whole upload, `head` included, in a buffer of its final size when that is known."""
+    readinto = getattr(stream, "readinto", None)
+    if size is None or readinto is None:
+        return _read_chunks(stream, bytearray(head), max_bytes)
+
+    data = bytearray(size)
+    view = memoryview(data)
+    view[:len(head)] = head
+    filled = len(head)
+    while filled < size:
+        count = readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    view.release()
+    del data[filled:]
+    return data
+
+
+def _remaining(stream):
+    """Bytes left in a seekable stream, or None if it cannot tell."""
+    try:
+        position = stream.tell()
+        end = stream.seek(0, 2)
+        stream.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return end - position
+
+
+def _read_chunks(stream, data, max_bytes):
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            return data
+        if len(data) + len(chunk) > max_bytes:
+            raise UploadError(f"Image is larger than {max_bytes // 2**20} MB", 413)
+        data += chunk
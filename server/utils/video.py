@@ -0,0 +1,332 @@
+"""
+Attendance from a video clip or live camera stream.
+Faces are tracked across frames so each person is embedded only a few
+times, at their best frames, instead of running ArcFace on every frame.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+# ==================== Frames ====================
+
+def iter_frames(source, sample_fps=2.0, max_seconds=None):
+    """
+    Yield (seconds, frame) from a video file, stream URL or webcam index,
+    keeping about `sample_fps` frames per second. Skipped frames are only
+    grabbed, not decoded.
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    fps = fps if fps and fps > 0 else 25.0
+    step = max(1, round(fps / sample_fps))
+
+    try:
+        index = 0
+        while True:
+            if index % step == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                seconds = index / fps
+                if max_seconds is not None and seconds > max_seconds:
+                    return
+                yield seconds, frame
+            elif not capture.grab():
+                return
+            index += 1
+    finally:
+        capture.release()
+
+
+# ==================== Tracking ====================
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ix = max(0.0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One face followed across frames, with its identity votes."""
+
+    def __init__(self, track_id, box, seconds):
+        self.id = track_id
+        self.box = box
+        self.hits = 0
+        self.first_seen = seconds
+        self.last_seen = seconds
+        # Best frame since the last embedding
+        self.best_quality = 0.0
+        self.best_face = None
+        self.embeddings = 0
+        self.votes = {}
+        self.names = {}
+        self.identity = None
+
+
+class FaceTracker:
+    """
+    Greedy IoU association between detections and tracks. Between detection
+    frames, boxes are carried forward with Lucas-Kanade optical flow on
+    corner features inside each box. Only detections keep a track alive:
+    flow also locks onto a static background once the person has left.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=2.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = {}
+        self._next_id = 1
+        self._prev_gray = None
+
+    def update(self, detections, seconds, gray):
+        """Match detections to tracks. Returns [(track, detection)] for this frame."""
+        pairs = []
+        for track in self.tracks.values():
+            for index, detection in enumerate(detections):
+                overlap = iou(track.box, _box(detection))
+                if overlap >= self.iou_threshold:
+                    pairs.append((overlap, track.id, index))
+
+        matched = []
+        used_tracks, used_detections = set(), set()
+        for _, track_id, index in sorted(pairs, reverse=True):
+            if track_id in used_tracks or index in used_detections:
+                continue
+            used_tracks.add(track_id)
+            used_detections.add(index)
+            matched.append((self.tracks[track_id], detections[index]))
+
+        for index, detection in enumerate(detections):
+            if index not in used_detections:
+                track = Track(self._next_id, _box(detection), seconds)
+                self.tracks[track.id] = track
+                self._next_id += 1
+                matched.append((track, detection))
+
+        for track, detection in matched:
+            track.box = _box(detection)
+            track.hits += 1
+            track.last_seen = seconds
+
+        self._prev_gray = gray
+        return matched
+
+    def propagate(self, seconds, gray):
+        """Move every live track with optical flow from the previous frame; `last_seen` is left as is."""
+        if self._prev_gray is not None:
+            for track in self.tracks.values():
+                shift = _flow_shift(self._prev_gray, gray, track.box)
+                if shift is not None:
+                    x, y, w, h = track.box
+                    track.box = (x + shift[0], y + shift[1], w, h)
+        self._prev_gray = gray
+
+    def expire(self, seconds):
+        """Drop and return tracks not seen for `max_age` seconds."""
+        expired = [t for t in self.tracks.values() if seconds - t.last_seen > self.max_age]
+        for track in expired:
+            del self.tracks[track.id]
+        return expired
+
+
+def _box(detection):
+    area = detection["facial_area"]
+    return (float(area["x"]), float(area["y"]), float(area["w"]), float(area["h"]))
+
+
+def _flow_shift(prev_gray, gray, box):
+    """Median displacement of trackable points inside `box`, or None if lost."""
+    x, y, w, h = (int(round(v)) for v in box)
+    x, y = max(x, 0), max(y, 0)
+    mask = np.zeros_like(prev_gray)
+    mask[y:y + h, x:x + w] = 255
+    points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+    if points is None:
+        return None
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None)
+    good = status.ravel() == 1
+    if good.sum() < 3:
+        return None
+    return np.median((moved[good] - points[good]).reshape(-1, 2), axis=0)
+
+
+def face_quality(detection):
+    """Detector confidence weighted by face size; bigger, surer faces embed better."""
+    area = detection["facial_area"]
+    return float(detection.get("confidence") or 0) * min(area["w"], area["h"])
+
+
+# ==================== Attendance ====================
+
+class VideoAttendance:
+    """
+    Streaming attendance over sampled frames.
+
+    Faces are detected every `detect_every` sampled frames and tracked in
+    between. A track is first embedded once it has been detected `min_hits`
+    times, then every `reembed_every` detections, at most `max_embeddings`
+    times; each time the best frame since the previous embedding is used.
+    Each embedding votes for its verified match; a track takes the identity
+    with most votes once it has `min_votes` and a majority. A track that is
+    lost, or still in view when the clip ends, before reaching `min_votes`
+    still counts if its votes are unanimous.
+
+    Args:
+        detect: frame -> list of detections (facial_area, confidence, face)
+        embed: list of face crops -> (N, D) embeddings
+        match: (N, D) embeddings -> per-face match lists, closest first
+    """
+
+    def __init__(
+        self,
+        detect,
+        embed,
+        match,
+        detect_every=3,
+        min_hits=2,
+        reembed_every=2,
+        max_embeddings=3,
+        min_votes=2,
+        absent_after=10.0,
+    ):
+        self.detect = detect
+        self.embed = embed
+        self.match = match
+        self.detect_every = detect_every
+        self.min_hits = min_hits
+        self.reembed_every = reembed_every
+        self.max_embeddings = max_embeddings
+        self.min_votes = min_votes
+        self.absent_after = absent_after
+        self.stats = {"frames": 0, "detections": 0, "embeddings": 0}
+
+    def run(self, frames, roster=None):
+        """
+        Consume (seconds, frame) pairs and yield events as they happen:
+        present (a student was identified), absent (not seen for
+        `absent_after` seconds) and a final summary. `roster` lists the roll
+        numbers expected, to report who never appeared.
+        """
+        tracker = FaceTracker(max_age=max(2.0, self.absent_after / 2))
+        present = {}  # roll number -> {"name", "last_seen", "track_ids"}
+        seconds = 0.0
+        started = time.perf_counter()
+
+        for index, (seconds, frame) in enumerate(frames):
+            self.stats["frames"] += 1
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            if index % self.detect_every == 0:
+                detections = [d for d in self.detect(frame) if d.get("confidence", 0) > 0]
+                self.stats["detections"] += len(detections)
+                for track, detection in tracker.update(detections, seconds, gray):
+                    quality = face_quality(detection)
+                    if quality > track.best_quality:
+                        track.best_quality, track.best_face = quality, detection["face"]
+                yield from self._embed_ready(tracker.tracks.values(), present, seconds)
+            else:
+                tracker.propagate(seconds, gray)
+
+            for track in tracker.expire(seconds):
+                yield from self._resolve(track, present, seconds)
+                if track.identity in present:
+                    present[track.identity]["track_ids"].discard(track.id)
+
+            for roll_number, state in present.items():
+                gone = seconds - state["last_seen"]
+                if state["present"] and not state["track_ids"] and gone > self.absent_after:
+                    state["present"] = False
+                    yield {"type": "absent", "roll_number": roll_number, "name": state["name"], "seconds": seconds}
+
+            for state in present.values():
+                if state["track_ids"]:
+                    state["last_seen"] = seconds
+
+        # Tracks still in view when the clip ends get the same fallback as lost ones
+        for track in list(tracker.tracks.values()):
+            yield from self._resolve(track, present, seconds)
+
+        seen = set(present)
+        yield {
+            "type": "summary",
+            "present": sorted(seen),
+            "absent": sorted(set(roster) - seen) if roster is not None else None,
+            "seconds": seconds,
+            "elapsed": time.perf_counter() - started,
+            **self.stats,
+        }
+
+    def _embed_ready(self, tracks, present, seconds):
+        """Embed, in one batch, the best recent frame of every track that is due."""
+        ready = [
+            track
+            for track in tracks
+            if track.embeddings < self.max_embeddings
+            and track.best_face is not None
+            and track.hits >= self.min_hits + track.embeddings * self.reembed_every
+        ]
+        if not ready:
+            return
+
+        embeddings = self.embed([track.best_face for track in ready])
+        self.stats["embeddings"] += len(ready)
+
+        for track, matches in zip(ready, self.match(embeddings)):
+            track.embeddings += 1
+            track.best_quality, track.best_face = 0.0, None
+            if matches and matches[0]["verified"]:
+                roll_number = matches[0]["roll_number"]
+                track.votes[roll_number] = track.votes.get(roll_number, 0) + 1
+                track.names[roll_number] = matches[0]["name"]
+
+            identity = self._vote(track)
+            if identity is not None and identity != track.identity:
+                yield from self._identify(track, identity, present, seconds)
+
+    def _resolve(self, track, present, seconds):
+        """Identify a track that ends before reaching `min_votes`, if its votes are unanimous."""
+        if track.identity is None:
+            identity = self._vote(track, min_votes=1)
+            if identity is not None and len(track.votes) == 1:
+                yield from self._identify(track, identity, present, seconds)
+
+    def _identify(self, track, identity, present, seconds):
+        """Assign a track's identity; yields a present event on a student's (re)appearance."""
+        if track.identity in present:
+            present[track.identity]["track_ids"].discard(track.id)
+        track.identity = identity
+
+        state = present.setdefault(
+            identity, {"name": track.names[identity], "present": False, "last_seen": seconds, "track_ids": set()}
+        )
+        state["track_ids"].add(track.id)
+        state["last_seen"] = seconds
+        if not state["present"]:
+            state["present"] = True
+            yield {
+                "type": "present",
+                "roll_number": identity,
+                "name": state["name"],
+                "track_id": track.id,
+                "seconds": seconds,
+            }
+
+    def _vote(self, track, min_votes=None):
+        """Majority identity of a track, once it has enough votes."""
+        if not track.votes:
+            return None
+        min_votes = min(self.min_votes if min_votes is None else min_votes, self.max_embeddings)
+        roll_number, votes = max(track.votes.items(), key=lambda item: item[1])
+        if votes >= min_votes and votes * 2 > track.embeddings:
+            return roll_number
+        return None
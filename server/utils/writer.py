@@ -0,0 +1,342 @@
+"""
+Background persistence of analysis results.
+Routes hand their result document to a ResultWriter and answer as soon as
+matching is done; a writer thread commits documents to the store in
+batches, retrying with backoff while the store is unreachable. Every
+document is first appended to a spill log on disk, so results accepted
+before a crash or restart are written once the server is back. Appends
+reach the OS at once, which a process crash cannot lose; the writer thread
+fsyncs them, so a power cut loses at most about `flush_interval` seconds.
+Once entries are committed the log is truncated, or rewritten with only
+the pending ones when it has grown, so it stays small under sustained load.
+
+Each process spills to its own results-<pid>.jsonl in the spill directory,
+so gunicorn workers never share a log. On start, a writer takes over the
+logs of processes that are no longer running. Delivery is at least once: a
+batch committed just before a crash is written again on replay, which
+POST /api/attendance/rebuild corrects in the attendance counters.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# results-<pid>.jsonl, or results-<pid>.jsonl.replay-<pid> while being replayed
+SPILL_NAME = re.compile(r"^results-(\d+)\.jsonl(?:\.replay-(\d+))?$")
+# Rewritten log of pending documents, left behind if a process died while compacting
+COMPACT_NAME = re.compile(r"^results-(\d+)\.jsonl\.compact$")
+
+
+# ==================== Compact Payload ====================
+
+def compact_result(document, top_k=3, digits=4):
+    """
+    The stored form of a result document: each face keeps its box, its
+    assignment and only its `top_k` closest students, with distances and
+    margins rounded to `digits` places; skipped faces keep their box and
+    reason. The API response is not affected.
+    """
+    faces = []
+    for face in document.get("faces") or []:
+        faces.append(
+            {
+                **face,
+                "face_box": _compact_box(face.get("face_box")),
+                "best_match": _round_match(face.get("best_match"), digits),
+                "top_matches": [_round_match(match, digits) for match in (face.get("top_matches") or [])[:top_k]],
+                "assignment_margin": _round(face.get("assignment_margin"), digits),
+            }
+        )
+    compact = {**document, "faces": faces}
+    if "skipped_faces" in document:
+        compact["skipped_faces"] = [
+            {**face, "face_box": _compact_box(face.get("face_box"))} for face in document["skipped_faces"]
+        ]
+    return compact
+
+
+def _compact_box(box):
+    box = box or {}
+    return {key: box[key] for key in ("x", "y", "w", "h") if key in box}
+
+
+def _round_match(match, digits):
+    if match is None:
+        return None
+    return {**match, "distance": _round(match.get("distance"), digits)}
+
+
+def _round(value, digits):
+    return None if value is None else round(float(value), digits)
+
+
+# ==================== Writer ====================
+
+class ResultWriter:
+    """
+    Batched, retried, crash-safe result writes.
+
+    Args:
+        store: Anything with add_results(documents), e.g. a FirestoreStore
+        spill_dir: Directory for the logs of accepted documents and
+            committed IDs; None keeps them in memory only
+        batch_size: Documents per commit
+        flush_interval: Seconds to wait for more documents before a partial batch
+        max_backoff: Cap, in seconds, on the delay between retries
+        compact_bytes: Spill log size above which it is rewritten with only
+            the pending documents after a commit
+    """
+
+    def __init__(
+        self, store, spill_dir=None, batch_size=50, flush_interval=0.5, max_backoff=60.0, compact_bytes=8 * 2**20
+    ):
+        self.store = store
+        self.spill_dir = spill_dir
+        self.spill_path = None  # Chosen in start(), once the process is final
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = {}  # id -> document, in arrival order
+        self._next_id = 0
+        self._spill = None
+        self._unsynced = False
+        self._compacted_bytes = 0  # Log size right after the last rewrite
+        self._thread = None
+        self._stopping = False
+        self.counters = {"written": 0, "batches": 0, "failures": 0, "replayed": 0}
+        self.last_error = None
+
+    def start(self):
+        """
+        Re-queue documents left in this process's spill log and in those of
+        dead processes, then start the writer thread. Call it after forking.
+        Returns self.
+        """
+        with self._lock:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self.spill_path = os.path.join(self.spill_dir, f"results-{os.getpid()}.jsonl")
+                self._replay()
+            self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def put(self, document):
+        """
+        Accept a result for writing. Its `timeStamp` is set to now unless
+        present, so it records when the analysis happened, not the commit.
+        Returns the document's ID within this writer.
+        """
+        document = {"timeStamp": datetime.now(timezone.utc), **document}
+        with self._lock:
+            doc_id = self._next_id
+            self._next_id += 1
+            self._log({"id": doc_id, "document": _encode(document)})
+            self._pending[doc_id] = document
+            self._changed.notify()
+        return doc_id
+
+    def flush(self, timeout=None):
+        """Wait until every accepted document is committed; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    def close(self, timeout=10.0):
+        """Flush what can be written within `timeout`, then stop; the rest stays in the spill log."""
+        self.flush(timeout)
+        with self._lock:
+            self._stopping = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._sync()
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": len(self._pending), "last_error": self.last_error}
+
+    # ---------- Internal ----------
+
+    def _run(self):
+        attempt = 0
+        while True:
+            with self._lock:
+                if len(self._pending) < self.batch_size and not self._stopping:
+                    self._changed.wait(self.flush_interval)
+                while not self._pending and not self._stopping:
+                    self._changed.wait()
+                if self._stopping:
+                    return
+                batch = list(self._pending.items())[: self.batch_size]
+
+            self._sync()
+            try:
+                self.store.add_results([document for _, document in batch])
+            except Exception as e:
+                attempt += 1
+                delay = min(self.max_backoff, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                with self._lock:
+                    self.counters["failures"] += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning("result write failed (attempt %d), retrying in %.1fs: %s", attempt, delay, e)
+                deadline = time.monotonic() + delay
+                while time.monotonic() < deadline:
+                    with self._lock:
+                        wait = min(self.flush_interval, deadline - time.monotonic())
+                        if self._changed.wait_for(lambda: self._stopping, timeout=max(wait, 0)):
+                            break
+                    # Documents accepted meanwhile still reach the disk
+                    self._sync()
+                continue
+
+            attempt = 0
+            with self._lock:
+                for doc_id, _ in batch:
+                    del self._pending[doc_id]
+                self._log({"done": [doc_id for doc_id, _ in batch]})
+                self.counters["written"] += len(batch)
+                self.counters["batches"] += 1
+                if not self._pending:
+                    self._truncate()
+                elif self._spill is not None and self._spill.tell() > max(
+                    self.compact_bytes, 2 * self._compacted_bytes
+                ):
+                    self._compact()
+                self._changed.notify_all()
+
+    def _log(self, record):
+        """Append one record to the spill log; the caller holds the lock."""
+        if not self.spill_path:
+            return
+        if self._spill is None:
+            self._spill = open(self.spill_path, "a", encoding="utf-8")
+        self._spill.write(json.dumps(record) + "\n")
+        self._spill.flush()
+        self._unsynced = True
+
+    def _sync(self):
+        """fsync records appended since the last call; runs in the writer thread, without the lock."""
+        with self._lock:
+            if self._spill is None or not self._unsynced:
+                return
+            self._unsynced = False
+            fd = self._spill.fileno()
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass  # Closed or replaced meanwhile; its records were synced there
+
+    def _truncate(self):
+        """Everything is committed, so the log can start over; the caller holds the lock."""
+        if self._spill is not None:
+            self._spill.truncate(0)
+            self._spill.seek(0)
+            self._compacted_bytes = 0
+
+    def _compact(self):
+        """Replace the log with one holding only the pending documents; the caller holds the lock."""
+        compacted = f"{self.spill_path}.compact"
+        with open(compacted, "w", encoding="utf-8") as f:
+            for doc_id, document in self._pending.items():
+                f.write(json.dumps({"id": doc_id, "document": _encode(document)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._spill.close()
+        os.replace(compacted, self.spill_path)
+        self._spill = open(self.spill_path, "a", encoding="utf-8")
+        self._compacted_bytes = self._spill.tell()
+        self._unsynced = False
+
+    def _replay(self):
+        """Load documents that were logged but never committed; the caller holds the lock."""
+        replayed = 0
+        for filename in sorted(os.listdir(self.spill_dir)):
+            leftover = COMPACT_NAME.match(filename)
+            if leftover is not None and not _pid_alive(int(leftover.group(1))):
+                # The log it was to replace is still complete
+                os.remove(os.path.join(self.spill_dir, filename))
+                continue
+            match = SPILL_NAME.match(filename)
+            if match is None:
+                continue
+            pid = int(match.group(2) or match.group(1))
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            # Renaming claims the log; of two writers starting at once, one wins
+            claimed = os.path.join(self.spill_dir, f"results-{match.group(1)}.jsonl.replay-{os.getpid()}")
+            try:
+                os.rename(os.path.join(self.spill_dir, filename), claimed)
+            except OSError:
+                continue
+            for document in _read_spill(claimed):
+                doc_id = self._next_id
+                self._next_id += 1
+                self._log({"id": doc_id, "document": _encode(document)})
+                self._pending[doc_id] = document
+                replayed += 1
+            os.remove(claimed)
+
+        if self._spill is not None:
+            os.fsync(self._spill.fileno())
+            self._unsynced = False
+        self.counters["replayed"] += replayed
+        if replayed:
+            logger.warning("re-queued %d result(s) from %s", replayed, self.spill_dir)
+
+
+def _read_spill(path):
+    """Documents in a spill log without a matching commit record, in order."""
+    pending = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn last line from a crash mid-write
+            if "done" in record:
+                for doc_id in record["done"]:
+                    pending.pop(doc_id, None)
+            else:
+                pending[record["id"]] = _decode(record["document"])
+    return list(pending.values())
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        return False  # Single process there; signal 0 would not be a probe
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _encode(document):
+    return {**document, "timeStamp": document["timeStamp"].isoformat()}
+
+
+def _decode(document):
+    return {**document, "timeStamp": datetime.fromisoformat(document["timeStamp"])}